@@ -740,6 +740,15 @@ def controller():
             else:
                 selections['target_port'] = ''
             
+            # 会话数决定进程池和线程数，限制在 1..MAX_SESSIONS
+            if selections.get('sessions') not in (None, ''):
+                try:
+                    selections['sessions'] = int(selections['sessions'])
+                except (TypeError, ValueError):
+                    return jsonify({'error': '会话数必须是整数'}), 400
+                if not 1 <= selections['sessions'] <= fsm_explan.MAX_SESSIONS:
+                    return jsonify({'error': f'会话数必须在 1 到 {fsm_explan.MAX_SESSIONS} 之间'}), 400
+            
             # 根据 xml_file 确定协议类型
             protocol_type = XML_TYPE.replace('.xml','')##########
             
@@ -767,6 +776,63 @@ def controller():
             logger.error(traceback.format_exc())
             return jsonify({'error': str(e)}), 500
 
+    # 查询当前 IR 的状态机覆盖率（测试进行中也可查询）
+    elif command == "coverage":
+        protocol_type = fsm_explan.PROTOCOL_TYPE.get(XML_TYPE)
+        coverage = fsm_explan.get_coverage(protocol_type) if protocol_type else fsm_explan.get_coverage()
+        return jsonify({'status': 'success', 'protocol_type': protocol_type, 'coverage': coverage})
+
+    # 按种子和决策序列离线重放一次测试，重新生成当时发送的报文（不连接目标）
+    elif command == "replay":
+        params = (request.get_json() or {}) if request.is_json else request.form
+        # 路径来自请求，只接受 outpcap 目录下的文件
+        if params.get('trace_file'):
+            trace_file = fsm_explan.resolve_run_file(params.get('trace_file'))
+        else:
+            pcap_file = fsm_explan.resolve_run_file(params.get('pcap_path'))
+            trace_file = fsm_explan.resolve_run_file(fsm_explan.find_trace(pcap_file, params.get('session_id'))) if pcap_file else None
+        if not trace_file or not os.path.exists(trace_file):
+            return jsonify({'error': '找不到重放记录（trace_file 或 pcap_path/session_id，须位于 outpcap 目录下）'}), 400
+        try:
+            pcap_path = fsm_explan.replay_trace(trace_file)
+            return jsonify({
+                'status': 'success',
+                'pcap_path': pcap_path,
+                'trace_file': trace_file,
+                'packets': ret_pcap_info(pcap_path)
+            })
+        except Exception as e:
+            logger.error(f'重放错误: {str(e)}')
+            return jsonify({'error': str(e)}), 500
+
+    # 对保存的崩溃/挂起记录做 ddmin 最小化；target 为 host:port 时改在本地替身上复现。
+    # 最小化可能持续数小时，在后台任务中进行：首次调用启动任务，之后用同一 crash_file 查询进度和结果，restart 为真时重新执行
+    elif command == "minimize":
+        params = (request.get_json() or {}) if request.is_json else request.form
+        # 路径来自请求，只接受崩溃记录目录下的文件；结果另存为 .min.json，不覆盖原记录
+        crash_file = fsm_explan.resolve_run_file(params.get('crash_file'), fsm_explan.CRASH_DIR)
+        if not crash_file or not os.path.exists(crash_file):
+            return jsonify({'error': f'找不到崩溃记录 crash_file（须位于 {fsm_explan.CRASH_DIR} 目录下）'}), 400
+        try:
+            restart = str(params.get('restart', '')).lower() in ('1', 'true', 'yes', 'on')
+            job = fsm_explan.start_minimize_job(crash_file, target=params.get('target'), restart=restart)
+            if job['status'] != 'done':
+                return jsonify({'status': job['status'], 'job': job}), 500 if job['status'] == 'failed' else 202
+            with open(job['record_file']) as f:
+                record = json.load(f)
+            return jsonify({
+                'status': 'success',
+                'job': job,
+                'reproduced': job['reproduced'],
+                'minimized': record.get('minimized'),
+                'minimization': record.get('minimization'),
+                'record_file': job['record_file'],
+                'pcap_path': record.get('minimized_pcap')
+            })
+        except Exception as e:
+            logger.error(f'最小化错误: {str(e)}')
+            return jsonify({'error': str(e)}), 500
+
     # 4. PROCESS_XML命令
     elif command == "PROCESS_XML":
         try:
@@ -1,17 +1,41 @@
+import asyncio
+import atexit
 import random
 import socket
 import select
 import xml.etree.ElementTree as ET
 import threading
+import queue
 import logging
 import time
 import os
 import struct
+import sys
+import array
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import heapq
+import json
+import multiprocessing
+import shlex
+import sqlite3
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import netifaces
-import pyshark
 from scapy.all import IP, TCP, UDP, Raw, RawPcapWriter, Ether
 import uuid
 import serial
+try:
+    import pyshark  # 仅用于可选的慢速解析回退路径
+except ImportError:
+    pyshark = None
+try:
+    import numpy as np  # 批量生成时向量化抽取随机字段
+except ImportError:
+    np = None
 
 # 全局日志配置
 logging.basicConfig(
@@ -31,10 +55,13 @@ GLOBAL_PARSER_CACHE = {
     "state_machine": None,
     "client_messages": None,
     "server_messages": None,
+    "encoder_plans": {},
+    "classifier": None,
     "last_xml_file": None
 }
 GLOBAL_MANDATORY_FIELDS = {}
 GLOBAL_RANDOM_FIELDS = {}
+GLOBAL_RANDOM_FIELD_INDEX = {}
 GLOBAL_PARSER_LOCK = threading.Lock()
 
 # 伪装 IP 和 MAC 地址
@@ -57,6 +84,8 @@ class ProtoIRParser:
         self.state_machine = {}
         self.client_messages = set()
         self.server_messages = set()
+        self.random_field_index = {}
+        self.shortest_paths = {}
         self.parse()
 
     def parse(self):
@@ -73,6 +102,7 @@ class ProtoIRParser:
                 raise ValueError("No statemachine found")
             self.state_machine = self.parse_statemachine(sm_elem)
             self.infer_message_roles()
+            self.shortest_paths = self.compute_shortest_paths()
             if not self.client_messages:
                 logger.warning("No client messages inferred")
                 self.client_messages = set(self.messages.keys())
@@ -155,6 +185,22 @@ class ProtoIRParser:
             }
         return states
 
+    def compute_shortest_paths(self):
+        """对每个状态做一次 BFS（转移无权重），返回 {起点: {终点: 途经状态列表}}，列表不含起点、以终点结尾"""
+        paths = {}
+        for source in self.state_machine:
+            found = {source: []}
+            queue = deque([source])
+            while queue:
+                state = queue.popleft()
+                for transition in self.state_machine.get(state, {}).get('transitions', []):
+                    next_state = transition['next_state']
+                    if next_state not in found:
+                        found[next_state] = found[state] + [next_state]
+                        queue.append(next_state)
+            paths[source] = found
+        return paths
+
     def infer_message_roles(self):
         self.client_messages = set()
         self.server_messages = set()
@@ -190,6 +236,7 @@ class ProtoIRParser:
             }
         }
         random_fields = {}
+        random_field_index = {}
 
         def process_fields(fields, msg_name, prefix=""):
             for field in fields:
@@ -213,6 +260,7 @@ class ProtoIRParser:
                             random_fields[field_name] = {'range': range_str, 'type': field_type, 'encoding': encoding}
                         else:
                             random_fields[field_name] = {'value': value, 'type': field_type, 'encoding': encoding}
+                        random_field_index.setdefault(msg_name, {})[field_name] = self.index_random_field(random_fields[field_name], field)
                 elif field['kind'] == 'field':
                     process_fields(field['subfields'], msg_name, f"{field_role}_")
 
@@ -222,12 +270,36 @@ class ProtoIRParser:
                 continue
             process_fields(msg['fields'], msg_name)
 
+        # 按报文建立随机字段索引，生成报文时无需再按前缀扫描全部随机字段
+        self.random_field_index = {msg_name: list(fields.items()) for msg_name, fields in random_field_index.items()}
         logger.info(f"Identified mandatory fields: {mandatory_fields}")
         logger.info(f"Identified randomizable fields: {list(random_fields.keys())}")
         return mandatory_fields, random_fields
 
+    def index_random_field(self, field_info, field):
+        """预先解析随机字段的取值范围和字节长度"""
+        entry = dict(field_info)
+        entry['bounds'] = None
+        entry['byte_length'] = None
+        range_str = field_info.get('range')
+        if range_str:
+            try:
+                base = 16 if field_info['type'] == 'B' else 2
+                min_val, max_val = (int(x, base) for x in range_str.split('-'))
+                entry['bounds'] = (min_val, max_val)
+            except ValueError as e:
+                # 形如 test-client-id 的字符串取值不是数值范围，保持运行时解析
+                logger.debug(f"Non-numeric range {range_str}: {e}")
+        length = field.get('length')
+        if length and ':' not in length:
+            try:
+                entry['byte_length'] = int(length)
+            except ValueError:
+                pass
+        return entry
+
 def init_parser(xml_file):
-    global GLOBAL_PARSER_CACHE, GLOBAL_MANDATORY_FIELDS, GLOBAL_RANDOM_FIELDS
+    global GLOBAL_PARSER_CACHE, GLOBAL_MANDATORY_FIELDS, GLOBAL_RANDOM_FIELDS, GLOBAL_RANDOM_FIELD_INDEX
     with GLOBAL_PARSER_LOCK:
         if GLOBAL_PARSER_CACHE["last_xml_file"] != xml_file or GLOBAL_PARSER_CACHE["parser"] is None:
             logger.info(f"Parsing XML file: {xml_file}")
@@ -237,14 +309,773 @@ def init_parser(xml_file):
                 "parser": parser,
                 "messages": parser.messages,
                 "state_machine": parser.state_machine,
+                "shortest_paths": parser.shortest_paths,
                 "client_messages": parser.client_messages,
                 "server_messages": parser.server_messages,
+                "encoder_plans": {},
+                "classifier": MessageClassifier(parser.messages),
                 "last_xml_file": xml_file
             })
             GLOBAL_MANDATORY_FIELDS = mandatory_fields
             GLOBAL_RANDOM_FIELDS = random_fields
+            GLOBAL_RANDOM_FIELD_INDEX = parser.random_field_index
         return GLOBAL_PARSER_CACHE
 
+class FieldSlot:
+    """编码计划中的变量槽位，字段名、长度和编码在编译时确定"""
+    __slots__ = ('name', 'role', 'encoding', 'length', 'length_range', 'default', 'protected', 'size')
+
+    def __init__(self, name, role, encoding, length, length_range, default, protected, size):
+        self.name = name
+        self.role = role
+        self.encoding = encoding
+        self.length = length
+        self.length_range = length_range
+        self.default = default
+        self.protected = protected
+        self.size = size
+
+class TemplateRun:
+    """编码计划中一段定长字节：常量和定长槽位预先排好的模板、受保护字节位图以及槽位在段内的偏移"""
+    __slots__ = ('template', 'protected_mask', 'slot_offsets')
+
+    def __init__(self, template, protected_mask, slot_offsets):
+        self.template = template
+        self.protected_mask = protected_mask
+        self.slot_offsets = slot_offsets
+
+class EncoderPlan:
+    """扁平化的报文编码计划：常量字节预先编码，生成报文时只填充变量槽位。
+    相邻的常量和定长槽位合并为 TemplateRun，变长槽位（如 MQTT 剩余长度、主题名）夹在各段之间，
+    全部定长的报文（如 Modbus 请求）只有一段模板"""
+    __slots__ = ('name', 'segments', 'const_names', 'pieces')
+
+    def __init__(self, name, segments, const_names):
+        self.name = name
+        self.segments = segments
+        self.const_names = const_names
+        self.pieces = []
+        template = bytearray()
+        mask = bytearray()
+        slot_offsets = []
+        for seg in segments:
+            if isinstance(seg, bytes):
+                template.extend(seg)
+                mask.extend(b'\x01' * len(seg))
+            elif seg.size is not None:
+                slot_offsets.append((len(template), seg))
+                template.extend(b'\x00' * seg.size)
+                mask.extend((b'\x01' if seg.protected else b'\x00') * seg.size)
+            else:
+                if template or slot_offsets:
+                    self.pieces.append(TemplateRun(bytes(template), bytes(mask), slot_offsets))
+                    template, mask, slot_offsets = bytearray(), bytearray(), []
+                self.pieces.append(seg)
+        if template or slot_offsets:
+            self.pieces.append(TemplateRun(bytes(template), bytes(mask), slot_offsets))
+
+# 进程内协议解析器注册表：协议类型 -> 解析函数(generator, data)，返回识别出的报文名或 None
+DISSECTORS = {}
+
+def register_dissector(protocol_type):
+    def decorator(func):
+        DISSECTORS[protocol_type] = func
+        return func
+    return decorator
+
+MQTT_PACKET_TYPES = {
+    1: 'CONNECT', 2: 'CONNACK', 3: 'PUBLISH', 4: 'PUBACK', 5: 'PUBREC', 6: 'PUBREL', 7: 'PUBCOMP',
+    8: 'SUBSCRIBE', 9: 'SUBACK', 10: 'UNSUBSCRIBE', 11: 'UNSUBACK', 12: 'PINGREQ', 13: 'PINGRESP', 14: 'DISCONNECT'
+}
+
+def decode_mqtt_remaining_length(data, offset=1):
+    """解码 MQTT 剩余长度变长整数，返回 (剩余长度, 固定头长度)，数据不完整或非法时返回 None"""
+    multiplier = 1
+    value = 0
+    for i in range(4):
+        if offset + i >= len(data):
+            return None
+        byte = data[offset + i]
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, offset + i + 1
+        multiplier *= 128
+    return None
+
+@register_dissector('mqtt')
+def dissect_mqtt(generator, data):
+    if len(data) < 2:
+        return None
+    decoded = decode_mqtt_remaining_length(data)
+    if decoded is None:
+        return None
+    remaining_length, header_length = decoded
+    if header_length + remaining_length > len(data):
+        logger.debug(f"Truncated MQTT packet: need {header_length + remaining_length} bytes, got {len(data)}")
+        return None
+    msg_name = MQTT_PACKET_TYPES.get(data[0] >> 4)
+    return msg_name if msg_name in generator.messages else None
+
+@register_dissector('dns')
+def dissect_dns(generator, data):
+    if len(data) < 12:
+        return None
+    if data[2] & 0x80:  # QR 位为 1 表示响应
+        return 'DNS_RESPONSE'
+    return None
+
+@register_dissector('modbus')
+def dissect_modbus_rtu(generator, data):
+    if len(data) < 4:
+        return None
+    function_code = data[1]
+    crc = bytes(data[-2:])
+    expected_crc = generator.calculate_modbus_crc(data[:-2])
+    if crc != expected_crc:
+        logger.warning(f"Invalid Modbus CRC: received {crc.hex()}, expected {expected_crc.hex()}")
+    msg_name = generator.get_function_code_map().get(function_code)
+    if msg_name:
+        return msg_name
+    if function_code >= 0x80:
+        return 'EXCEPTION_RESPONSE'
+    return None
+
+# 流水线模式下的请求/响应关联：MQTT 请求报文类型 -> 无 packet_id 时期望的响应类型
+MQTT_EXPECTED_RESPONSES = {1: 2, 12: 13}  # CONNECT -> CONNACK, PINGREQ -> PINGRESP
+MQTT_ACK_TYPES = (4, 5, 6, 7, 9, 11)  # PUBACK, PUBREC, PUBREL, PUBCOMP, SUBACK, UNSUBACK
+
+def correlation_key(protocol_type, data, outbound):
+    """返回用于匹配请求和响应的关联键：('id', 协议标识) 或 ('type', 响应类型)，
+    不带标识的协议按 ('fifo', None) 顺序匹配；请求不需要响应时返回 None。Modbus 的 data 为 Modbus/TCP 帧"""
+    if protocol_type == 'modbus':
+        if len(data) < MBAP_HEADER.size:
+            return None
+        return ('id', int.from_bytes(data[0:2], 'big'))
+    if protocol_type == 'dns':
+        if len(data) < 12:
+            return None
+        return ('id', int.from_bytes(data[0:2], 'big'))
+    if protocol_type == 'mqtt':
+        decoded = decode_mqtt_remaining_length(data)
+        if decoded is None:
+            return None
+        packet_type = data[0] >> 4
+        offset = decoded[1]
+        if outbound:
+            if packet_type == 3:  # PUBLISH：QoS 0 无响应，否则 packet_id 位于主题名之后
+                if not (data[0] >> 1) & 0x03 or offset + 2 > len(data):
+                    return None
+                offset += 2 + int.from_bytes(data[offset:offset + 2], 'big')
+            elif packet_type not in (6, 8, 10):  # PUBREL、SUBSCRIBE、UNSUBSCRIBE 紧跟 packet_id
+                response_type = MQTT_EXPECTED_RESPONSES.get(packet_type)
+                return ('type', response_type) if response_type else None
+        elif packet_type not in MQTT_ACK_TYPES:
+            return ('type', packet_type)
+        if offset + 2 > len(data):
+            return None
+        return ('id', int.from_bytes(data[offset:offset + 2], 'big'))
+    return ('fifo', None)
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+def _load_mmsg_libc():
+    """加载提供 sendmmsg/recvmmsg 的 libc，非 Linux 或加载失败时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+MMSG_LIBC = _load_mmsg_libc()
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+
+class UDPBatchIO:
+    """UDP 批量收发：Linux 上用 sendmmsg/recvmmsg 一次系统调用处理一批数据报，
+    其他平台或 libc 不支持时退化为逐个 sendto/recv。使用期间套接字切换为非阻塞，close() 时恢复原超时"""
+
+    def __init__(self, sock, address, batch_size=64, buffer_size=4096):
+        self.sock = sock
+        self.saved_timeout = sock.gettimeout()
+        sock.setblocking(False)
+        self.address = address
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.native = MMSG_LIBC is not None and sock.family == socket.AF_INET
+        self.syscalls = 0
+        if self.native:
+            # sockaddr_in：地址族按本机字节序，端口和地址按网络字节序
+            self.sockaddr = ctypes.create_string_buffer(
+                struct.pack('=H', socket.AF_INET) + struct.pack('!H', address[1]) + socket.inet_aton(address[0]) + bytes(8), 16)
+            self.send_iovecs = (_IOVec * batch_size)()
+            self.send_msgs = (_MMsgHdr * batch_size)()
+            self.recv_buffer = ctypes.create_string_buffer(batch_size * buffer_size)
+            self.recv_iovecs = (_IOVec * batch_size)()
+            self.recv_msgs = (_MMsgHdr * batch_size)()
+            base = ctypes.addressof(self.recv_buffer)
+            for i in range(batch_size):
+                self.send_msgs[i].msg_hdr.msg_name = ctypes.addressof(self.sockaddr)
+                self.send_msgs[i].msg_hdr.msg_namelen = 16
+                self.send_msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.send_iovecs[i])
+                self.send_msgs[i].msg_hdr.msg_iovlen = 1
+                self.recv_iovecs[i].iov_base = base + i * buffer_size
+                self.recv_iovecs[i].iov_len = buffer_size
+                self.recv_msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.recv_iovecs[i])
+                self.recv_msgs[i].msg_hdr.msg_iovlen = 1
+
+    def send(self, packets, wait=0.0):
+        """发送一批 bytes 数据报，返回实际发出的个数；发送缓冲区满时最多等待 wait 秒可写"""
+        sent = 0
+        while sent < len(packets):
+            try:
+                sent += self._send_chunk(packets[sent:sent + self.batch_size])
+            except BlockingIOError:
+                if not select.select([], [self.sock], [], wait)[1]:
+                    break
+        return sent
+
+    def _send_chunk(self, packets):
+        self.syscalls += 1
+        if not self.native:
+            for i, packet in enumerate(packets):
+                try:
+                    self.sock.sendto(packet, self.address)
+                except BlockingIOError:
+                    if i:
+                        return i
+                    raise
+            return len(packets)
+        # c_char_p 直接指向 bytes 对象的内部缓冲区，调用期间由 buffers 保持引用
+        buffers = [ctypes.c_char_p(packet) for packet in packets]
+        for i, packet in enumerate(packets):
+            self.send_iovecs[i].iov_base = ctypes.cast(buffers[i], ctypes.c_void_p)
+            self.send_iovecs[i].iov_len = len(packet)
+        count = MMSG_LIBC.sendmmsg(self.sock.fileno(), self.send_msgs, len(packets), 0)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise BlockingIOError(err, os.strerror(err))
+            raise OSError(err, os.strerror(err))
+        return count
+
+    def receive(self):
+        """取走当前已到达的一批数据报，不阻塞；原生路径返回接收缓冲区上的 memoryview，下一次 receive() 前有效"""
+        self.syscalls += 1
+        if not self.native:
+            datagrams = []
+            for _ in range(self.batch_size):
+                try:
+                    datagrams.append(self.sock.recv(self.buffer_size, MSG_DONTWAIT))
+                except BlockingIOError:
+                    break
+            return datagrams
+        count = MMSG_LIBC.recvmmsg(self.sock.fileno(), self.recv_msgs, self.batch_size, MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(err, os.strerror(err))
+        view = memoryview(self.recv_buffer).cast('B')
+        return [view[i * self.buffer_size:i * self.buffer_size + self.recv_msgs[i].msg_len] for i in range(count)]
+
+    def close(self):
+        if self.sock.fileno() != -1:
+            self.sock.settimeout(self.saved_timeout)
+
+MBAP_HEADER = struct.Struct('!HHHB')  # 事务 ID、协议 ID、长度、单元 ID
+
+def rtu_to_mbap(packet, transaction_id):
+    """把生成器产生的 RTU 帧（从站 ID + PDU + CRC）封装为 Modbus/TCP 帧"""
+    pdu = packet[1:-2]
+    return MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, packet[0]) + pdu
+
+def mbap_to_rtu(generator, frame):
+    """把 Modbus/TCP 帧还原为带 CRC 的 RTU 帧，复用 RTU 解析器识别报文"""
+    body = bytes(frame[6:])
+    return body + generator.calculate_modbus_crc(body)
+
+STREAM_FRAMED_PROTOCOLS = ('mqtt', 'dns', 'modbus')  # stream_frame_length 能确定报文边界的协议
+
+def stream_frame_length(protocol_type, data):
+    """返回 data 开头一条报文的 (长度前缀字节数, 总长度)，数据不足以确定边界时返回 None；
+    MQTT 按剩余长度变长整数，DNS over TCP 按 2 字节长度前缀，Modbus/TCP 按 MBAP 长度字段，其他协议整块作为一条"""
+    if protocol_type == 'mqtt':
+        decoded = decode_mqtt_remaining_length(data)
+        if decoded is None:
+            # 变长整数超过 4 字节说明数据已错位，整块交给解析器，避免缓冲区卡死
+            return (0, len(data)) if len(data) > 4 else None
+        remaining_length, header_length = decoded
+        return 0, header_length + remaining_length
+    if protocol_type == 'dns':
+        if len(data) < 2:
+            return None
+        return 2, 2 + int.from_bytes(data[0:2], 'big')
+    if protocol_type == 'modbus':
+        if len(data) < MBAP_HEADER.size:
+            return None
+        return 0, 6 + int.from_bytes(data[4:6], 'big')
+    return 0, len(data)
+
+class ReceiveRing:
+    """每连接的 TCP 接收缓冲区：recv_into 直接写入预分配的 bytearray，按协议边界切出 memoryview，不复制报文。
+    交出的视图在下一次 fill() 之前有效，需要保留的调用方自行 bytes() 复制"""
+    MIN_READ = 4096
+
+    def __init__(self, protocol_type, capacity=65536):
+        self.protocol_type = protocol_type
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def make_room(self):
+        pending = self.end - self.start
+        if pending and len(self.buffer) - pending < self.MIN_READ:
+            # 单条报文超过剩余空间时扩容；旧缓冲区仍被已交出的视图引用，不能原地调整大小
+            buffer = bytearray(len(self.buffer) * 2)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        elif pending:
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def fill(self, sock):
+        """读取一次套接字，返回本次读到的数据视图，对端关闭时为空"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buffer) - self.end < self.MIN_READ:
+            self.make_room()
+        count = sock.recv_into(self.view[self.end:])
+        chunk = self.view[self.end:self.end + count]
+        self.end += count
+        return chunk
+
+    def next_message(self):
+        """切出下一条完整报文（不含长度前缀），数据不完整时返回 None"""
+        if self.start == self.end:
+            return None
+        framed = stream_frame_length(self.protocol_type, self.view[self.start:self.end])
+        if framed is None:
+            return None
+        prefix, total = framed
+        if total > self.end - self.start:
+            return None
+        message = self.view[self.start + prefix:self.start + total]
+        self.start += total
+        return message
+
+class MessageClassifier:
+    """由 IR 一次性编译出的字节级决策树，按常量字段的偏移和取值单遍识别报文"""
+
+    def __init__(self, messages):
+        self.signatures = []
+        self.first_byte_map = {}
+        for msg_name, msg in messages.items():
+            signature = self.compile_signature(msg)
+            if signature is not None:
+                self.signatures.append((msg_name,) + signature)
+            for field in msg['fields']:
+                if field['kind'] == 'constant' and field['type'] == 'B' and field.get('field_role') == 'field':
+                    try:
+                        self.first_byte_map.setdefault(int(field['value'], 16), msg_name)
+                    except (ValueError, TypeError):
+                        continue
+        self.tree = self.build_tree([(name, min_len, dict(constraints)) for name, min_len, constraints in self.signatures])
+
+    def compile_signature(self, msg):
+        """返回 (最小长度, [((偏移, 长度), 期望值), ...])，报文定义无法解析时返回 None"""
+        constraints = []
+        min_len = 0
+
+        def walk(fields, offset):
+            nonlocal min_len
+            for field in fields:
+                field_length = field.get('length', '1')
+                if ':' in field_length:
+                    field_length = int(field_length.split(':')[0])
+                else:
+                    field_length = int(field_length)
+                min_len = max(min_len, offset + field_length)
+                if field['kind'] == 'constant':
+                    expected_value = field.get('value')
+                    if expected_value.startswith('0x'):
+                        constraints.append(((offset, field_length), int(expected_value, 16)))
+                    elif expected_value.startswith('0b'):
+                        constraints.append(((offset, field_length), int(expected_value, 2)))
+                    offset += field_length
+                elif field['kind'] == 'variable':
+                    offset += field_length
+                elif field['kind'] == 'field':
+                    offset = walk(field['subfields'], offset)
+            return offset
+
+        try:
+            walk(msg['fields'], 0)
+            fixed_length = sum(int(f.get('length', '1').split(':')[0]) for f in msg['fields'] if ':' not in f.get('length', '1'))
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Cannot compile match signature for {msg['name']}: {e}")
+            return None
+        return max(min_len, fixed_length), constraints
+
+    def build_tree(self, candidates):
+        # 选择被最多候选报文约束的 (偏移, 长度) 作为分支键，候选顺序保持 IR 中的定义顺序
+        key_counts = {}
+        for _, _, constraints in candidates:
+            for key in constraints:
+                key_counts[key] = key_counts.get(key, 0) + 1
+        if not key_counts:
+            return ('leaf', [(name, min_len) for name, min_len, _ in candidates])
+        key = max(key_counts, key=lambda k: (key_counts[k], -k[0]))
+        values = []
+        for _, _, constraints in candidates:
+            if key in constraints and constraints[key] not in values:
+                values.append(constraints[key])
+        branches = {}
+        for value in values:
+            subset = []
+            for name, min_len, constraints in candidates:
+                if key not in constraints or constraints[key] == value:
+                    rest = {k: v for k, v in constraints.items() if k != key}
+                    subset.append((name, min_len, rest))
+            branches[value] = self.build_tree(subset)
+        default = self.build_tree([(name, min_len, constraints) for name, min_len, constraints in candidates if key not in constraints])
+        return ('node', key[0], key[1], branches, default)
+
+    def classify(self, data):
+        node = self.tree
+        data_length = len(data)
+        while node[0] == 'node':
+            _, offset, length, branches, default = node
+            if offset + length <= data_length:
+                node = branches.get(int.from_bytes(data[offset:offset + length], 'big'), default)
+            else:
+                node = default
+        for msg_name, min_len in node[1]:
+            if data_length >= min_len:
+                return msg_name
+        return None
+
+IR_COVERAGE = {}  # 协议类型 -> 最近一次测试的 StateCoverage，供界面实时查询
+
+class StateCoverage:
+    """状态机覆盖率：统计每个状态和每条转移的命中次数，选择下一状态时偏向未覆盖的转移。
+    同一次测试的多个会话共享一个实例"""
+    UNSEEN_BOOST = 8.0  # 从未走过的转移相对已走过转移的额外权重
+
+    def __init__(self, state_machine):
+        self.lock = threading.Lock()
+        self.edges = {(state, t['next_state']) for state, info in state_machine.items() for t in info.get('transitions', [])}
+        self.states = set(state_machine) | {next_state for _, next_state in self.edges}
+        # MQTT 的 IR 以 INIT 为初始状态，生成器内部统一使用 INIT_STATE
+        self.initial = 'INIT_STATE' if 'INIT_STATE' in self.states or 'INIT' not in self.states else 'INIT'
+        self.state_hits = {}
+        self.edge_hits = {}
+        self.uncovered_out = {}
+        for state, _ in self.edges:
+            self.uncovered_out[state] = self.uncovered_out.get(state, 0) + 1
+
+    def record(self, from_state, to_state):
+        if from_state == 'INIT_STATE':
+            from_state = self.initial
+        edge = (from_state, to_state)
+        with self.lock:
+            self.state_hits.setdefault(from_state, 1)
+            self.state_hits[to_state] = self.state_hits.get(to_state, 0) + 1
+            hits = self.edge_hits.get(edge, 0)
+            self.edge_hits[edge] = hits + 1
+            if not hits and edge in self.edges:
+                self.uncovered_out[from_state] -= 1
+
+    def choose(self, from_state, candidates, rng=random):
+        """按覆盖情况加权选择：未走过的转移、通往仍有未覆盖出边的状态的转移权重更高"""
+        if from_state == 'INIT_STATE':
+            from_state = self.initial
+        weights = []
+        for candidate in candidates:
+            hits = self.edge_hits.get((from_state, candidate), 0)
+            weight = (1 + self.uncovered_out.get(candidate, 0)) / (1 + hits)
+            weights.append(weight * self.UNSEEN_BOOST if not hits else weight)
+        return rng.choices(candidates, weights=weights)[0]
+
+    def report(self):
+        with self.lock:
+            covered_states = sorted(state for state in self.state_hits if state in self.states)
+            covered_edges = sorted(edge for edge in self.edge_hits if edge in self.edges)
+        return coverage_summary(covered_states, [f"{a}->{b}" for a, b in covered_edges], len(self.states), len(self.edges))
+
+class MergedCoverage:
+    """多个独立覆盖率统计的合并视图：各会话各自统计，保证状态选择只取决于本会话的种子和 trace，
+    查询时取并集，供界面实时查看整个测试的覆盖率"""
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+
+    def report(self):
+        return merge_coverage_reports([part.report() for part in self.parts])
+
+def merge_coverage_reports(reports):
+    """覆盖率报告取并集，各报告来自同一状态机"""
+    return coverage_summary(
+        sorted(set().union(*(r['covered_states'] for r in reports))),
+        sorted(set().union(*(r['covered_transitions'] for r in reports))),
+        reports[0]['states_total'], reports[0]['transitions_total'])
+
+def coverage_summary(covered_states, covered_transitions, states_total, transitions_total):
+    return {
+        'states_covered': len(covered_states), 'states_total': states_total,
+        'transitions_covered': len(covered_transitions), 'transitions_total': transitions_total,
+        'state_percent': round(100.0 * len(covered_states) / states_total, 1) if states_total else 100.0,
+        'transition_percent': round(100.0 * len(covered_transitions) / transitions_total, 1) if transitions_total else 100.0,
+        'covered_states': list(covered_states), 'covered_transitions': list(covered_transitions)
+    }
+
+def get_coverage(protocol_type=None):
+    """返回各协议 IR 最近一次测试的实时覆盖率，指定协议时只返回该协议"""
+    if protocol_type is not None:
+        coverage = IR_COVERAGE.get(protocol_type)
+        return coverage.report() if coverage else None
+    return {name: coverage.report() for name, coverage in list(IR_COVERAGE.items())}
+
+def response_signature(protocol_type, msg_name, data):
+    """响应签名：报文名加去掉易变字段（DNS ID、MQTT packet_id 等）后的前若干字节，哈希为 64 位整数"""
+    data = bytes(data)
+    if protocol_type == 'dns':
+        normalized = data[2:12]  # 标志位、RCODE 和各节计数
+    elif protocol_type == 'mqtt':
+        decoded = decode_mqtt_remaining_length(data)
+        header_length = decoded[1] if decoded else 1
+        if data and data[0] >> 4 in MQTT_ACK_TYPES:
+            normalized = data[:1] + data[header_length + 2:header_length + 10]  # 跳过 packet_id，保留返回码
+        else:
+            normalized = data[:1] + data[header_length:header_length + 8]
+    elif protocol_type == 'modbus':
+        normalized = data[1:3]  # 功能码和异常码/字节数
+    else:
+        normalized = data[:8]
+    digest = hashlib.blake2b(str(msg_name).encode() + b'\0' + normalized, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def pack_blobs(blobs):
+    return b''.join(len(blob).to_bytes(2, 'big') + blob for blob in blobs)
+
+def unpack_blobs(data):
+    blobs = []
+    offset = 0
+    while offset + 2 <= len(data):
+        length = int.from_bytes(data[offset:offset + 2], 'big')
+        blobs.append(data[offset + 2:offset + 2 + length])
+        offset += 2 + length
+    return blobs
+
+class CorpusStore:
+    """按协议持久化的语料库：记录每个新响应签名以及触发它的请求序列。
+    单个 sqlite 文件，序列按内容哈希去重；签名是 signatures 表的整数主键，查重走主键索引，
+    不在内存中保存签名集合，多个进程共用同一文件时也能互相去重"""
+    HISTORY_LENGTH = 16  # 每条序列最多保留触发响应前的报文数
+    COMMIT_INTERVAL = 1.0
+    SEED_LIMIT = 5000
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS signatures (signature INTEGER PRIMARY KEY, msg_name TEXT, sequence BLOB, first_seen REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sequences (digest BLOB PRIMARY KEY, states TEXT, packets BLOB, masks BLOB, created REAL)")
+        self.size = self.db.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+        self.seed_cache = None
+        self.seed_size = 0
+        self.pending = 0
+        self.last_commit = time.monotonic()
+        logger.info(f"Opened corpus {path} with {self.size} signatures")
+
+    def observe(self, msg_name, signature, history):
+        """签名未见过时保存 history 中的请求序列，返回是否为新签名"""
+        if not history:
+            return False
+        with self.lock:
+            # 签名插入成功即为新签名，已存在时主键冲突被忽略，查重和写入是同一次索引查找
+            if not self.db.execute("INSERT OR IGNORE INTO signatures VALUES (?, ?, NULL, ?)",
+                                   (signature, str(msg_name), time.time())).rowcount:
+                return False
+            states = '\n'.join(state for state, _, _ in history)
+            packets = pack_blobs([packet for _, packet, _ in history])
+            masks = pack_blobs([mask for _, _, mask in history])
+            digest = hashlib.blake2b(states.encode() + b'\0' + packets, digest_size=16).digest()
+            self.db.execute("INSERT OR IGNORE INTO sequences VALUES (?, ?, ?, ?, ?)", (digest, states, packets, masks, time.time()))
+            self.db.execute("UPDATE signatures SET sequence = ? WHERE signature = ?", (digest, signature))
+            self.size += 1
+            self.pending += 1
+            if time.monotonic() - self.last_commit >= self.COMMIT_INTERVAL:
+                self.commit()
+        return True
+
+    def commit(self):
+        with self.lock:
+            if self.pending:
+                self.db.commit()
+                self.pending = 0
+            self.last_commit = time.monotonic()
+
+    def seeds(self):
+        """随机抽取至多 SEED_LIMIT 条序列，按状态返回 {状态: [(报文, 保护掩码), ...]}；语料库没有新增时复用上次结果"""
+        with self.lock:
+            if self.seed_cache is None or self.seed_size != self.size:
+                self.commit()
+                self.seed_size = self.size
+                seeds = {}
+                for states, packets, masks in self.sample_sequences(self.SEED_LIMIT):
+                    for state, packet, mask in zip(states.split('\n'), unpack_blobs(packets), unpack_blobs(masks)):
+                        seeds.setdefault(state, []).append((packet, mask))
+                self.seed_cache = seeds
+            return self.seed_cache
+
+    def sample_sequences(self, limit):
+        """按 rowid 随机抽样：sequences 只增不删，rowid 基本连续，随机取 rowid 再按主键查找，
+        避免 ORDER BY RANDOM() 对整表排序"""
+        max_rowid = self.db.execute("SELECT MAX(rowid) FROM sequences").fetchone()[0] or 0
+        if max_rowid <= limit:
+            return self.db.execute("SELECT states, packets, masks FROM sequences").fetchall()
+        rowids = random.sample(range(1, max_rowid + 1), limit)
+        rows = []
+        for i in range(0, len(rowids), 500):
+            chunk = rowids[i:i + 500]
+            rows.extend(self.db.execute(
+                f"SELECT states, packets, masks FROM sequences WHERE rowid IN ({','.join('?' * len(chunk))})", chunk))
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.db.close()
+
+CORPUS_ROOT = "corpus"
+CORPUS_STORES = {}
+CORPUS_LOCK = threading.Lock()
+
+def open_corpus(spec, protocol_type):
+    """按 corpus 输入字段打开语料库：true/1 使用 CORPUS_ROOT，其他值视为 CORPUS_ROOT 下的子目录；未开启时返回 None。
+    路径来自请求，解析到 CORPUS_ROOT 之外时拒绝。同一进程内同一文件只打开一次，fork 出的子进程各自重新打开"""
+    if spec is None or str(spec).lower() in ("", "0", "false", "no", "off"):
+        return None
+    if str(spec).lower() in ("1", "true", "yes", "on"):
+        directory = resolve_run_file(CORPUS_ROOT, CORPUS_ROOT)
+    else:
+        directory = resolve_run_file(os.path.join(CORPUS_ROOT, str(spec)), CORPUS_ROOT)
+    if directory is None:
+        logger.warning(f"Corpus {spec} is outside {CORPUS_ROOT}, running without a corpus")
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{protocol_type}.db")
+    key = (os.getpid(), path)
+    with CORPUS_LOCK:
+        store = CORPUS_STORES.get(key)
+        if store is None:
+            store = CORPUS_STORES[key] = CorpusStore(path)
+        return store
+
+def close_corpora():
+    with CORPUS_LOCK:
+        for (pid, _), store in CORPUS_STORES.items():
+            if pid != os.getpid():
+                continue
+            try:
+                store.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to close corpus {store.path}: {e}")
+        CORPUS_STORES.clear()
+
+atexit.register(close_corpora)
+
+class HavocMutator:
+    """havoc 式字节变异：只改动保护掩码为 0 的偏移，叠加 1~MAX_STACK 个变异（位翻转、特殊整数、算术加减、
+    块删除/复制、与语料拼接）。掩码随报文一起增删，长度字段和 CRC 由生成器在变异后重新计算"""
+    MAX_STACK = 8
+    MAX_BLOCK = 16
+    MAX_PACKET = 4096
+    INTERESTING_8 = (0x00, 0x01, 0x10, 0x20, 0x40, 0x7F, 0x80, 0xFF)
+    INTERESTING_16 = (0x0000, 0x0080, 0x00FF, 0x0100, 0x7FFF, 0x8000, 0xFFFF)
+    INTERESTING_32 = (0x00000000, 0x0000FFFF, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF)
+
+    def __init__(self, rng=None):
+        self.rng = rng or random
+
+    def mutable_run(self, mask, start):
+        end = start
+        while end < len(mask) and not mask[end] and end - start < self.MAX_BLOCK:
+            end += 1
+        return end
+
+    def mutate(self, packet, mask, donors=None, resizable=True):
+        """原地变异 packet 和 mask 并返回二者；没有可变字节时原样返回。resizable 为假时不做块删除/复制"""
+        rng = self.rng
+        mutable = [i for i, m in enumerate(mask) if not m]
+        for _ in range(rng.randint(1, self.MAX_STACK)):
+            if not mutable:
+                break
+            i = rng.choice(mutable)
+            op = rng.randrange(9)
+            if op == 0:
+                packet[i] ^= 1 << rng.randrange(8)
+            elif op == 1:
+                packet[i] = rng.randrange(256)
+            elif op == 2:
+                packet[i] = rng.choice(self.INTERESTING_8)
+            elif op == 3:
+                packet[i] = (packet[i] + rng.choice((-1, 1)) * rng.randint(1, 35)) & 0xFF
+            elif op in (4, 5):
+                width = 2 if op == 4 else 4
+                if self.mutable_run(mask, i) - i < width:
+                    continue
+                value = rng.choice(self.INTERESTING_16 if width == 2 else self.INTERESTING_32)
+                packet[i:i + width] = value.to_bytes(width, rng.choice(('big', 'little')))
+            elif op in (6, 7) and not resizable:
+                continue
+            elif op == 6:
+                if len(packet) <= 1:
+                    continue
+                end = rng.randint(i + 1, self.mutable_run(mask, i))
+                del packet[i:end]
+                del mask[i:end]
+                mutable = [j for j, m in enumerate(mask) if not m]
+            elif op == 7:
+                end = rng.randint(i + 1, self.mutable_run(mask, i))
+                if len(packet) + end - i > self.MAX_PACKET:
+                    continue
+                packet[end:end] = packet[i:end]
+                mask[end:end] = bytes(end - i)
+                mutable = [j for j, m in enumerate(mask) if not m]
+            elif donors:
+                donor, donor_mask = rng.choice(donors)
+                sources = [j for j in range(min(len(donor), len(donor_mask))) if not donor_mask[j]]
+                if not sources:
+                    continue
+                start = rng.choice(sources)
+                length = min(self.mutable_run(mask, i) - i, self.mutable_run(donor_mask, start) - start)
+                packet[i:i + length] = donor[start:start + length]
+        return packet, mask
+
 class PacketGenerator:
     MAX_FIELD_LENGTH = 255
     PROTOCOL_CONFIG = {
@@ -264,7 +1095,12 @@ class PacketGenerator:
         }
     }
 
-    def __init__(self, messages, state_machine, client_messages, server_messages, protocol_type):
+    SEED_RATIO = 0.3  # 不变异时直接使用语料库中同一状态报文的概率
+
+    MODBUS_PROTECTED_ROLES = ('slave_id', 'function_code', 'address', 'coil_address', 'register_address', 'quantity', 'coil_value', 'crc')
+
+    def __init__(self, messages, state_machine, client_messages, server_messages, protocol_type, encoder_plans=None, use_pyshark=False, classifier=None, coverage=None,
+                 shortest_paths=None, seed=None):
         self.messages = messages
         self.state_machine = state_machine
         self.client_messages = client_messages
@@ -272,7 +1108,36 @@ class PacketGenerator:
         self.protocol_type = protocol_type.lower()
         self.current_state = 'INIT_STATE'
         self.state_lock = threading.Lock()
-        self.config = self.PROTOCOL_CONFIG.get(self.protocol_type, {})
+        # 拷贝一份配置，并行会话可以各自修改客户端 ID 等默认值
+        self.config = dict(self.PROTOCOL_CONFIG.get(self.protocol_type, {}))
+        # 编码计划按报文懒编译，同一次解析的多个生成器可共享该字典
+        self.encoder_plans = encoder_plans if encoder_plans is not None else {}
+        self.last_protected_mask = bytearray()
+        self.slave_index = 0
+        self.function_code_map = None
+        self.classifier = classifier if classifier is not None else MessageClassifier(messages)
+        self.coverage = coverage if coverage is not None else StateCoverage(state_machine)
+        self.shortest_paths = shortest_paths or {}
+        self.target_state = None  # drive_to 设定的目标状态，复位后会重新沿最短路径驱动过去
+        self.corpus = None
+        self.seed_packets = {}
+        self.history = deque(maxlen=CorpusStore.HISTORY_LENGTH)  # 自上次复位以来生成的 (状态, 报文, 保护掩码)
+        # 所有随机决策都取自本会话的 rng，同一种子加同一决策序列（trace）即可重放出相同报文
+        self.seed = seed if seed is not None else random.SystemRandom().getrandbits(32)
+        self.rng = random.Random(self.seed)
+        self.trace = []  # 影响随机决策的外部输入：响应报文名、复位、驱动目标、生成请求
+        self.trace_events = {}  # 相同事件共用一个元组，长时间测试时 trace 只占指针大小
+        self.mutator = HavocMutator(self.rng)  # 为 None 时只做字段级变异
+        self.new_signatures = 0
+        self.driving = False
+        self.drives_completed = 0
+        self.fork_state = None  # fork_at 设定的分叉点，复位回到这里而不是初始状态
+        self.fork_prefix = ()
+        self.state_history = deque(maxlen=CorpusStore.HISTORY_LENGTH)  # 自上次复位以来生成报文的状态名，用于记录前缀
+        self.fork_history = ()  # 最近一次重放前缀的状态序列，复位后保留，新记录的前缀仍从初始状态算起
+        self.prefixes = {}  # 收到响应后到达的状态 -> 自初始状态起最短的客户端报文状态序列
+        # 进程内解析器无法识别时是否回退到 pyshark（需要 tshark，速度较慢）
+        self.use_pyshark = use_pyshark and pyshark is not None
 
     def calculate_modbus_crc(self, data):
         crc = 0xFFFF
@@ -347,55 +1212,59 @@ class PacketGenerator:
         
         if self.protocol_type == 'mqtt':
             if field_name.endswith(("_topic_name_B", "_topic_filter_B")):
-                topic = random.choice(self.config['default_topics']) if fuzz else self.config['default_topics'][0]
+                topic = self.rng.choice(self.config['default_topics']) if fuzz else self.config['default_topics'][0]
                 return topic
             if field_name.endswith(("_topic_length_B", "_topic_filter_length_B")):
                 topic = self.config['default_topics'][0]  # 使用默认主题
                 return hex(len(topic.encode('ascii')))  # 固定为0x0a
             if field_name.endswith("_client_id_length_B"):
-                client_id = self.config['default_client_id'] if not fuzz else f"client-{random.randint(1000, 9999)}"
+                client_id = self.config['default_client_id'] if not fuzz else f"client-{self.rng.randint(1000, 9999)}"
                 return hex(len(client_id))
             if field_name.endswith("_client_id_B"):
-                return self.config['default_client_id'] if not fuzz else f"client-{random.randint(1000, 9999)}"
+                return self.config['default_client_id'] if not fuzz else f"client-{self.rng.randint(1000, 9999)}"
             if field_name.endswith("_keep_alive_B"):
-                return "0x003c" if not fuzz else f"0x{random.randint(0x0001, 0x003c):04x}"
+                return "0x003c" if not fuzz else f"0x{self.rng.randint(0x0001, 0x003c):04x}"
             if field_name.endswith("_connect_flags_B"):
                 return "0x02"  # Clean Session
             if field_name.endswith("_packet_id_B"):
-                return f"0x{random.randint(0x0001, 0xFFFF):04x}"  # 非零packet_id
+                return f"0x{self.rng.randint(0x0001, 0xFFFF):04x}"  # 非零packet_id
 
         if self.protocol_type == 'dns':
             if field_name.startswith(f"{self.current_state}_query_domain_B"):
-                return random.choice(self.config['default_domains']) if fuzz else self.config['default_domains'][0]
+                return self.rng.choice(self.config['default_domains']) if fuzz else self.config['default_domains'][0]
      
         if self.protocol_type == 'modbus':
             if field_name.endswith("_slave_id_B"):
-                return hex(self.config['default_slave_id']) if not fuzz else hex(random.randint(1, 247))
+                return hex(self.next_slave_id()) if not fuzz else hex(self.rng.randint(1, 247))
             if field_name.endswith("_function_code_B"):
-                return hex(self.config['default_function_codes'][0]) if not fuzz else hex(random.choice(self.config['default_function_codes'] + [random.randint(0, 255)]))
+                return hex(self.config['default_function_codes'][0]) if not fuzz else hex(self.rng.choice(self.config['default_function_codes'] + [self.rng.randint(0, 255)]))
             if field_name.endswith("_address_B") or field_name.endswith("_coil_address_B") or field_name.endswith("_register_address_B"):
-                return hex(self.config['default_address']) if not fuzz else hex(random.randint(0, 65535))
+                return hex(self.config['default_address']) if not fuzz else hex(self.rng.randint(0, 65535))
             if field_name.endswith("_quantity_B"):
                 if "READ_HOLDING_REGISTERS_REQUEST" in field_name:
                     max_quantity = 125
                 else:
                     max_quantity = 2000
-                return hex(self.config['default_quantity']) if not fuzz else hex(random.randint(1, max_quantity))
+                return hex(self.config['default_quantity']) if not fuzz else hex(self.rng.randint(1, max_quantity))
             if field_name.endswith("_coil_value_B"):
-                return "0xFF00" if not fuzz else random.choice(["0x0000", "0xFF00"])
+                return "0xFF00" if not fuzz else self.rng.choice(["0x0000", "0xFF00"])
             if field_name.endswith("_crc_B"):
                 return None  # CRC 在 generate_packet 中动态计算
 
         if range_str and '-' in range_str:
-            min_val, max_val = map(lambda x: int(x, 16 if field_type == 'B' else 2), range_str.split('-'))
+            bounds = field_info.get('bounds')
+            if bounds:
+                min_val, max_val = bounds
+            else:
+                min_val, max_val = map(lambda x: int(x, 16 if field_type == 'B' else 2), range_str.split('-'))
             if field_name.endswith("_coil_value_B"):
-                val = random.choice([0, 0xFF00]) if fuzz else 0xFF00
+                val = self.rng.choice([0, 0xFF00]) if fuzz else 0xFF00
             elif field_name.endswith("_quantity_B") and "READ_HOLDING_REGISTERS_REQUEST" in field_name:
-                val = random.randint(min_val, min(max_val, 125)) if fuzz else min_val
+                val = self.rng.randint(min_val, min(max_val, 125)) if fuzz else min_val
             elif field_name.endswith("_quantity_B"):
-                val = random.randint(min_val, min(max_val, 2000)) if fuzz else min_val
+                val = self.rng.randint(min_val, min(max_val, 2000)) if fuzz else min_val
             else:
-                val = random.randint(min_val, max_val)
+                val = self.rng.randint(min_val, max_val)
             if field_type == 'B' or field_type == 'H':
                 return f"0x{val:04x}" if field_name.endswith(("_coil_value_B", "_quantity_B", "_address_B", "_coil_address_B", "_register_address_B")) else f"0x{val:02x}"
             if field_type == 'B' and encoding == 'hex':
@@ -404,60 +1273,162 @@ class PacketGenerator:
             
         return field_info.get('value', '0x00')
 
-    def generate_packet(self, state_name, input_fields=None, fuzz=False):
-        logger.debug(f"Generating packet for state: {state_name}, fuzz: {fuzz}")
-        if state_name not in self.client_messages:
-            logger.warning(f"Skipping non-client message: {state_name}")
-            return None
-        
-        if state_name == 'UNSUBSCRIBE' and not self.subscribed_topics:
-            logger.warning("No subscribed topics for UNSUBSCRIBE, skipping")
-            return None
-        
+    def next_slave_id(self):
+        """配置了 slave_ids 时按轮询依次寻址各从站，保持总线上多个从站交替繁忙"""
+        slave_ids = self.config.get('slave_ids')
+        if not slave_ids:
+            return self.config['default_slave_id']
+        slave_id = slave_ids[self.slave_index % len(slave_ids)]
+        self.slave_index += 1
+        return slave_id
+
+    def compile_message(self, state_name):
         msg = self.messages.get(state_name)
         if not msg:
-            logger.warning(f"No message definition for state {state_name}")
             return None
-        logger.debug(f"Message fields for {state_name}: {msg['fields']}")
-        
+        segments = []
+        const_names = set()
+
+        def compile_fields(fields, prefix=""):
+            for field in fields:
+                field_role = field.get('field_role', 'field')
+                field_name = f"{state_name}_{prefix}{field_role}_{field.get('type', 'B')}"
+                encoding = field.get('encoding', 'hex')
+                if self.protocol_type != 'modbus' and field_role in ('topic_name', 'topic_filter', 'client_id'):
+                    encoding = 'ascii'
+                if field['kind'] == 'constant':
+                    const_names.add(field_name)
+                    try:
+                        bytes_val = bytes(self.encode_value(field.get('value', '0x00'), encoding, field.get('length', '1'), field_role))
+                    except (ValueError, UnicodeEncodeError) as e:
+                        logger.warning(f"Invalid value {field.get('value')} for {field_name} (encoding: {encoding}): {e}, using default 0x00")
+                        bytes_val = b"\x00"
+                    # 相邻常量合并为一段预编码字节
+                    if segments and isinstance(segments[-1], bytes):
+                        segments[-1] += bytes_val
+                    else:
+                        segments.append(bytes_val)
+                elif field['kind'] == 'variable':
+                    length = field.get('length', '1')
+                    length_range = None
+                    try:
+                        if ':' in length:
+                            min_len, max_len = map(int, length.split(':'))
+                            length_range = (min_len, max_len)
+                            length = None
+                        else:
+                            length = min(int(length), self.MAX_FIELD_LENGTH)
+                    except ValueError:
+                        logger.warning(f"Invalid length {length} for {field_name}, using default 1")
+                        length = 1
+                    size = None
+                    if length_range is None:
+                        if self.protocol_type == 'modbus':
+                            if field_role == 'crc':
+                                size = 0
+                            elif encoding == 'hex' and length > 0:
+                                size = length
+                        elif field_role == 'remaining_length':
+                            if self.protocol_type != 'mqtt':
+                                size = 4 if self.protocol_type == 'dns' else 1
+                        elif field_role in ('topic_length', 'topic_filter_length', 'packet_id'):
+                            if length == 2:
+                                size = 2
+                        elif field_role not in ('topic_name', 'topic_filter', 'client_id') and encoding == 'hex' and length > 0:
+                            size = length
+                    protected = field_role == 'protected' or (self.protocol_type != 'modbus' and field_role == 'remaining_length')
+                    segments.append(FieldSlot(
+                        field_name, field_role, encoding, length, length_range,
+                        field.get('scope') or field.get('value', '0x00-0xFF'), protected, size
+                    ))
+                elif field['kind'] == 'field':
+                    compile_fields(field['subfields'], f"{field_role}_")
+
+        try:
+            compile_fields(msg['fields'])
+        except Exception as e:
+            logger.warning(f"Failed to compile encoder plan for {state_name}: {e}, falling back to field walk")
+            return None
+        return EncoderPlan(state_name, segments, frozenset(const_names))
+
+    def get_encoder_plan(self, state_name):
+        if state_name not in self.encoder_plans:
+            self.encoder_plans[state_name] = self.compile_message(state_name)
+        return self.encoder_plans[state_name]
+
+    def fill_slot(self, slot, effective_fields, fuzz):
+        value = effective_fields.get(slot.name)
+        if value is None and slot.name not in effective_fields:
+            value = slot.default
+        if slot.length_range is not None:
+            min_len, max_len = slot.length_range
+            length = min(self.rng.randint(min_len, max_len) if fuzz else min_len, self.MAX_FIELD_LENGTH)
+        else:
+            length = slot.length
+        field_role = slot.role
+
+        if self.protocol_type == 'modbus':
+            if fuzz and self.rng.random() < 0.2 and field_role not in self.MODBUS_PROTECTED_ROLES:
+                logger.debug(f"Fuzzing field {slot.name}")
+                return bytes(self.rng.randint(0, 255) for _ in range(length))
+            if field_role == 'crc':  # CRC 在最后处理
+                return b''
+            try:
+                return self.encode_value(value, slot.encoding, length, field_role)
+            except (ValueError, TypeError, OverflowError) as e:
+                logger.warning(f"Error processing value {value} for {slot.name} (encoding: {slot.encoding}): {e}, using default 0x00")
+                return b"\x00" * length
+
+        if field_role == 'remaining_length':
+            return b'\x00' * (4 if self.protocol_type == 'dns' else 1)
+        try:
+            if field_role in ('topic_filter', 'topic_name', 'client_id'):
+                value = effective_fields.get(slot.name, value)
+                return self.encode_value(value, 'ascii', len(value), field_role)
+            elif field_role in ('topic_length', 'topic_filter_length'):
+                value = effective_fields.get(slot.name, '0x000a')
+                return int(value, 16).to_bytes(2, 'big')
+            elif field_role == 'packet_id':
+                value = effective_fields.get(slot.name, '0x0001')
+                return int(value, 16).to_bytes(2, 'big')
+            elif '-' in value:
+                min_val, max_val = map(lambda x: int(x, 16), value.split('-'))
+                val = self.rng.randint(min_val, max_val)
+                return val.to_bytes(length, 'big')
+            return self.encode_value(value, slot.encoding, length, field_role)
+        except (ValueError, TypeError, OverflowError, UnicodeEncodeError) as e:
+            logger.warning(f"Error processing value {value} for {slot.name} (encoding: {slot.encoding}): {e}, using default 0x00")
+            return b"\x00" * length
+
+    def encode_with_plan(self, plan, effective_fields, fuzz):
+        remaining_length_fields = []
+        track_remaining = self.protocol_type != 'modbus'
+        temp_packet = bytearray()
+        mask = bytearray()
+        for piece in plan.pieces:
+            if isinstance(piece, TemplateRun):
+                base = len(temp_packet)
+                temp_packet += piece.template
+                mask += piece.protected_mask
+                for offset, slot in piece.slot_offsets:
+                    field_bytes = self.fill_slot(slot, effective_fields, fuzz)
+                    if slot.size:
+                        temp_packet[base + offset:base + offset + slot.size] = field_bytes
+                    if track_remaining and slot.role == 'remaining_length':
+                        remaining_length_fields.append((base + offset, base + offset + slot.size))
+                continue
+            field_bytes = self.fill_slot(piece, effective_fields, fuzz)
+            if track_remaining and piece.role == 'remaining_length':
+                remaining_length_fields.append((len(temp_packet), len(temp_packet) + len(field_bytes)))
+            temp_packet += field_bytes
+            mask += (b'\x01' if piece.protected else b'\x00') * len(field_bytes)
+        return temp_packet, mask, remaining_length_fields
+
+    def encode_fields(self, state_name, msg, effective_fields, fuzz):
+        """逐字段遍历报文定义进行编码，作为无法编译或覆盖了常量字段时的回退路径"""
         remaining_length_fields = []
-        self.subscribed_topics = getattr(self, 'subscribed_topics', set())
-        packet = bytearray()
         protected_bytes = set()
         temp_packet = bytearray()
-        input_fields = input_fields or {}
-        effective_fields = input_fields.copy()
-        generated_fields = set()
-        relevant_fields = {k: v for k, v in GLOBAL_RANDOM_FIELDS.items() if k.startswith(state_name)}
-        for field_name, field_info in relevant_fields.items():
-            if field_name not in effective_fields and field_name not in generated_fields:
-                if self.protocol_type == 'modbus':
-                    effective_fields[field_name] = self.generate_field_value(field_name, field_info, fuzz)
-                else:
-                    if field_name.endswith(("_topic_filter_B", "_topic_name_B")):
-                        value = self.generate_field_value(field_name, field_info, fuzz)
-                        effective_fields[field_name] = value
-                        length_field_name = field_name.replace("_topic_filter_B", "_topic_filter_length_B").replace("_topic_name_B", "_topic_length_B")
-                        if length_field_name in GLOBAL_RANDOM_FIELDS and length_field_name not in generated_fields:
-                            effective_fields[length_field_name] = hex(len(value.encode('ascii')))
-                            generated_fields.add(length_field_name)
-                            logger.info(f"Generated {length_field_name}: {effective_fields[length_field_name]}")
-                    elif field_name.endswith("_client_id_B"):
-                        value = self.generate_field_value(field_name, field_info, fuzz)
-                        if len(value) > 23:
-                            value = value[:23]
-                        effective_fields[field_name] = value
-                        length_field_name = field_name.replace("_client_id_B", "_client_id_length_B")
-                        if length_field_name in GLOBAL_RANDOM_FIELDS and length_field_name not in generated_fields:
-                            effective_fields[length_field_name] = hex(len(value.encode('ascii')))
-                            generated_fields.add(length_field_name)
-                            logger.info(f"Generated {length_field_name}: {effective_fields[length_field_name]}")
-                    elif field_name.endswith("_remaining_length_B"):
-                        continue
-                    else:
-                        effective_fields[field_name] = self.generate_field_value(field_name, field_info, fuzz)
-                generated_fields.add(field_name)
-                logger.info(f"Generated {field_name}: {effective_fields[field_name]}")
 
         def process_field(field, prefix=""):
             field_role = field.get('field_role', 'field')
@@ -488,7 +1459,7 @@ class PacketGenerator:
                 try:
                     if ':' in length:
                         min_len, max_len = map(int, length.split(':'))
-                        length = min(random.randint(min_len, max_len) if fuzz else min_len, self.MAX_FIELD_LENGTH)
+                        length = min(self.rng.randint(min_len, max_len) if fuzz else min_len, self.MAX_FIELD_LENGTH)
                     else:
                         length = int(length)
                         length = min(length, self.MAX_FIELD_LENGTH)
@@ -507,10 +1478,10 @@ class PacketGenerator:
                 
                 field_bytes = bytearray()
                 if self.protocol_type == "modbus":
-                    if fuzz and random.random() < 0.2 and field_role not in ('slave_id', 'function_code', 'address', 'coil_address', 'register_address', 'quantity', 'coil_value', 'crc'):
+                    if fuzz and self.rng.random() < 0.2 and field_role not in self.MODBUS_PROTECTED_ROLES:
                         logger.debug(f"Fuzzing field {field_name}")
                         for _ in range(length):
-                            field_bytes.append(random.randint(0, 255))
+                            field_bytes.append(self.rng.randint(0, 255))
                     else:
                         try:
                             if field_role != 'crc':  # CRC 在最后处理
@@ -535,7 +1506,7 @@ class PacketGenerator:
                             field_bytes.extend(int(value, 16).to_bytes(2, 'big'))
                         elif '-' in value:
                             min_val, max_val = map(lambda x: int(x, 16), value.split('-'))
-                            val = random.randint(min_val, max_val)
+                            val = self.rng.randint(min_val, max_val)
                             field_bytes.extend(val.to_bytes(length, 'big'))
                         else:
                             field_bytes.extend(self.encode_value(value, encoding, length, field_role))
@@ -552,53 +1523,225 @@ class PacketGenerator:
                     process_field(subfield, f"{field_role}_")
 
         for field in msg['fields']:
-            try:
-                process_field(field)
-            except Exception as e:
-                logger.error(f"Failed to process field {field}: {e}")
-                return None
+            process_field(field)
+        mask = bytearray(len(temp_packet))
+        for j in protected_bytes:
+            mask[j] = 1
+        return temp_packet, mask, remaining_length_fields
+
+    def bulk_field_range(self, field_name, field_info, fuzz):
+        """返回可批量均匀抽取的字段 (最小值, 最大值, 格式化函数)，取值不是均匀整数时返回 None"""
         if self.protocol_type == 'mqtt':
-            if state_name in ('PUBLISH', 'SUBSCRIBE', 'UNSUBSCRIBE', 'CONNECT', 'DISCONNECT'):
-                total_length = 0
-                if state_name == 'PUBLISH':
-                    topic_name = effective_fields.get(f"{state_name}_topic_name_B", self.config['default_topics'][0])
-                    payload = effective_fields.get(f"{state_name}_payload_B", '0x00')
-                    topic_length = len(topic_name.encode('ascii'))
-                    payload_length = 1
-                    packet_id_length = 2 if effective_fields.get(f"{state_name}_packet_id_B") and self.config.get('qos_level', 0) > 0 else 0
-                    total_length = 2 + topic_length + packet_id_length + payload_length
-                elif state_name == 'SUBSCRIBE':
-                    topic_filter = effective_fields.get(f"{state_name}_topic_filter_B", self.config['default_topics'][0])
-                    topic_length = len(topic_filter.encode('ascii'))
-                    total_length = 2 + 2 + topic_length + 1  # packet_id + topic_length + topic + qos
-                elif state_name == 'UNSUBSCRIBE':
-                    topic_filter = effective_fields.get(f"{state_name}_topic_filter_B", self.config['default_topics'][0])
-                    topic_length = len(topic_filter.encode('ascii'))
-                    total_length = 2 + 2 + topic_length  # packet_id + topic_length + topic
-                elif state_name == 'CONNECT':
-                    client_id = effective_fields.get(f"{state_name}_client_id_B", 'test-client-id')
-                    client_id_length = len(client_id.encode('ascii'))
-                    total_length = 2 + 4 + 1 + 1 + 2 + 2 + client_id_length
-                elif state_name == 'DISCONNECT':
-                    total_length = 0  # DISCONNECT has no payload in MQTT 3.1.1
-                
-                encoded_length = self.encode_remaining_length(total_length)
-                for start, end in remaining_length_fields:
-                    temp_packet[start:end] = encoded_length
-                effective_fields[f"{state_name}_remaining_length_B"] = hex(total_length)
-                logger.info(f"Calculated {state_name}_remaining_length_B: {effective_fields[f'{state_name}_remaining_length_B']}")
-            
-        packet.extend(temp_packet)
-        
+            if field_name.endswith("_keep_alive_B"):
+                return (0x0001, 0x003c, "0x{:04x}".format) if fuzz else None
+            if field_name.endswith("_packet_id_B"):
+                return 0x0001, 0xFFFF, "0x{:04x}".format
+            if field_name.endswith(("_topic_name_B", "_topic_filter_B", "_topic_length_B", "_topic_filter_length_B",
+                                    "_client_id_length_B", "_client_id_B", "_connect_flags_B")):
+                return None
+        if self.protocol_type == 'dns' and field_name.startswith(f"{self.current_state}_query_domain_B"):
+            return None
         if self.protocol_type == 'modbus':
-            crc = self.calculate_modbus_crc(packet)
-            if fuzz and random.random() < 0.05:  # 仅 5% 概率模糊 CRC
-                crc = bytes([random.randint(0, 255), random.randint(0, 255)])
-                logger.debug(f"Fuzzing CRC: {crc.hex()}")
-            else:
-                logger.debug(f"Calculated CRC: {crc.hex()}")
-            packet.extend(crc)
-        elif self.protocol_type == 'mqtt':
+            if not fuzz:
+                return None
+            if field_name.endswith("_slave_id_B"):
+                return 1, 247, hex
+            if field_name.endswith(("_address_B", "_coil_address_B", "_register_address_B")):
+                return 0, 65535, hex
+            if field_name.endswith("_quantity_B"):
+                return 1, 125 if "READ_HOLDING_REGISTERS_REQUEST" in field_name else 2000, hex
+            return None
+        bounds = field_info.get('bounds')
+        if not bounds or field_name.endswith("_coil_value_B") or field_info.get('type', 'B') not in ('B', 'H'):
+            return None
+        min_val, max_val = bounds
+        if field_name.endswith("_quantity_B"):
+            if not fuzz:
+                return None
+            max_val = min(max_val, 125 if "READ_HOLDING_REGISTERS_REQUEST" in field_name else 2000)
+        if field_name.endswith(("_coil_value_B", "_quantity_B", "_address_B", "_coil_address_B", "_register_address_B")):
+            return min_val, max_val, "0x{:04x}".format
+        return min_val, max_val, "0x{:02x}".format
+
+    def generate_batch(self, state_name, n, input_fields=None, fuzz=False, contiguous=False):
+        """一次生成 n 个报文。contiguous 为 True 时返回 (连续缓冲区, 偏移数组)，偏移数组长度为报文数加一"""
+        input_fields = input_fields or {}
+        columns = {}
+        if np is not None and n > 1:
+            # 从会话 rng 派生种子，同一种子下整批报文可以复现
+            rng = np.random.default_rng(self.rng.getrandbits(64))
+            for field_name, field_info in GLOBAL_RANDOM_FIELD_INDEX.get(state_name, ()):
+                if field_name in input_fields:
+                    continue
+                bulk = self.bulk_field_range(field_name, field_info, fuzz)
+                if bulk is None:
+                    continue
+                min_val, max_val, fmt = bulk
+                if min_val > max_val:
+                    continue
+                values = rng.integers(min_val, max_val, size=n, endpoint=True)
+                columns[field_name] = list(map(fmt, values.tolist()))
+        packets = []
+        for i in range(n):
+            if columns:
+                fields = dict(input_fields)
+                for field_name, values in columns.items():
+                    fields[field_name] = values[i]
+            else:
+                fields = input_fields
+            packet = self.generate_packet(state_name, fields, fuzz=fuzz)
+            if packet is None:
+                logger.warning(f"Failed to generate packet {i} of batch for {state_name}")
+                continue
+            packets.append(packet)
+        logger.info(f"Generated batch of {len(packets)} packets for {state_name}")
+        if not contiguous:
+            return packets
+        buffer = bytearray(b''.join(packets))
+        offsets = [0]
+        for packet in packets:
+            offsets.append(offsets[-1] + len(packet))
+        if np is not None:
+            offsets = np.asarray(offsets, dtype=np.int64)
+        return buffer, offsets
+
+    def record(self, *event):
+        self.trace.append(self.trace_events.setdefault(event, event))
+
+    def generate_next(self, state_name, input_fields, fuzz_ratio):
+        """按 fuzz_ratio 决定是否变异并生成报文；沿最短路径驱动途中只发送合法报文"""
+        self.record('G', state_name, fuzz_ratio)
+        fuzz = not self.driving and self.rng.random() < fuzz_ratio
+        return self.generate_packet(state_name, input_fields, fuzz=fuzz)
+
+    def discard_last(self):
+        """调用方没有发出最近生成的报文（发送失败或已到时限），重放时同样丢弃"""
+        self.record('X')
+
+    def generate_packet(self, state_name, input_fields=None, fuzz=False):
+        # 每个报文都会经过这里，日志用惰性格式，未开启 DEBUG 时不做字符串拼接
+        logger.debug("Generating packet for state: %s, fuzz: %s", state_name, fuzz)
+        if state_name not in self.client_messages:
+            logger.warning(f"Skipping non-client message: {state_name}")
+            return None
+        
+        if state_name == 'UNSUBSCRIBE' and not self.subscribed_topics:
+            logger.warning("No subscribed topics for UNSUBSCRIBE, skipping")
+            return None
+        
+        msg = self.messages.get(state_name)
+        if not msg:
+            logger.warning(f"No message definition for state {state_name}")
+            return None
+        logger.debug("Message fields for %s: %s", state_name, msg['fields'])
+
+        seeds = self.seed_packets.get(state_name)
+        if seeds and not fuzz and self.rng.random() < self.SEED_RATIO:
+            seed, mask = self.rng.choice(seeds)
+            packet = bytearray(seed)
+            self.last_protected_mask = bytearray(mask)
+            self.history.append((state_name, seed, mask))
+            self.state_history.append(state_name)
+            logger.debug("Using corpus seed for %s: %s", state_name, seed.hex())
+            return packet
+        
+        self.subscribed_topics = getattr(self, 'subscribed_topics', set())
+        input_fields = input_fields or {}
+        effective_fields = input_fields.copy()
+        generated_fields = set()
+        relevant_fields = GLOBAL_RANDOM_FIELD_INDEX.get(state_name, ())
+        for field_name, field_info in relevant_fields:
+            if field_name not in effective_fields and field_name not in generated_fields:
+                if self.protocol_type == 'modbus':
+                    effective_fields[field_name] = self.generate_field_value(field_name, field_info, fuzz)
+                else:
+                    if field_name.endswith(("_topic_filter_B", "_topic_name_B")):
+                        value = self.generate_field_value(field_name, field_info, fuzz)
+                        effective_fields[field_name] = value
+                        length_field_name = field_name.replace("_topic_filter_B", "_topic_filter_length_B").replace("_topic_name_B", "_topic_length_B")
+                        if length_field_name in GLOBAL_RANDOM_FIELDS and length_field_name not in generated_fields:
+                            effective_fields[length_field_name] = hex(len(value.encode('ascii')))
+                            generated_fields.add(length_field_name)
+                            logger.debug("Generated %s: %s", length_field_name, effective_fields[length_field_name])
+                    elif field_name.endswith("_client_id_B"):
+                        value = self.generate_field_value(field_name, field_info, fuzz)
+                        if len(value) > 23:
+                            value = value[:23]
+                        effective_fields[field_name] = value
+                        length_field_name = field_name.replace("_client_id_B", "_client_id_length_B")
+                        if length_field_name in GLOBAL_RANDOM_FIELDS and length_field_name not in generated_fields:
+                            effective_fields[length_field_name] = hex(len(value.encode('ascii')))
+                            generated_fields.add(length_field_name)
+                            logger.debug("Generated %s: %s", length_field_name, effective_fields[length_field_name])
+                    elif field_name.endswith("_remaining_length_B"):
+                        continue
+                    else:
+                        effective_fields[field_name] = self.generate_field_value(field_name, field_info, fuzz)
+                generated_fields.add(field_name)
+                logger.debug("Generated %s: %s", field_name, effective_fields[field_name])
+
+        plan = self.get_encoder_plan(state_name)
+        try:
+            if plan is None or (input_fields and not plan.const_names.isdisjoint(input_fields)):
+                temp_packet, protected_mask, remaining_length_fields = self.encode_fields(state_name, msg, effective_fields, fuzz)
+            else:
+                temp_packet, protected_mask, remaining_length_fields = self.encode_with_plan(plan, effective_fields, fuzz)
+        except Exception as e:
+            logger.error(f"Failed to encode fields of {state_name}: {e}")
+            return None
+        mutated = fuzz and self.mutator is not None
+        if mutated:
+            temp_packet, protected_mask, remaining_length_fields = self.havoc(state_name, temp_packet, protected_mask, remaining_length_fields)
+        if self.protocol_type == 'mqtt' and mutated:
+            # 变异可能增删字节，剩余长度按实际报文长度重新编码
+            for start, end in remaining_length_fields[:1]:
+                encoded_length = self.encode_remaining_length(len(temp_packet) - end)
+                temp_packet[start:end] = encoded_length
+                protected_mask[start:end] = b'\x01' * len(encoded_length)
+        elif self.protocol_type == 'mqtt':
+            if state_name in ('PUBLISH', 'SUBSCRIBE', 'UNSUBSCRIBE', 'CONNECT', 'DISCONNECT'):
+                total_length = 0
+                if state_name == 'PUBLISH':
+                    topic_name = effective_fields.get(f"{state_name}_topic_name_B", self.config['default_topics'][0])
+                    payload = effective_fields.get(f"{state_name}_payload_B", '0x00')
+                    topic_length = len(topic_name.encode('ascii'))
+                    payload_length = 1
+                    packet_id_length = 2 if effective_fields.get(f"{state_name}_packet_id_B") and self.config.get('qos_level', 0) > 0 else 0
+                    total_length = 2 + topic_length + packet_id_length + payload_length
+                elif state_name == 'SUBSCRIBE':
+                    topic_filter = effective_fields.get(f"{state_name}_topic_filter_B", self.config['default_topics'][0])
+                    topic_length = len(topic_filter.encode('ascii'))
+                    total_length = 2 + 2 + topic_length + 1  # packet_id + topic_length + topic + qos
+                elif state_name == 'UNSUBSCRIBE':
+                    topic_filter = effective_fields.get(f"{state_name}_topic_filter_B", self.config['default_topics'][0])
+                    topic_length = len(topic_filter.encode('ascii'))
+                    total_length = 2 + 2 + topic_length  # packet_id + topic_length + topic
+                elif state_name == 'CONNECT':
+                    client_id = effective_fields.get(f"{state_name}_client_id_B", 'test-client-id')
+                    client_id_length = len(client_id.encode('ascii'))
+                    total_length = 2 + 4 + 1 + 1 + 2 + 2 + client_id_length
+                elif state_name == 'DISCONNECT':
+                    total_length = 0  # DISCONNECT has no payload in MQTT 3.1.1
+                
+                encoded_length = self.encode_remaining_length(total_length)
+                for start, end in remaining_length_fields:
+                    temp_packet[start:end] = encoded_length
+                    protected_mask[start:end] = b'\x01' * len(encoded_length)
+                effective_fields[f"{state_name}_remaining_length_B"] = hex(total_length)
+                logger.debug("Calculated %s_remaining_length_B: %s", state_name, effective_fields[f"{state_name}_remaining_length_B"])
+            
+        packet = temp_packet
+        self.last_protected_mask = protected_mask
+        
+        if self.protocol_type == 'modbus':
+            crc = self.calculate_modbus_crc(packet)
+            if fuzz and self.rng.random() < 0.05:  # 仅 5% 概率模糊 CRC
+                crc = bytes([self.rng.randint(0, 255), self.rng.randint(0, 255)])
+                logger.debug("Fuzzing CRC: %s", crc.hex())
+            else:
+                logger.debug("Calculated CRC: %s", crc.hex())
+            packet.extend(crc)
+        elif self.protocol_type == 'mqtt':
             if state_name == 'SUBSCRIBE' and packet:
                 topic = effective_fields.get(f"{state_name}_topic_filter_B", self.config['default_topics'][0])
                 if topic not in self.subscribed_topics:
@@ -609,71 +1752,162 @@ class PacketGenerator:
                 if topic in self.subscribed_topics:
                     self.subscribed_topics.remove(topic)
                     logger.info(f"Removed subscribed topic: {topic}")
-        logger.debug(f"Generated packet: {packet.hex()}")
+        self.state_history.append(state_name)
+        if self.corpus is not None:
+            self.history.append((state_name, bytes(packet), bytes(self.last_protected_mask)))
+        logger.debug("Generated packet: %s", packet.hex())
         return packet
 
+    def havoc(self, state_name, packet, mask, remaining_length_fields):
+        """对编码结果做 havoc 变异，返回 (报文, 掩码, 变异后的剩余长度字段位置)。
+        剩余长度字段在掩码中临时标为 2，随报文增删后重新定位；Modbus 从站地址决定响应归属，不参与变异；
+        MQTT 报文没有剩余长度字段时长度固定，只做原位变异"""
+        for start, end in remaining_length_fields:
+            mask[start:end] = b'\x02' * (end - start)
+        if self.protocol_type == 'modbus' and mask:
+            mask[0] = 1
+        donors = self.seed_packets.get(state_name)
+        resizable = self.protocol_type != 'mqtt' or bool(remaining_length_fields)
+        packet, mask = self.mutator.mutate(packet, mask, donors, resizable)
+        fields = []
+        start = mask.find(2)
+        while start != -1:
+            end = start
+            while end < len(mask) and mask[end] == 2:
+                end += 1
+            fields.append((start, end))
+            start = mask.find(2, end)
+        return packet, bytearray(mask.replace(b'\x02', b'\x01')), fields
+
+    def get_function_code_map(self):
+        if self.function_code_map is None:
+            function_code_map = {}
+            for msg_name, msg in self.messages.items():
+                if msg['role'] != 'server':
+                    continue
+                for field in msg['fields']:
+                    if field['kind'] == 'constant' and field.get('field_role') == 'function_code' and field.get('type') == 'B':
+                        try:
+                            function_code_map.setdefault(int(field['value'], 16), msg_name)
+                        except ValueError:
+                            continue
+            self.function_code_map = function_code_map
+        return self.function_code_map
+
+    def path_to(self, target, source=None):
+        """返回从 source（默认当前状态）到 target 的最短状态序列，不可达时返回 None"""
+        source = source or self.current_state
+        if source == 'INIT_STATE' and source not in self.shortest_paths:
+            source = 'INIT'
+        return self.shortest_paths.get(source, {}).get(target)
+
+    def drive_to(self, target):
+        """设定驱动目标：之后 select_next_state 沿最短路径前进直到到达 target，途中报文不做变异；target 为 None 时取消"""
+        self.record('D', target)
+        if target is not None and target not in self.coverage.states:
+            logger.warning(f"Unknown target state {target}, ignoring")
+            return False
+        self.target_state = target
+        self.driving = target is not None and self.current_state != target
+        return True
+
+    def reset_state(self):
+        """把状态机模型退回初始状态（设定了分叉点时退回分叉点），不向目标发送报文；
+        设定了驱动目标时重新沿最短路径驱动过去"""
+        self.record('R')
+        self.current_state = self.fork_state or 'INIT_STATE'
+        self.driving = self.target_state is not None
+        self.history.clear()
+        self.state_history.clear()
+        self.state_history.extend(self.fork_history)
+
+    def fork_at(self, state, prefix):
+        """把分叉点设为 state，prefix 为从初始状态到达 state 的客户端报文状态序列。这里只改动生成器的模型：
+        目标端的状态靠 Fuzzer 在每次（重新）连接后按 prefix 重放报文到达，之后的复位都把模型退回 state"""
+        self.record('F', state)
+        self.fork_state = state
+        self.fork_prefix = tuple(prefix)
+        self.fork_history = ()
+        self.reset_state()
+
+    def generate_prefix_packet(self, state_name, input_fields):
+        """重放前缀时生成不变异的报文，客户端 ID 等会话相关字段按本会话配置生成"""
+        self.record('P', state_name)
+        return self.generate_packet(state_name, input_fields, fuzz=False)
+
+    def attach_corpus(self, corpus):
+        """接入语料库：之后的新响应签名连同请求序列写入语料库，生成报文时按 SEED_RATIO 复用已有语料"""
+        self.corpus = corpus
+        self.seed_packets = corpus.seeds() if corpus is not None else {}
+
+    def next_drive_state(self, received_msg):
+        # 收到响应时由服务端实际发送的报文决定状态，下一步再从新状态重新查表
+        if not self.driving or received_msg is not None:
+            return None
+        path = self.path_to(self.target_state)
+        if not path:
+            logger.warning(f"Target state {self.target_state} is unreachable from {self.current_state}, continuing random walk")
+            self.driving = False
+            return None
+        self.current_state = path[0]
+        return path[0]
+
     def select_next_state(self, received_msg=None):
         with self.state_lock:
-            if self.current_state == 'INIT_STATE' and self.protocol_type == 'mqtt':
-                self.current_state = 'CONNECT'
-                logger.debug(f"Forced transition from INIT_STATE to CONNECT for MQTT")
-                return self.current_state
-            transitions = self.state_machine.get(self.current_state, {}).get('transitions', [])
-            if not transitions:
-                logger.warning(f"No transitions for {self.current_state}")
-                if self.client_messages:
-                    next_state = random.choice(list(self.client_messages))
-                    logger.debug(f"Defaulting to {next_state}")
-                    return next_state
-                return None
-            valid_transitions = transitions
-            if received_msg and received_msg in self.messages:
-                valid_transitions = [
-                    t for t in transitions
-                    if t['next_state'] == received_msg and t.get('next_role') == self.messages[received_msg].get('role')
-                ]
-            if not valid_transitions and self.current_state in self.server_messages:
-                next_state = 'CONNECT' if self.protocol_type == 'mqtt' else random.choice(list(self.client_messages))
-                logger.warning(f"No valid transition from server state {self.current_state}, forcing to {next_state}")
-                return next_state
-            client_transitions = [t for t in valid_transitions if t['next_state'] in self.client_messages]
-            if client_transitions:
-                candidates = [t['next_state'] for t in client_transitions]
-                logger.debug(f"Available client transitions from {self.current_state}: {candidates}")
-                next_state = random.choice(candidates)
-            else:
-                candidates = [t['next_state'] for t in valid_transitions] if valid_transitions else ['CONNECT' if self.protocol_type == 'mqtt' else 'INIT'] 
-                logger.debug(f"Falling back to candidates: {candidates}")
-                next_state = random.choice(candidates)
-            logger.debug(f"Selected next state: {next_state}")
-            self.current_state = next_state
+            self.record('S', received_msg)
+            previous_state = self.current_state
+            next_state = self.next_drive_state(received_msg) or self.choose_next_state(received_msg)
+            if next_state:
+                self.coverage.record(previous_state, next_state)
+                if received_msg is not None and 0 < len(self.state_history) < self.state_history.maxlen:
+                    # 历史未被截断时才是完整的前缀，只保留最短的一条
+                    prefix = self.prefixes.get(next_state)
+                    if prefix is None or len(self.state_history) < len(prefix):
+                        self.prefixes[next_state] = tuple(self.state_history)
+                if self.driving and next_state == self.target_state:
+                    self.driving = False
+                    self.drives_completed += 1
+                    logger.debug(f"Reached target state {next_state}")
             return next_state
 
-    def identify_message(self, data, dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol):
-        if not data or len(data) < 1:
-            return None
-        if self.protocol_type == 'modbus':
-            if len(data) < 4:
-                return None
-            slave_id = data[0]
-            function_code = data[1]
-            crc = data[-2:]
-            expected_crc = self.calculate_modbus_crc(data[:-2])
-            if crc != expected_crc:
-                logger.warning(f"Invalid Modbus CRC: received {crc.hex()}, expected {expected_crc.hex()}")
-            for msg_name, msg in self.messages.items():
-                if msg['role'] == 'server':
-                    for field in msg['fields']:
-                        if field['kind'] == 'constant' and field.get('field_role') == 'function_code' and field.get('type') == 'B':
-                            try:
-                                value = int(field['value'], 16)
-                                if value == function_code:
-                                    return msg_name
-                            except ValueError:
-                                continue
-            if function_code >= 0x80:
-                return 'EXCEPTION_RESPONSE'
+    def choose_next_state(self, received_msg):
+        """在候选转移中按覆盖率加权选择下一状态，调用方持有 state_lock"""
+        if self.current_state == 'INIT_STATE' and self.protocol_type == 'mqtt':
+            self.current_state = 'CONNECT'
+            logger.debug(f"Forced transition from INIT_STATE to CONNECT for MQTT")
+            return self.current_state
+        transitions = self.state_machine.get(self.current_state, {}).get('transitions', [])
+        if not transitions:
+            logger.warning(f"No transitions for {self.current_state}")
+            if self.client_messages:
+                next_state = self.coverage.choose(self.current_state, list(self.client_messages), self.rng)
+                logger.debug(f"Defaulting to {next_state}")
+                return next_state
             return None
+        valid_transitions = transitions
+        if received_msg and received_msg in self.messages:
+            valid_transitions = [
+                t for t in transitions
+                if t['next_state'] == received_msg and t.get('next_role') == self.messages[received_msg].get('role')
+            ]
+        if not valid_transitions and self.current_state in self.server_messages:
+            next_state = 'CONNECT' if self.protocol_type == 'mqtt' else self.coverage.choose(self.current_state, list(self.client_messages), self.rng)
+            logger.warning(f"No valid transition from server state {self.current_state}, forcing to {next_state}")
+            return next_state
+        client_transitions = [t for t in valid_transitions if t['next_state'] in self.client_messages]
+        if client_transitions:
+            candidates = [t['next_state'] for t in client_transitions]
+            logger.debug(f"Available client transitions from {self.current_state}: {candidates}")
+            next_state = self.coverage.choose(self.current_state, candidates, self.rng)
+        else:
+            candidates = [t['next_state'] for t in valid_transitions] if valid_transitions else ['CONNECT' if self.protocol_type == 'mqtt' else 'INIT'] 
+            logger.debug(f"Falling back to candidates: {candidates}")
+            next_state = self.coverage.choose(self.current_state, candidates, self.rng)
+        logger.debug(f"Selected next state: {next_state}")
+        self.current_state = next_state
+        return next_state
+
+    def identify_with_pyshark(self, data, dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol):
         temp_pcap = f"temp_{uuid.uuid4().hex}.pcap"
         try:
             pcap_writer = RawPcapWriter(temp_pcap, linktype=1)
@@ -707,83 +1941,528 @@ class PacketGenerator:
         finally:
             if os.path.exists(temp_pcap):
                 os.remove(temp_pcap)
-        def match_fields(fields, offset=0):
-            for field in fields:
-                field_length = field.get('length', '1')
-                if ':' in field_length:
-                    min_len, _ = map(int, field_length.split(':'))
-                    field_length = min_len
-                else:
-                    field_length = int(field_length)
-                if offset + field_length > len(data):
-                    return False, offset
-                if field['kind'] == 'constant':
-                    expected_value = field.get('value')
-                    if expected_value.startswith('0x'):
-                        expected_value = int(expected_value, 16)
-                        actual_value = int.from_bytes(data[offset:offset + field_length], 'big')
-                        if expected_value != actual_value:
-                            return False, offset
-                    elif expected_value.startswith('0b'):
-                        expected_value = int(expected_value, 2)
-                        actual_value = int.from_bytes(data[offset:offset + field_length], 'big')
-                        if expected_value != actual_value:
-                            return False, offset
-                    offset += field_length
-                elif field['kind'] == 'variable':
-                    offset += field_length
-                elif field['kind'] == 'field':
-                    match, new_offset = match_fields(field['subfields'], offset)
-                    if not match:
-                        return False, offset
-                    offset = new_offset
-            return True, offset
-        for msg_name, msg in self.messages.items():
-            msg_fields = msg['fields']
-            if len(data) < sum(int(f.get('length', '1').split(':')[0]) for f in msg_fields if ':' not in f.get('length', '1')):
-                continue
-            match, _ = match_fields(msg_fields)
-            if match:
+        return None
+
+    def identify_message(self, data, dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol):
+        """识别响应报文名；接入语料库时同时按响应签名记录新出现的响应"""
+        msg_name = self.match_message(data, dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol)
+        if self.corpus is not None and data:
+            if self.corpus.observe(msg_name, response_signature(self.protocol_type, msg_name, data), self.history):
+                self.new_signatures += 1
+                logger.info(f"New response signature for {msg_name}, corpus size {self.corpus.size}")
+        return msg_name
+
+    def match_message(self, data, dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol):
+        if not data or len(data) < 1:
+            return None
+        dissector = DISSECTORS.get(self.protocol_type)
+        if dissector:
+            msg_name = dissector(self, data)
+            if msg_name or self.protocol_type == 'modbus':
+                return msg_name
+        if self.use_pyshark:
+            msg_name = self.identify_with_pyshark(bytes(data), dest_mac, source_mac, target_ip, source_ip, target_port, source_port, protocol)
+            if msg_name:
                 return msg_name
+        msg_name = self.classifier.classify(data)
+        if msg_name:
+            return msg_name
         if self.protocol_type == 'mqtt' and len(data) >= 2 and data[0] == 0x20:
             return 'CONNACK'
-        first_byte = data[0]
-        for msg_name, msg in self.messages.items():
-            for field in msg['fields']:
-                if field['kind'] == 'constant' and field['type'] == 'B' and field.get('field_role') == 'field':
+        return self.classifier.first_byte_map.get(data[0])
+
+def checksum_fold(total):
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+def checksum_sum(data):
+    """按大端 16 位字做反码累加并折叠为 16 位，用于 IP/TCP/UDP 校验和"""
+    if len(data) % 2:
+        data = bytes(data) + b'\x00'
+    total = checksum_fold(sum(array.array('H', bytes(data))))
+    if sys.byteorder == 'little':
+        total = ((total & 0xFF) << 8) | (total >> 8)
+    return total
+
+class FrameTemplate:
+    """单个方向的以太网/IP/TCP|UDP 头模板，只需补齐长度和校验和"""
+    __slots__ = ('header', 'header_length', 'is_udp', 'ip_sum', 'l4_sum')
+
+    def __init__(self, src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport):
+        self.is_udp = transport == 'udp'
+        eth = bytes.fromhex(dst_mac.replace(':', '')) + bytes.fromhex(src_mac.replace(':', '')) + b'\x08\x00'
+        # 与 scapy 一致：地址可以是主机名，未设置时视为本地回环
+        src_addr = socket.inet_aton(socket.gethostbyname(src_ip or '127.0.0.1'))
+        dst_addr = socket.inet_aton(socket.gethostbyname(dst_ip or '127.0.0.1'))
+        proto = 17 if self.is_udp else 6
+        # 与 scapy 默认值一致：IP id=1、ttl=64；TCP flags=S、window=8192
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 0, 1, 0, 64, proto, 0, src_addr, dst_addr)
+        if self.is_udp:
+            l4 = struct.pack('!HHHH', sport, dport, 0, 0)
+        else:
+            l4 = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 0x50, 0x02, 8192, 0, 0)
+        self.header = eth + ip + l4
+        self.header_length = len(self.header)
+        self.ip_sum = checksum_sum(ip)
+        self.l4_sum = checksum_sum(src_addr + dst_addr + struct.pack('!BB', 0, proto) + l4)
+
+class FramePcapWriter:
+    """轻量 pcap 写入器：按方向缓存帧头模板，用 struct.pack_into 在复用缓冲区中补齐长度、校验和与时间戳"""
+    RECORD_HEADER = struct.Struct('<IIII')
+    ETH_LENGTH = 14
+    IP_LENGTH = 20
+
+    def __init__(self, filename, linktype=1, snaplen=0xFFFF, bufsz=4096):
+        self.filename = filename
+        self.f = open(filename, 'wb', bufsz)
+        self.f.write(struct.pack('<IHHIIII', 0xa1b2c3d4, 2, 4, 0, 0, snaplen, linktype))
+        self.templates = {}
+        self.buffer = bytearray(2048)
+
+    def get_template(self, src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport):
+        key = (src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport)
+        template = self.templates.get(key)
+        if template is None:
+            template = FrameTemplate(src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport)
+            self.templates[key] = template
+        return template
+
+    def write_frame(self, src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport, payload, timestamp=None):
+        template = self.get_template(src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport)
+        payload_length = len(payload)
+        frame_length = template.header_length + payload_length
+        total = self.RECORD_HEADER.size + frame_length
+        if len(self.buffer) < total:
+            self.buffer = bytearray(total * 2)
+        buf = self.buffer
+        base = self.RECORD_HEADER.size
+        buf[base:base + template.header_length] = template.header
+        buf[base + template.header_length:base + frame_length] = payload
+
+        ip_offset = base + self.ETH_LENGTH
+        l4_offset = ip_offset + self.IP_LENGTH
+        ip_length = frame_length - self.ETH_LENGTH
+        l4_length = ip_length - self.IP_LENGTH
+        ip_checksum = checksum_fold(template.ip_sum + ip_length)
+        struct.pack_into('!H', buf, ip_offset + 2, ip_length)
+        struct.pack_into('!H', buf, ip_offset + 10, ~ip_checksum & 0xFFFF)
+        l4_sum = template.l4_sum + l4_length + checksum_sum(payload)
+        if template.is_udp:
+            l4_checksum = ~checksum_fold(l4_sum + l4_length) & 0xFFFF
+            struct.pack_into('!HH', buf, l4_offset + 4, l4_length, l4_checksum or 0xFFFF)
+        else:
+            struct.pack_into('!H', buf, l4_offset + 16, ~checksum_fold(l4_sum) & 0xFFFF)
+
+        self.pack_record_header(buf, frame_length, timestamp)
+        self.f.write(memoryview(buf)[:total])
+
+    def write_raw(self, frame, timestamp=None):
+        header = bytearray(self.RECORD_HEADER.size)
+        self.pack_record_header(header, len(frame), timestamp)
+        self.f.write(header)
+        self.f.write(frame)
+
+    def pack_record_header(self, buf, length, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        sec = int(timestamp)
+        usec = int(round((timestamp - sec) * 1_000_000))
+        self.RECORD_HEADER.pack_into(buf, 0, sec, usec, length, length)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class PcapSink:
+    """后台线程批量写 pcap：收发循环只把帧放入有界队列，不直接做文件 I/O"""
+    DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+    STOP = object()
+    FLUSH = object()
+
+    def __init__(self, writer, max_queue=16384, flush_interval=0.5, batch_size=256, drop_policy='drop_newest', block_timeout=None):
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError(f"Unsupported drop policy: {drop_policy}")
+        self.writer = writer
+        self.filename = writer.filename
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'flushes': 0, 'max_depth': 0, 'errors': 0}
+        # stats 同时被收发线程和后台写线程修改，统一加锁
+        self.stats_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name=f"pcap-sink-{os.path.basename(self.filename)}", daemon=True)
+        self.thread.start()
+
+    def write_frame(self, src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport, payload, timestamp=None):
+        # 时间戳在入队时确定，保证 pcap 中记录的是实际收发时间
+        fields = (src_mac, dst_mac, src_ip, dst_ip, transport, sport, dport)
+        self.put(('frame', fields, bytes(payload), timestamp if timestamp is not None else time.time()))
+
+    def write_raw(self, frame, timestamp=None):
+        self.put(('raw', None, bytes(frame), timestamp if timestamp is not None else time.time()))
+
+    def count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def snapshot(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def put(self, item):
+        if self.closed:
+            raise ValueError("PCAP sink is closed")
+        if self.drop_policy == 'block':
+            try:
+                self.queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self.count('dropped')
+                return
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    if self.drop_policy == 'drop_newest':
+                        self.count('dropped')
+                        return
                     try:
-                        value = int(field['value'], 16)
-                        if value == first_byte:
-                            return msg_name
-                    except ValueError:
-                        continue
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self.count('dropped')
+                    except queue.Empty:
+                        pass
+        depth = self.queue.qsize()
+        with self.stats_lock:
+            self.stats['enqueued'] += 1
+            if depth > self.stats['max_depth']:
+                self.stats['max_depth'] = depth
+
+    def run(self):
+        last_flush = time.time()
+        pending = 0
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            batch = [] if item is None else [item]
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            flush_now = False
+            written = errors = 0
+            for entry in batch:
+                if entry is self.STOP:
+                    stop = True
+                    continue
+                if entry is self.FLUSH:
+                    flush_now = True
+                    continue
+                kind, fields, payload, timestamp = entry
+                try:
+                    if kind == 'frame':
+                        self.writer.write_frame(*fields, payload, timestamp=timestamp)
+                    else:
+                        self.writer.write_raw(payload, timestamp=timestamp)
+                    written += 1
+                except Exception as e:
+                    errors += 1
+                    logger.error(f"PCAP sink write failed: {e}")
+            pending += written
+            now = time.time()
+            flushed = False
+            if pending and (stop or flush_now or now - last_flush >= self.flush_interval):
+                self.writer.flush()
+                flushed = True
+                pending = 0
+                last_flush = now
+            with self.stats_lock:
+                self.stats['written'] += written
+                self.stats['errors'] += errors
+                self.stats['batches'] += bool(batch)
+                self.stats['flushes'] += flushed
+            # 写入并落盘后才确认，flush() 中的 queue.join() 据此等待队列排空
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """阻塞到调用前入队的帧全部写入并落盘"""
+        if self.closed:
+            return
+        self.queue.put(self.FLUSH)
+        self.queue.join()
+
+    def close(self):
+        if self.closed:
+            return self.snapshot()
+        self.closed = True
+        self.queue.put(self.STOP)
+        self.thread.join()
+        self.writer.flush()
+        self.writer.close()
+        stats = self.snapshot()
+        logger.info(f"PCAP sink closed: {stats}")
+        return stats
+
+class Pacer:
+    """令牌桶发包节奏控制：rate 为每秒报文数（None 表示不限速），burst 为桶容量；
+    adaptive 为 True 时按响应时延做乘性退避、加性恢复"""
+    LATENCY_FACTOR = 2.0
+    LATENCY_MARGIN = 0.005
+    BACKOFF = 0.7
+    RECOVERY_STEP = 0.05
+    ADJUST_INTERVAL = 0.5
+
+    def __init__(self, rate=None, burst=1, adaptive=False, min_rate=1.0):
+        if rate is not None and rate <= 0:
+            rate = None
+        self.target_rate = rate
+        self.rate = rate
+        self.burst = max(1, int(burst))
+        self.adaptive = adaptive and rate is not None
+        if adaptive and rate is None:
+            logger.warning("Adaptive pacing needs a target rate, running unpaced")
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.start = None
+        self.sent = 0
+        self.waited = 0.0
+        self.latency_ewma = None
+        self.latency_floor = None
+        self.last_adjust = 0.0
+        self.backoffs = 0
+
+    def reserve(self):
+        """取一个令牌，返回发送前需要等待的秒数"""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        self.sent += 1
+        if self.rate is None:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        self.waited += delay
+        return delay
+
+    def wait(self, max_wait=None):
+        delay = self.reserve()
+        if max_wait is not None:
+            delay = min(delay, max(0.0, max_wait))
+        if delay > 0:
+            time.sleep(delay)
+
+    def observe_latency(self, latency):
+        if not self.adaptive:
+            return
+        self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma * 0.8 + latency * 0.2
+        self.latency_floor = latency if self.latency_floor is None else min(self.latency_floor, latency)
+        now = time.monotonic()
+        if now - self.last_adjust < self.ADJUST_INTERVAL:
+            return
+        self.last_adjust = now
+        if self.latency_ewma > self.latency_floor * self.LATENCY_FACTOR + self.LATENCY_MARGIN:
+            self.rate = max(self.min_rate, self.rate * self.BACKOFF)
+            self.backoffs += 1
+            logger.debug(f"Response latency {self.latency_ewma * 1000:.1f} ms, backing off to {self.rate:.1f} pps")
+        elif self.rate < self.target_rate:
+            self.rate = min(self.target_rate, self.rate + self.target_rate * self.RECOVERY_STEP)
+
+    def report(self):
+        elapsed = time.monotonic() - self.start if self.start is not None else 0.0
+        return {
+            'target_rate': self.target_rate,
+            'current_rate': self.rate,
+            'achieved_rate': self.sent / elapsed if elapsed > 0 else 0.0,
+            'paced': self.sent,
+            'waited': self.waited,
+            'backoffs': self.backoffs
+        }
+
+def create_pacer(input_fields):
+    """按输入字段 rate/burst/adaptive 创建节奏控制器，rate 为 0 或 max 时不限速"""
+    rate = input_fields.get("rate", Fuzzer.DEFAULT_RATE)
+    try:
+        rate = None if rate in (None, "", "max") else float(rate)
+        burst = int(input_fields.get("burst") or 1)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid pacing parameters rate={input_fields.get('rate')} burst={input_fields.get('burst')}, using defaults")
+        rate, burst = Fuzzer.DEFAULT_RATE, 1
+    adaptive = str(input_fields.get("adaptive", "")).lower() in ("1", "true", "yes", "on")
+    return Pacer(rate=rate, burst=burst, adaptive=adaptive)
+
+class ModbusRTUFramer:
+    """按 Modbus RTU 规范切分串口响应帧：功能码确定帧长时收满即返回，否则以 3.5 字符静默间隔作为帧边界"""
+    BITS_PER_CHAR = 11  # 起始位 + 8 数据位 + 校验位/第二停止位 + 停止位
+    FIXED_SILENCE = 0.00175  # 波特率高于 19200 时规范规定的固定 t3.5
+
+    def __init__(self, serial_port, baudrate, response_timeout=2.0):
+        self.serial = serial_port
+        self.response_timeout = response_timeout
+        if baudrate > 19200:
+            self.silence = self.FIXED_SILENCE
+        else:
+            self.silence = 3.5 * self.BITS_PER_CHAR / baudrate
+        # pyserial 每次给 timeout 赋值都会重新配置串口，超时固定为响应超时，只在与当前值不同时设置一次；
+        # 首字节靠阻塞 read(1) 等待，帧内只读取 in_waiting 中已到达的字节，不再依赖串口超时
+        if self.serial.timeout != self.response_timeout:
+            self.serial.timeout = self.response_timeout
+
+    @staticmethod
+    def expected_length(frame):
+        """根据已收到的帧头推算完整帧长（含 CRC），尚无法确定时返回 None"""
+        if len(frame) < 2:
+            return None
+        function_code = frame[1]
+        if function_code & 0x80:
+            return 5  # 从站 ID + 功能码 + 异常码 + CRC
+        if function_code in (0x01, 0x02, 0x03, 0x04):
+            return 5 + frame[2] if len(frame) >= 3 else None  # 字节计数之后跟数据和 CRC
+        if function_code in (0x05, 0x06, 0x0F, 0x10):
+            return 8  # 回显地址和数量/取值
         return None
 
+    def read_frame(self):
+        # 阻塞等待首字节，字节一到 read 立即返回，超过响应超时仍无数据视为无响应
+        first = self.serial.read(1)
+        if not first:
+            return None
+        frame = bytearray(first)
+        while True:
+            expected = self.expected_length(frame)
+            if expected is not None and len(frame) >= expected:
+                break
+            waiting = self.serial.in_waiting
+            if not waiting:
+                time.sleep(self.silence)
+                waiting = self.serial.in_waiting
+                if not waiting:
+                    break  # t3.5 内没有新字符，帧结束
+            if expected is not None:
+                waiting = min(waiting, expected - len(frame))
+            frame.extend(self.serial.read(waiting))
+        return bytes(frame)
+
+def new_campaign_coverage(cache, protocol_type):
+    """为一次测试创建覆盖率统计，并登记为该协议 IR 的当前覆盖率"""
+    coverage = StateCoverage(cache["state_machine"])
+    IR_COVERAGE[protocol_type] = coverage
+    return coverage
+
+def campaign_seed(input_fields):
+    """读取 seed 输入字段作为测试种子，未指定或非法时随机生成；种子写入统计信息，用于复现和重放"""
+    seed = (input_fields or {}).get("seed")
+    if seed not in (None, ""):
+        try:
+            return int(seed, 0) if isinstance(seed, str) else int(seed)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid seed {seed}, using a random one")
+    return random.SystemRandom().getrandbits(32)
+
+def session_seed(seed, session_id):
+    """由测试种子派生各会话的种子：同一测试种子下各会话序列互不相同，且只依赖种子和会话编号"""
+    if session_id is None:
+        return seed
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{session_id}".encode(), digest_size=8).digest(), 'big')
+
+def create_generator(cache, protocol_type, coverage=None, seed=None):
+    """按解析缓存创建生成器，同一协议的生成器共享编码计划和分类器；
+    未传入 coverage 时新建一份覆盖率统计，多会话测试应传入共享实例"""
+    return PacketGenerator(
+        cache["messages"],
+        cache["state_machine"],
+        cache["client_messages"],
+        cache["server_messages"],
+        protocol_type,
+        encoder_plans=cache["encoder_plans"].setdefault(protocol_type, {}),
+        classifier=cache["classifier"],
+        coverage=coverage or new_campaign_coverage(cache, protocol_type),
+        shortest_paths=cache["shortest_paths"],
+        seed=seed
+    )
+
+def new_session_stats():
+    return {'iterations': 0, 'sent': 0, 'received': 0, 'send_failures': 0, 'no_response': 0, 'reconnects': 0,
+            'disconnects': 0, 'keepalive_probes': 0, 'prefix_replays': 0, 'messages': {}}
+
+def count_session_message(stats, msg_name):
+    messages = stats['messages']
+    messages[str(msg_name)] = messages.get(str(msg_name), 0) + 1
+
 class Fuzzer:
-    def __init__(self, target_ip, target_port, protocol, cache, protocol_type):
+    PCAP_QUEUE_SIZE = 16384
+    PCAP_FLUSH_INTERVAL = 0.5
+    PCAP_DROP_POLICY = 'drop_newest'
+    DEFAULT_RATE = 1000.0  # 每秒报文数；锁步模式本就受响应时延限制，这里只防止流水线/批量模式失控，需要更慢时由 rate 指定
+    KEEPALIVE_IDLE = 5.0  # 空闲超过该秒数才做一次存活探测，None 表示关闭
+    MODBUS_BAUDRATE = 19200
+    MODBUS_RESPONSE_TIMEOUT = 2.0  # 等待响应首字节的时间，帧内以 t3.5 静默判定结束
+    CRASH_HISTORY = 32  # 判定目标崩溃或挂起时保存的最近发送报文数
+    EMPTY_ROUND_BACKOFF = (0.001, 0.05)  # 批量模式一轮没有生成出报文时的退避等待，逐轮加倍直到上限
+    PROBE_TIMEOUT = 5.0
+
+    def __init__(self, target_ip, target_port, protocol, cache, protocol_type, session_id=None, source_port=None,
+                 serial_port=None, slave_ids=None, seed=None, coverage=None):
         self.target_ip = target_ip
-        self.target_port = DEST_PORT if protocol_type == 'modbus' else int(target_port)  # Modbus 使用固定端口
-        self.serial_port = "/dev/ttyS1" if protocol_type == 'modbus' else None
         self.protocol = protocol.lower()
         self.protocol_type = protocol_type.lower()
-        self.generator = PacketGenerator(
-            cache["messages"],
-            cache["state_machine"],
-            cache["client_messages"],
-            cache["server_messages"],
-            protocol_type
-        )
+        # Modbus 默认走串口 RTU；protocol 为 tcp 时使用带 MBAP 头的 Modbus/TCP
+        self.modbus_tcp = self.protocol_type == 'modbus' and self.protocol == 'tcp'
+        self.serial_link = self.protocol_type == 'modbus' and not self.modbus_tcp
+        if self.protocol_type == 'modbus':
+            self.target_port = int(target_port) if self.modbus_tcp and target_port else DEST_PORT
+        else:
+            self.target_port = int(target_port)
+        self.serial_port = (serial_port or "/dev/ttyS1") if self.serial_link else None
+        self.cache = cache
+        self.generator = create_generator(cache, self.protocol_type, coverage, seed=seed)
+        self.recent_packets = deque(maxlen=self.CRASH_HISTORY)  # 最近发送的 (状态名, 报文)，Modbus 为不带 MBAP 头的 RTU 帧
+        self.connect_failures = 0
+        # 源端口、事务 ID 等传输层随机值单独取一路随机数，不打乱生成器的决策序列
+        self.transport_rng = random.Random(f"{self.generator.seed}/transport")
         self.sock = None
         self.serial = None
+        self.rtu_framer = None
         self.connected = False
         self.lock = threading.Lock()
-        self.source_ip = SOURCE_IP if protocol_type == 'modbus' else "127.0.0.1"
-        self.source_port = SOURCE_PORT if protocol_type == 'modbus' else random.randint(1024, 65535)
+        self.source_ip = SOURCE_IP if self.serial_link else "127.0.0.1"
+        self.source_port = (source_port or SOURCE_PORT) if self.serial_link else source_port or self.transport_rng.randint(1024, 65535)
+        self.transaction_id = 0
+        self.last_sent_frame = b''
+        self.session_id = session_id
+        if slave_ids:
+            self.generator.config['slave_ids'] = list(slave_ids)
+        self.last_slave_id = None
+        if session_id is not None and self.protocol_type == 'mqtt':
+            # 并行会话使用不同的客户端 ID，避免 broker 互相踢掉同名连接
+            self.generator.config['default_client_id'] = f"{self.generator.config['default_client_id']}-{session_id}"[:23]
         self.pcap_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
         os.makedirs("outpcap", exist_ok=True)
         self.source_mac = SOURCE_MAC
         self.dest_mac = DEST_MAC
         self.is_multicast = (self.target_ip == "224.0.0.251")
+        self.stats = new_session_stats()
+        self.last_activity = time.time()
+        self.receive_ring = ReceiveRing(self.protocol_type)
+        self.datagram_buffer = bytearray(65536) if self.protocol == 'udp' else None
 
     def get_default_interface_ip(self):
         try:
@@ -802,16 +2481,17 @@ class Fuzzer:
 
     def connect(self):
         try:
-            if self.protocol_type == 'modbus':
+            if self.serial_link:
                 self.serial = serial.Serial(
                     port=self.serial_port,
-                    baudrate=19200,
+                    baudrate=self.MODBUS_BAUDRATE,
                     parity=serial.PARITY_NONE,
                     stopbits=serial.STOPBITS_ONE,
                     bytesize=serial.EIGHTBITS,
-                    timeout=2.0
+                    timeout=self.MODBUS_RESPONSE_TIMEOUT
                 )
-                logger.info(f"Connected to Modbus RTU on {self.serial_port}, baudrate 19200")
+                self.rtu_framer = ModbusRTUFramer(self.serial, self.MODBUS_BAUDRATE, self.MODBUS_RESPONSE_TIMEOUT)
+                logger.info(f"Connected to Modbus RTU on {self.serial_port}, baudrate {self.MODBUS_BAUDRATE}")
                 self.connected = True
             elif self.protocol == 'tcp':
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -842,191 +2522,265 @@ class Fuzzer:
             self.connected = False
             return False
 
+    def open_session(self, pcap_writer):
+        """建立连接；设定了分叉点时接着重放前缀，把目标带到分叉点"""
+        if not self.connect():
+            return False
+        if self.generator.fork_state is not None and not self.replay_prefix(pcap_writer):
+            self.close()
+            return False
+        return True
+
+    def replay_prefix(self, pcap_writer):
+        """在新连接上按序发送前缀报文并等待各自的响应，最后一个响应应为分叉点状态；任一步失败返回 False"""
+        generator = self.generator
+        start = time.time()
+        msg_name = None
+        generator.state_history.clear()
+        for state in generator.fork_prefix:
+            packet = generator.generate_prefix_packet(state, {})
+            if not packet or not self.connected or not self.send_packet(packet, pcap_writer, start, float('inf')):
+                if packet:
+                    generator.discard_last()
+                logger.warning(f"Failed to send prefix packet {state} towards fork state {generator.fork_state}")
+                return False
+            received = self.receive_packet(pcap_writer, start, float('inf'))
+            if not received:
+                logger.warning(f"No response to prefix packet {state} towards fork state {generator.fork_state}")
+                return False
+            msg_name = generator.identify_message(received, dest_mac=self.dest_mac, source_mac=self.source_mac,
+                                                  target_ip=self.target_ip, source_ip=self.source_ip,
+                                                  target_port=self.target_port if not self.serial_link else 0,
+                                                  source_port=self.source_port if not self.serial_link else 0,
+                                                  protocol=self.protocol)
+        if generator.fork_state in generator.server_messages and msg_name != generator.fork_state:
+            logger.warning(f"Prefix ended in {msg_name}, expected fork state {generator.fork_state}")
+            return False
+        generator.fork_history = tuple(generator.state_history)
+        self.stats['prefix_replays'] += 1
+        return True
+
+    def mark_disconnected(self, reason):
+        """收发调用本身发现连接失效（EPIPE、ECONNRESET、对端关闭等）时调用"""
+        if self.connected:
+            logger.warning(f"Connection lost: {reason}")
+            self.stats['disconnects'] += 1
+        self.connected = False
+
+    def keepalive_due(self):
+        return self.KEEPALIVE_IDLE is not None and time.time() - self.last_activity >= self.KEEPALIVE_IDLE
+
     def check_connection(self):
+        """空闲保活探测：不等待，仅检查挂起的套接字错误和对端是否已关闭"""
         if not self.connected:
             logger.debug("Connection check failed: not connected")
             return False
         try:
-            if self.protocol_type == 'modbus':
+            if self.serial_link:
                 if not self.serial or not self.serial.is_open:
                     logger.debug("Serial port closed or not initialized")
                     return False
                 return True
             error_code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
             if error_code != 0:
-                logger.debug(f"Socket error detected: {error_code}")
-                self.connected = False
+                self.mark_disconnected(f"socket error {error_code}")
                 return False
             self.sock.setblocking(False)
-            ready = select.select([self.sock], [], [], 0.1)[0]
-            if not ready:
-                logger.debug("Connection check passed, no data available")
-                self.sock.setblocking(True)
-                return True
-            data = self.sock.recv(1, socket.MSG_PEEK)
-            if not data:
-                logger.debug("Connection closed by peer")
-                self.connected = False
+            ready = select.select([self.sock], [], [], 0)[0]
+            if ready and self.protocol == 'tcp' and not self.sock.recv(1, socket.MSG_PEEK):
+                self.mark_disconnected("closed by peer")
                 return False
-            logger.debug("Connection check passed with data available")
-            self.sock.setblocking(True)
+            logger.debug(f"Connection check passed, data available: {bool(ready)}")
             return True
         except (socket.error, serial.SerialException) as e:
-            logger.debug(f"Connection check failed: {e}")
-            self.connected = False
+            self.mark_disconnected(f"check failed: {e}")
             return False
+        finally:
+            if self.sock is not None:
+                self.sock.setblocking(True)
 
     def send_packet(self, packet, pcap_writer, start_time, timeout):
         if time.time() - start_time >= timeout:
             logger.info("Send aborted due to timeout")
-            self.connected = False
             return False
-        if not self.check_connection():
+        if not self.connected:
             logger.warning("Connection lost before sending, attempting reconnect")
-            if not self.reconnect(start_time, timeout):
+            if not self.reconnect(start_time, timeout, pcap_writer):
                 logger.error("Reconnect failed")
                 return False
         try:
-            sport = self.source_port
-            dport = self.target_port
-            
-            current_time = time.time()
-            sec = int(current_time)
-            usec = int((current_time - sec) * 1_000_000)
-            
-            # 构造伪以太网/IP/UDP 包
-            eth = Ether(src=self.source_mac, dst=self.dest_mac, type=0x0800)
-            ip = IP(src=self.source_ip, dst=self.target_ip)
-            
-            if self.protocol_type == 'modbus':
-                # 为 Modbus RTU 报文添加 MBAP 头，伪装为 Modbus TCP
-                transaction_id = random.randint(0, 65535)
-                protocol_id = 0  # Modbus 协议 ID
-                length = len(packet) - 2  # PDU 长度（去掉 CRC）
-                unit_id = packet[0]  # 从站 ID
-                mbap_header = struct.pack('!HHHB', transaction_id, protocol_id, length, unit_id)
-                modbus_tcp_packet = mbap_header + packet[1:-2]  # 去掉 RTU 的从站 ID 和 CRC
-                udp = UDP(sport=self.source_port, dport=self.target_port)
-                payload = Raw(load=modbus_tcp_packet)
-                scapy_packet = eth / ip / udp / payload
-                raw_packet = bytes(scapy_packet)
-                pcap_writer._write_packet(raw_packet, sec, usec)
+            if self.serial_link:
+                # 为 Modbus RTU 报文添加 MBAP 头，伪装为 Modbus TCP 写入 pcap
+                self.last_slave_id = packet[0]
+                modbus_tcp_packet = rtu_to_mbap(packet, self.transport_rng.randint(0, 65535))
+                self.record_frame(pcap_writer, modbus_tcp_packet, outbound=True, transport='udp')
                 logger.info(f"Sent packet: {packet.hex()} (State: {self.generator.current_state})")
-
-                if self.protocol_type == 'modbus':
-                    self.serial.write(packet)  # 发送原始 RTU 报文
-                    return True
-                else:
-                    if self.protocol == 'udp':
-                        self.sock.sendto(packet, (self.target_ip, self.target_port))
-                    else:
-                        self.sock.send(packet)
-                    return True
+                self.serial.write(packet)  # 发送原始 RTU 报文
+                self.last_sent_frame = packet
+                return True
+            elif self.modbus_tcp:
+                self.last_slave_id = packet[0]
+                self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+                frame = rtu_to_mbap(packet, self.transaction_id)
+                self.sock.sendall(frame)
+                self.last_sent_frame = frame
+                self.last_activity = time.time()
+                self.record_frame(pcap_writer, frame, outbound=True)
+                logger.info(f"Sent packet: {frame.hex()} (State: {self.generator.current_state}, transaction {self.transaction_id})")
+                return True
             else:
+                wire = packet
                 if self.protocol == 'tcp':
-                    transport = TCP(sport=sport, dport=dport)
-                    self.sock.sendall(packet)
+                    if self.protocol_type == 'dns':
+                        wire = len(packet).to_bytes(2, 'big') + packet  # DNS over TCP 带 2 字节长度前缀
+                    self.sock.sendall(wire)
                 elif self.protocol == 'udp':
-                    transport = UDP(sport=sport, dport=dport)
                     sent_bytes = self.sock.sendto(packet, (self.target_ip, self.target_port))
                     if sent_bytes != len(packet):
                         raise socket.error(f"Failed to send {len(packet)} bytes, sent {sent_bytes} bytes")
-                pkt = eth / ip / transport / Raw(load=packet)
-                pkt.time = time.time()
-                pcap_writer.write(pkt)
+                self.last_sent_frame = packet
+                self.last_activity = time.time()
+                self.record_frame(pcap_writer, wire, outbound=True)
                 logger.info(f"Sent packet: {packet.hex()} (State: {self.generator.current_state})")
                 if self.protocol_type == 'mqtt' and self.generator.current_state == 'DISCONNECT':
                     logger.info("Normal disconnection, no error")
                     self.connected = False
-                    return True
-                if not self.check_connection():
-                    logger.warning("Connection lost after sending, attempting reconnect")
-                    if not self.reconnect(start_time, timeout):
-                        logger.error("Reconnect failed")
-                        return False
                 return True
         except socket.error as e:
-            logger.warning(f"Send failed: {e}")
-            self.connected = False
+            self.mark_disconnected(f"send failed: {e}")
             return False
         except Exception as e:
             logger.error(f"PCAP write failed: {e}")
             self.connected = False
             return False
 
+    def record_frame(self, pcap_writer, payload, outbound, transport=None):
+        transport = transport or self.protocol
+        if outbound:
+            pcap_writer.write_frame(self.source_mac, self.dest_mac, self.source_ip, self.target_ip,
+                                    transport, self.source_port, self.target_port, payload)
+        else:
+            pcap_writer.write_frame(self.dest_mac, self.source_mac, self.target_ip, self.source_ip,
+                                    transport, self.target_port, self.source_port, payload)
+
     def receive_packet(self, pcap_writer, start_time, timeout):
         elapsed = time.time() - start_time
         if elapsed >= timeout:
             logger.info("Receive aborted due to timeout")
-            self.connected = False
             return None
         try:
-            if self.protocol_type == 'modbus':
-                data = self.serial.read(256)
+            if self.serial_link:
+                data = self.rtu_framer.read_frame()
                 if data:
-                    current_time = time.time()
-                    sec = int(current_time)
-                    usec = int((current_time - sec) * 1_000_000)
-                    # 构造伪以太网/IP/UDP 包（反向方向）
-                    eth = Ether(src=self.dest_mac, dst=self.source_mac)
-                    ip = IP(src=self.target_ip, dst=self.source_ip)
-                    # 添加 MBAP 头
-                    transaction_id = random.randint(0, 65535)
-                    protocol_id = 0
-                    length = len(data) - 2  # 去掉 CRC
-                    unit_id = data[0]
-                    mbap_header = struct.pack('!HHHB', transaction_id, protocol_id, length, unit_id)
-                    modbus_tcp_packet = mbap_header + data[1:-2]  # 去掉 RTU 的从站 ID 和 CRC
-                    udp = UDP(sport=self.target_port, dport=self.source_port)
-                    payload = Raw(load=modbus_tcp_packet)
-                    scapy_packet = eth / ip / udp / payload
-                    raw_packet = bytes(scapy_packet)
-                    pcap_writer._write_packet(raw_packet, sec, usec)
+                    # 伪以太网/IP/UDP 帧（反向方向），载荷为加上 MBAP 头的报文
+                    self.record_frame(pcap_writer, rtu_to_mbap(data, self.transport_rng.randint(0, 65535)), outbound=False, transport='udp')
                     logger.info(f"Received Modbus packet: {data.hex()}")
                     return data
                 return None
+            elif self.modbus_tcp:
+                return self.receive_mbap(pcap_writer)
+            elif self.protocol == 'tcp':
+                data = self.receive_stream_message(pcap_writer, 2.0)
             else:
                 self.sock.setblocking(False)
-            ready = select.select([self.sock], [], [], 2.0)[0]
-            if not ready:
-                logger.debug("No data received within timeout")
-                return None
-            if self.protocol == 'tcp':
-                data = self.sock.recv(1024)
-            elif self.protocol == 'udp':
-                data, addr = self.sock.recvfrom(1024)
-                logger.debug(f"Received data from {addr}")
+                if not select.select([self.sock], [], [], 2.0)[0]:
+                    logger.debug("No data received within timeout")
+                    return None
+                data = self.receive_datagram(pcap_writer)
             if data:
-                eth = Ether(src=self.dest_mac, dst=self.source_mac, type=0x0800)
-                ip = IP(src=self.target_ip, dst=self.source_ip)
-                transport = TCP(sport=self.target_port, dport=self.source_port) if self.protocol == 'tcp' else UDP(sport=self.target_port, dport=self.source_port)
-                pkt = eth / ip / transport / Raw(load=data)
-                pkt.time = time.time()
-                pcap_writer.write(pkt)
                 logger.info(f"Received packet: {data.hex()}")
                 return data
             return None
         except socket.error as e:
-            logger.error(f"Receive error: {e}")
-            self.connected = False
+            self.mark_disconnected(f"receive failed: {e}")
             return None
         except Exception as e:
             logger.error(f"PCAP write failed: {e}")
             self.connected = False
             return None
         finally:
-            if self.protocol_type != 'modbus':
+            if self.sock is not None:
                 self.sock.setblocking(True)
 
-    def reconnect(self, start_time, timeout):
+    def receive_stream_message(self, pcap_writer, wait):
+        """从接收环中取出下一条完整报文，缓冲区不足一条时最多等待 wait 秒继续读取；
+        返回的 memoryview 在下一次读取前有效"""
+        deadline = time.time() + wait
+        while True:
+            message = self.receive_ring.next_message()
+            if message is not None:
+                return message
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([self.sock], [], [], remaining)[0]:
+                logger.debug("No complete message received within timeout")
+                return None
+            chunk = self.receive_ring.fill(self.sock)
+            if not chunk:
+                self.mark_disconnected("closed by peer")
+                return None
+            self.last_activity = time.time()
+            self.record_frame(pcap_writer, chunk, outbound=False)
+
+    def receive_datagram(self, pcap_writer):
+        """recv_into 复用的数据报缓冲区，返回 memoryview，下一次读取前有效"""
+        count = self.sock.recv_into(self.datagram_buffer)
+        data = memoryview(self.datagram_buffer)[:count]
+        self.last_activity = time.time()
+        self.record_frame(pcap_writer, data, outbound=False)
+        return data
+
+    def receive_mbap(self, pcap_writer):
+        """取出与最近请求事务 ID 相同的 Modbus/TCP 响应，返回还原后的 RTU 帧；事务 ID 不符的迟到响应被丢弃"""
+        deadline = time.time() + self.MODBUS_RESPONSE_TIMEOUT
+        while True:
+            frame = self.receive_stream_message(pcap_writer, deadline - time.time())
+            if frame is None:
+                return None
+            transaction_id = int.from_bytes(frame[0:2], 'big')
+            if transaction_id != self.transaction_id:
+                self.stats['unmatched'] = self.stats.get('unmatched', 0) + 1
+                logger.warning(f"Discarding Modbus/TCP response for transaction {transaction_id}, expected {self.transaction_id}")
+                continue
+            logger.info(f"Received Modbus/TCP packet: {frame.hex()}")
+            return mbap_to_rtu(self.generator, frame)
+
+    def decode_frame(self, message):
+        """流水线模式收到的报文转换为生成器解析器使用的格式"""
+        return mbap_to_rtu(self.generator, message) if self.modbus_tcp else message
+
+    def receive_messages(self, pcap_writer, wait):
+        """流水线模式的接收：最多等待 wait 秒，逐条产出当前可读的完整报文。
+        报文是接收缓冲区上的 memoryview，调用方处理完一条再取下一条"""
+        try:
+            ready = select.select([self.sock], [], [], max(0.0, wait))[0]
+            while ready:
+                if self.protocol == 'tcp':
+                    chunk = self.receive_ring.fill(self.sock)
+                    if not chunk:
+                        self.mark_disconnected("closed by peer")
+                        break
+                    self.last_activity = time.time()
+                    self.record_frame(pcap_writer, chunk, outbound=False)
+                    message = self.receive_ring.next_message()
+                    while message is not None:
+                        yield message
+                        message = self.receive_ring.next_message()
+                else:
+                    yield self.receive_datagram(pcap_writer)
+                ready = select.select([self.sock], [], [], 0)[0]
+        except socket.error as e:
+            self.mark_disconnected(f"receive failed: {e}")
+
+    def reconnect(self, start_time, timeout, pcap_writer=None):
         max_retries = 3
         retry_delay = 1.0
+        self.connect_failures = 0  # 因剩余时间不足跳过的重连不计入，目标确实连不上时才需要探测
         for attempt in range(max_retries):
             if time.time() - start_time >= timeout - (max_retries - attempt) * retry_delay:
                 logger.info("Reconnect skipped due to insufficient time remaining")
                 return False
             try:
-                if self.protocol_type == 'modbus':
+                if self.serial_link:
                     if self.serial:
                         self.serial.close()
                     self.serial = None
@@ -1034,31 +2788,199 @@ class Fuzzer:
                     if self.sock:
                         self.sock.close()
                     self.sock = None
+                    self.receive_ring.clear()  # 旧连接残留的半条报文不能和新连接的响应拼在一起
                 self.connected = False
-                self.generator.current_state = 'INIT_STATE'
+                self.generator.reset_state()
                 logger.info(f"Connection lost, resetting state to INIT_STATE, attempt {attempt + 1}/{max_retries}")
                 time.sleep(retry_delay)
                 if self.connect():
-                    logger.info(f"Reconnected successfully on attempt {attempt + 1}")
-                    if self.protocol_type != 'modbus':
-                        self.source_port = random.randint(1024, 65535)
-                    return True
+                    if not self.serial_link and self.session_id is None:
+                        self.source_port = self.transport_rng.randint(1024, 65535)
+                    if self.generator.fork_state is None or self.replay_prefix(pcap_writer):
+                        logger.info(f"Reconnected successfully on attempt {attempt + 1}")
+                        self.stats['reconnects'] += 1
+                        return True
+                    self.close()
+                self.connect_failures += 1
                 logger.warning(f"Reconnect attempt {attempt + 1} failed")
             except (serial.SerialException, socket.error) as e:
+                self.connect_failures += 1
                 logger.error(f"Reconnect attempt {attempt + 1} failed: {e}")
                 self.connected = False
         logger.error(f"Max reconnect attempts ({max_retries}) reached, giving up")
         return False
 
-    def communicate_with_timeout(self, input_fields, timeout=15.0, fuzz_ratio=0.2, max_retries=5):
-        pcap_writer = RawPcapWriter(self.pcap_file, linktype=1)
-        pcap_writer._write_header(None)
+    def new_probe_session(self):
+        """与本会话目标相同、但状态机和覆盖率独立的新会话，用于存活探测"""
+        return Fuzzer(self.target_ip, self.target_port, self.protocol, self.cache, self.protocol_type,
+                      serial_port=self.serial_port, slave_ids=self.generator.config.get('slave_ids'),
+                      coverage=StateCoverage(self.cache["state_machine"]))
+
+    def probe(self, input_fields, pcap_writer):
+        """存活探测：新建连接并发送一个不变异的初始请求。返回 'alive'、'hang'（连上但无响应）或 'down'（连不上或发送失败）"""
+        if not self.connected and not self.connect():
+            return 'down'
+        self.generator.reset_state()
+        state = self.generator.select_next_state()
+        if state not in self.generator.client_messages:
+            return 'alive' if self.receive_packet(pcap_writer, time.time(), self.PROBE_TIMEOUT) else 'hang'
+        self.generator.current_state = state
+        packet = self.generator.generate_packet(state, input_fields, fuzz=False)
+        start = time.time()
+        if not packet or not self.send_packet(packet, pcap_writer, start, self.PROBE_TIMEOUT):
+            return 'down'
+        return 'alive' if self.receive_packet(pcap_writer, start, self.PROBE_TIMEOUT) else 'hang'
+
+    def check_target_failure(self, reason, input_fields, pcap_writer):
+        """会话不再响应或重连失败时另开会话探测目标：新会话也连不上或收不到响应时判定为崩溃/挂起，
+        保存最近发送的报文后立即返回；最小化可能要数小时，由 minimize 命令在后台任务中进行。
+        目标仍能响应新会话时只记录告警"""
+        self.close()  # 串口同一时刻只能由一个会话读写
+        probe = self.new_probe_session()
+        try:
+            status = probe.probe(input_fields, pcap_writer)
+        finally:
+            probe.close()
+        if status == 'alive':
+            logger.warning(f"Session stopped ({reason}), but the target still answers new sessions")
+            return None
+        kind = 'crash' if status == 'down' else 'hang'
+        crash_file = self.save_crash(kind, reason, input_fields)
+        summary = {'kind': kind, 'reason': reason, 'file': crash_file, 'packets': len(self.recent_packets)}
+        self.stats.setdefault('crashes', []).append(summary)
+        return crash_file
+
+    def save_crash(self, kind, reason, input_fields):
+        """把最近发送的报文连同目标、种子和 trace 位置写入 CRASH_DIR 下的 JSON，返回文件路径"""
+        os.makedirs(CRASH_DIR, exist_ok=True)
+        crash_file = os.path.join(CRASH_DIR, f"crash_{uuid.uuid4().hex}.json")
+        record = {
+            'kind': kind,
+            'reason': reason,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'protocol_type': self.protocol_type,
+            'protocol': self.protocol,
+            'target_ip': self.target_ip,
+            'target_port': self.target_port,
+            'serial_port': self.serial_port,
+            'slave_ids': self.generator.config.get('slave_ids'),
+            'seed': self.generator.seed,
+            'pcap_file': self.pcap_file,
+            'trace_file': os.path.splitext(self.pcap_file)[0] + '.trace.json',
+            'input_fields': input_fields or {},
+            'packets': [[state, packet.hex()] for state, packet in self.recent_packets]
+        }
+        try:
+            with open(crash_file, 'w') as f:
+                json.dump(record, f, indent=2, default=str)
+        except OSError as e:
+            logger.error(f"Failed to save crash record {crash_file}: {e}")
+            return None
+        logger.error(f"Target {kind} detected ({reason}), last {len(self.recent_packets)} packets saved to {crash_file}")
+        return crash_file
+
+    def write_trace(self, input_fields):
+        """把种子和生成器决策序列写入与 pcap 同名的 .trace.json，replay_trace 据此离线重新生成发送的报文；
+        连接复用时 trace 从会话创建开始累计"""
+        generator = self.generator
+        trace_file = os.path.splitext(self.pcap_file)[0] + '.trace.json'
+        trace = {
+            'seed': generator.seed,
+            'protocol_type': self.protocol_type,
+            'protocol': self.protocol,
+            'target_ip': self.target_ip,
+            'target_port': self.target_port,
+            'source_port': self.source_port,
+            'session_id': self.session_id,
+            'config': generator.config,
+            'input_fields': input_fields or {},
+            'corpus': generator.corpus is not None,
+            'fork_state': generator.fork_state,
+            'events': generator.trace
+        }
+        try:
+            with open(trace_file, 'w') as f:
+                json.dump(trace, f, separators=(',', ':'), default=str)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to write replay trace {trace_file}: {e}")
+            return None
+        self.stats['seed'] = generator.seed
+        self.stats['trace_file'] = trace_file
+        return trace_file
+
+    def count_message(self, msg_name):
+        count_session_message(self.stats, msg_name)
+
+    def count_slave(self, counter):
+        """Modbus 按从站统计最近一次请求的结果"""
+        if self.protocol_type != 'modbus' or self.last_slave_id is None:
+            return
+        slave = self.stats.setdefault('slaves', {}).setdefault(self.last_slave_id, {'sent': 0, 'received': 0, 'exceptions': 0, 'no_response': 0})
+        slave[counter] += 1
+
+    def close(self):
+        self.receive_ring.clear()
+        if self.serial_link:
+            if self.serial:
+                try:
+                    self.serial.close()
+                except serial.SerialException:
+                    pass
+                self.serial = None
+        else:
+            if self.sock:
+                try:
+                    self.sock.close()
+                except socket.error:
+                    pass
+                self.sock = None
+        self.connected = False
+
+    def communicate_with_timeout(self, input_fields, timeout=15.0, fuzz_ratio=0.2, max_retries=5, pacer=None, keep_open=False, window=None):
+        """运行一次模糊测试；keep_open 为 True 时结束后保留连接和状态机当前状态，供下一次调用继续。
+        window 大于 1 时使用流水线模式，允许同时有 window 个未收到响应的请求；
+        target_state 指定时先沿最短路径驱动到该状态再开始变异，每次复位后重新驱动"""
+        pacer = pacer or create_pacer(input_fields or {})
+        target_state = (input_fields or {}).get("target_state") or None
+        if target_state != self.generator.target_state:
+            self.generator.drive_to(target_state)
+        corpus = open_corpus((input_fields or {}).get("corpus"), self.protocol_type)
+        if corpus is not self.generator.corpus:
+            self.generator.attach_corpus(corpus)
+        if window is None:
+            try:
+                window = int((input_fields or {}).get("window") or 1)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid pipeline window {input_fields.get('window')}, using lock-step mode")
+                window = 1
+        try:
+            batch = int((input_fields or {}).get("batch") or 1)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid batch size {input_fields.get('batch')}, sending one packet at a time")
+            batch = 1
+        if batch > 1:
+            if self.protocol == 'udp' and not self.is_multicast:
+                return self.communicate_batched(input_fields, timeout=timeout, fuzz_ratio=fuzz_ratio, batch=batch,
+                                                window=max(window, batch * 16), pacer=pacer, keep_open=keep_open)
+            logger.warning("Batched sending is only supported for unicast UDP, ignoring batch size")
+        if window > 1:
+            if self.serial_link:
+                logger.warning("Modbus RTU does not allow outstanding requests, using lock-step mode")
+            else:
+                return self.communicate_pipelined(input_fields, timeout=timeout, fuzz_ratio=fuzz_ratio, window=window,
+                                                  pacer=pacer, keep_open=keep_open)
+        pcap_writer = PcapSink(
+            FramePcapWriter(self.pcap_file, linktype=1),
+            max_queue=self.PCAP_QUEUE_SIZE,
+            flush_interval=self.PCAP_FLUSH_INTERVAL,
+            drop_policy=self.PCAP_DROP_POLICY
+        )
         start_time = time.time()
         iteration_count = 0
         no_response_count = 0
         try:
             if not self.connected:
-                if not self.connect():
+                if not self.open_session(pcap_writer):
                     logger.error("Initial connection failed")
                     return self.pcap_file
             while True:
@@ -1066,12 +2988,18 @@ class Fuzzer:
                 if elapsed >= timeout:
                     logger.info(f"Timeout reached after {elapsed:.2f} seconds")
                     break
+                pacer.wait(max_wait=timeout - elapsed)
                 iteration_count += 1
                 logger.debug(f"Iteration {iteration_count}, state: {self.generator.current_state}")
-                if not self.check_connection():
+                if self.connected and self.keepalive_due():
+                    self.stats['keepalive_probes'] += 1
+                    self.check_connection()
+                if not self.connected:
                     logger.warning("Connection lost, attempting to reconnect")
-                    if not self.reconnect(start_time, timeout):
+                    if not self.reconnect(start_time, timeout, pcap_writer):
                         logger.error("Reconnect failed, stopping")
+                        if self.connect_failures:
+                            self.check_target_failure("reconnect failed", input_fields, pcap_writer)
                         break
                 next_state = self.generator.select_next_state()
                 if next_state:
@@ -1081,42 +3009,55 @@ class Fuzzer:
                     logger.warning("No valid state transition, stopping")
                     break
                 if self.generator.current_state in self.generator.client_messages:
-                    fuzz = random.random() < fuzz_ratio
-                    packet = self.generator.generate_packet(self.generator.current_state, input_fields, fuzz=fuzz)
+                    packet = self.generator.generate_next(self.generator.current_state, input_fields, fuzz_ratio)
                     if packet:
                         logger.debug(f"Generated packet: {packet.hex()}")
                         if self.send_packet(packet, pcap_writer, start_time, timeout):
+                            self.stats['sent'] += 1
+                            self.recent_packets.append((self.generator.current_state, bytes(packet)))
+                            self.count_slave('sent')
+                            sent_time = time.time()
                             received = self.receive_packet(pcap_writer, start_time, timeout)
                             if received:
+                                pacer.observe_latency(time.time() - sent_time)
                                 no_response_count = 0
+                                self.stats['received'] += 1
+                                self.count_slave('received')
                                 msg_name = self.generator.identify_message(
                                     received,
                                     dest_mac=self.dest_mac,
                                     source_mac=self.source_mac,
                                     target_ip=self.target_ip,
                                     source_ip=self.source_ip,
-                                    target_port=self.target_port if self.protocol_type != 'modbus' else 0,
-                                    source_port=self.source_port if self.protocol_type != 'modbus' else 0,
+                                    target_port=self.target_port if not self.serial_link else 0,
+                                    source_port=self.source_port if not self.serial_link else 0,
                                     protocol=self.protocol
                                 )
                                 logger.info(f"Identified received message: {msg_name}")
+                                self.count_message(msg_name)
                                 if msg_name == 'EXCEPTION_RESPONSE':
+                                    self.count_slave('exceptions')
                                     exception_code = received[2] if len(received) > 2 else 'Unknown'
                                     logger.info(f"Exception response received, code: 0x{exception_code:02x}")
                                 next_state = self.generator.select_next_state(msg_name)
                                 if next_state:
                                     self.generator.current_state = next_state
                                 else:
-                                    self.generator.current_state = 'INIT_STATE'
+                                    self.generator.reset_state()
                                     logger.warning(f"Forcing transition to {self.generator.current_state} after server response")
                             else:
                                 no_response_count += 1
+                                self.stats['no_response'] += 1
+                                self.count_slave('no_response')
                                 if no_response_count >= max_retries:
                                     logger.error(f"No response received after {no_response_count} attempts, stopping")
+                                    self.check_target_failure(f"no response after {no_response_count} attempts", input_fields, pcap_writer)
                                     break
-                                self.generator.current_state = 'INIT_STATE'
+                                self.generator.reset_state()
                                 logger.warning(f"No response received, forcing transition to {self.generator.current_state}")
                         else:
+                            self.stats['send_failures'] += 1
+                            self.generator.discard_last()
                             logger.warning("Failed to send packet")
                     else:
                         logger.error("Failed to generate packet, skipping iteration")
@@ -1125,17 +3066,19 @@ class Fuzzer:
                     received = self.receive_packet(pcap_writer, start_time, timeout)
                     if received:
                         no_response_count = 0
+                        self.stats['received'] += 1
                         msg_name = self.generator.identify_message(
                             received,
                             dest_mac=self.dest_mac,
                             source_mac=self.source_mac,
                             target_ip=self.target_ip,
                             source_ip=self.source_ip,
-                            target_port=self.target_port if self.protocol_type != 'modbus' else 0,
-                            source_port=self.source_port if self.protocol_type != 'modbus' else 0,
+                            target_port=self.target_port if not self.serial_link else 0,
+                            source_port=self.source_port if not self.serial_link else 0,
                             protocol=self.protocol
                         )
                         logger.info(f"Identified received message: {msg_name}")
+                        self.count_message(msg_name)
                         if msg_name == 'EXCEPTION_RESPONSE':
                             exception_code = received[2] if len(received) > 2 else 'Unknown'
                             logger.info(f"Exception response received, code: 0x{exception_code:02x}")
@@ -1143,46 +3086,696 @@ class Fuzzer:
                         if next_state:
                             self.generator.current_state = next_state
                         else:
-                            self.generator.current_state = 'INIT_STATE'
+                            self.generator.reset_state()
                             logger.warning(f"Forcing transition to {self.generator.current_state} after server response")
                     else:
                         no_response_count += 1
+                        self.stats['no_response'] += 1
                         if no_response_count >= max_retries:
                             logger.error(f"No response received after {no_response_count} attempts, stopping")
+                            self.check_target_failure(f"no response after {no_response_count} attempts", input_fields, pcap_writer)
                             break
-                        self.generator.current_state = 'INIT_STATE'
+                        self.generator.reset_state()
                         logger.warning(f"No response received, forcing transition to {self.generator.current_state}")
-                elapsed = time.time() - start_time
-                if elapsed < timeout:
-                    sleep_time = min(0.1, timeout - elapsed)
-                    time.sleep(sleep_time)
         except KeyboardInterrupt:
             logger.info("Communication interrupted by user")
         except Exception as e:
             logger.error(f"Communication stopped due to error: {e}")
             self.connected = False
         finally:
-            pcap_writer.flush()
-            pcap_writer.close()
-            if self.protocol_type == 'modbus':
-                if self.serial:
-                    try:
-                        self.serial.close()
-                    except serial.SerialException:
-                        pass
-                    self.serial = None
+            pcap_stats = pcap_writer.close()
+            if pcap_stats['dropped']:
+                logger.warning(f"PCAP sink dropped {pcap_stats['dropped']} frames")
+            if keep_open and self.connected:
+                logger.info(f"Keeping connection open for reuse, state: {self.generator.current_state}")
             else:
-                if self.sock:
-                    try:
-                        self.sock.close()
-                    except socket.error:
-                        pass
-                    self.sock = None
-            self.connected = False
+                self.close()
             elapsed = time.time() - start_time
+            self.stats['iterations'] = iteration_count
+            self.stats['elapsed'] = elapsed
+            self.stats['pcap_dropped'] = pcap_stats['dropped']
+            self.stats['pacing'] = pacer.report()
+            self.stats['coverage'] = self.generator.coverage.report()
+            self.write_trace(input_fields)
+            logger.info(f"State coverage: {self.stats['coverage']['state_percent']}% states, {self.stats['coverage']['transition_percent']}% transitions")
+            if self.generator.target_state:
+                self.stats['target_reached'] = self.generator.drives_completed
+            if self.generator.corpus is not None:
+                self.generator.corpus.commit()
+                self.stats['new_signatures'] = self.generator.new_signatures
+            logger.info(f"Achieved {self.stats['pacing']['achieved_rate']:.1f} iterations/s (target {pacer.target_rate or 'unpaced'}, {pacer.backoffs} backoffs)")
             logger.info(f"Resources cleaned up, PCAP saved to {self.pcap_file}, ran for {elapsed:.2f} seconds, {iteration_count} iterations")
         return self.pcap_file
 
+    def next_client_packet(self, input_fields, fuzz_ratio):
+        """推进状态机一步，返回 (状态名, 报文)；新状态不是客户端报文或生成失败时报文为 None"""
+        state = self.generator.select_next_state()
+        if not state:
+            logger.warning("No valid state transition, resetting to INIT_STATE")
+            self.generator.reset_state()
+            return None, None
+        self.generator.current_state = state
+        if state not in self.generator.client_messages:
+            return state, None
+        return state, self.generator.generate_next(state, input_fields, fuzz_ratio)
+
+    def communicate_batched(self, input_fields, timeout=15.0, fuzz_ratio=0.2, batch=64, window=1024, response_timeout=2.0,
+                            pacer=None, keep_open=False):
+        """UDP 批量模式：每轮预先生成 batch 个报文，用 sendmmsg 一次发出，响应用 recvmmsg 批量取回并按 DNS ID 等关联；
+        在途请求达到 window 时等待响应，超过 response_timeout 未匹配的请求计为无响应。不逐包写日志"""
+        pacer = pacer or create_pacer(input_fields or {})
+        pcap_writer = PcapSink(
+            FramePcapWriter(self.pcap_file, linktype=1),
+            max_queue=self.PCAP_QUEUE_SIZE,
+            flush_interval=self.PCAP_FLUSH_INTERVAL,
+            drop_policy=self.PCAP_DROP_POLICY
+        )
+        inflight = {}  # 关联键 -> deque[(发送时间, 状态名)]
+        inflight_count = 0
+        latency_total = 0.0
+        self.stats.update({'unmatched': 0, 'max_inflight': 0, 'window': window, 'batch': batch})
+        start_time = time.time()
+        iteration_count = 0
+        batch_io = None
+        idle_wait = 0.0
+        try:
+            if not self.connected and not self.open_session(pcap_writer):
+                logger.error("Initial connection failed")
+                return self.pcap_file
+            batch_io = UDPBatchIO(self.sock, (self.target_ip, self.target_port), batch_size=batch)
+            logger.info(f"Batched UDP mode, batch {batch}, window {window}, {'sendmmsg/recvmmsg' if batch_io.native else 'sendto/recv loop'}")
+            while time.time() - start_time < timeout:
+                packets = []
+                states = []
+                # 每轮最多尝试 room 次生成，生成失败的名额留到下一轮，不在轮内反复重试
+                room = min(batch, window - inflight_count)
+                for _ in range(room):
+                    elapsed = time.time() - start_time
+                    if elapsed >= timeout:
+                        break
+                    pacer.wait(max_wait=timeout - elapsed)
+                    iteration_count += 1
+                    state, packet = self.next_client_packet(input_fields, fuzz_ratio)
+                    if packet:
+                        packets.append(bytes(packet))
+                        states.append(state)
+                if packets:
+                    sent = batch_io.send(packets, wait=response_timeout)
+                    now = time.time()
+                    self.stats['send_failures'] += len(packets) - sent
+                    self.stats['sent'] += sent
+                    for _ in range(len(packets) - sent):
+                        self.generator.discard_last()
+                    self.last_activity = now
+                    for packet, state in zip(packets[:sent], states[:sent]):
+                        self.recent_packets.append((state, packet))
+                        self.record_frame(pcap_writer, packet, outbound=True)
+                        key = correlation_key(self.protocol_type, packet, outbound=True)
+                        if key is not None:
+                            inflight.setdefault(key, deque()).append((now, state))
+                            inflight_count += 1
+                    self.stats['max_inflight'] = max(self.stats['max_inflight'], inflight_count)
+                # 窗口已满时阻塞等待响应；本轮没有生成出报文时等待响应或退避，避免不限速时空转；
+                # 否则只取走已到达的数据报
+                remaining = timeout - (time.time() - start_time)
+                if inflight_count >= window:
+                    select.select([self.sock], [], [], max(0.0, min(response_timeout, remaining)))
+                elif not packets:
+                    low, high = self.EMPTY_ROUND_BACKOFF
+                    idle_wait = min(high, idle_wait * 2 or low)
+                    select.select([self.sock], [], [], max(0.0, min(idle_wait, remaining)))
+                else:
+                    idle_wait = 0.0
+                while True:
+                    datagrams = batch_io.receive()
+                    if not datagrams:
+                        break
+                    now = time.time()
+                    for message in datagrams:
+                        self.stats['received'] += 1
+                        self.record_frame(pcap_writer, message, outbound=False)
+                        msg_name = self.generator.identify_message(
+                            message,
+                            dest_mac=self.dest_mac,
+                            source_mac=self.source_mac,
+                            target_ip=self.target_ip,
+                            source_ip=self.source_ip,
+                            target_port=self.target_port,
+                            source_port=self.source_port,
+                            protocol=self.protocol
+                        )
+                        self.count_message(msg_name)
+                        key = correlation_key(self.protocol_type, message, outbound=False)
+                        pending = inflight.get(key)
+                        if not pending:
+                            self.stats['unmatched'] += 1
+                            continue
+                        sent_time, request_state = pending.popleft()
+                        if not pending:
+                            del inflight[key]
+                        inflight_count -= 1
+                        latency = now - sent_time
+                        latency_total += latency
+                        pacer.observe_latency(latency)
+                deadline = time.time() - response_timeout
+                for key in list(inflight):
+                    pending = inflight[key]
+                    while pending and pending[0][0] < deadline:
+                        pending.popleft()
+                        inflight_count -= 1
+                        self.stats['no_response'] += 1
+                    if not pending:
+                        del inflight[key]
+        except KeyboardInterrupt:
+            logger.info("Communication interrupted by user")
+        except Exception as e:
+            logger.error(f"Batched communication stopped due to error: {e}")
+            self.connected = False
+        finally:
+            pcap_stats = pcap_writer.close()
+            self.stats['no_response'] += inflight_count
+            matched = self.stats['received'] - self.stats['unmatched']
+            if batch_io:
+                batch_io.close()
+            if keep_open and self.connected:
+                logger.info(f"Keeping connection open for reuse, state: {self.generator.current_state}")
+            else:
+                self.close()
+            elapsed = time.time() - start_time
+            self.stats['iterations'] = iteration_count
+            self.stats['elapsed'] = elapsed
+            self.stats['pcap_dropped'] = pcap_stats['dropped']
+            self.stats['pacing'] = pacer.report()
+            self.stats['coverage'] = self.generator.coverage.report()
+            self.write_trace(input_fields)
+            logger.info(f"State coverage: {self.stats['coverage']['state_percent']}% states, {self.stats['coverage']['transition_percent']}% transitions")
+            if self.generator.target_state:
+                self.stats['target_reached'] = self.generator.drives_completed
+            if self.generator.corpus is not None:
+                self.generator.corpus.commit()
+                self.stats['new_signatures'] = self.generator.new_signatures
+            self.stats['mean_latency'] = latency_total / matched if matched > 0 else None
+            self.stats['syscalls'] = batch_io.syscalls if batch_io else 0
+            logger.info(f"Batched run finished: {self.stats['sent']} sent ({self.stats['sent'] / elapsed if elapsed else 0:.0f}/s), "
+                        f"{matched} matched, {self.stats['unmatched']} unmatched, {self.stats['syscalls']} syscalls, PCAP saved to {self.pcap_file}")
+        return self.pcap_file
+
+    def communicate_pipelined(self, input_fields, timeout=15.0, fuzz_ratio=0.2, window=8, response_timeout=2.0, pacer=None, keep_open=False):
+        """流水线模式：不等待响应连续发送，最多 window 个请求在途；响应按 DNS ID、MQTT packet_id 等关联回请求，
+        超过 response_timeout 未匹配的请求计为无响应"""
+        pacer = pacer or create_pacer(input_fields or {})
+        pcap_writer = PcapSink(
+            FramePcapWriter(self.pcap_file, linktype=1),
+            max_queue=self.PCAP_QUEUE_SIZE,
+            flush_interval=self.PCAP_FLUSH_INTERVAL,
+            drop_policy=self.PCAP_DROP_POLICY
+        )
+        inflight = {}  # 关联键 -> deque[(发送时间, 状态名)]，同一键下按发送顺序排列
+        inflight_count = 0
+        latency_total = 0.0
+        self.stats.update({'unmatched': 0, 'max_inflight': 0, 'window': window})
+        start_time = time.time()
+        iteration_count = 0
+        try:
+            if not self.connected and not self.open_session(pcap_writer):
+                logger.error("Initial connection failed")
+                return self.pcap_file
+            while time.time() - start_time < timeout:
+                if not self.connected:
+                    self.stats['no_response'] += inflight_count
+                    inflight.clear()
+                    inflight_count = 0
+                    if not self.reconnect(start_time, timeout, pcap_writer):
+                        logger.error("Reconnect failed, stopping")
+                        if self.connect_failures:
+                            self.check_target_failure("reconnect failed", input_fields, pcap_writer)
+                        break
+                # 每轮最多补满窗口空位，随后总会取一次响应，无需响应的请求（如 QoS 0 PUBLISH）不会占住循环
+                for _ in range(window - inflight_count):
+                    elapsed = time.time() - start_time
+                    if not self.connected or elapsed >= timeout:
+                        break
+                    pacer.wait(max_wait=timeout - elapsed)
+                    iteration_count += 1
+                    state, packet = self.next_client_packet(input_fields, fuzz_ratio)
+                    if not packet:
+                        continue
+                    if not self.send_packet(packet, pcap_writer, start_time, timeout):
+                        self.stats['send_failures'] += 1
+                        self.generator.discard_last()
+                        break
+                    self.stats['sent'] += 1
+                    self.recent_packets.append((state, bytes(packet)))
+                    key = correlation_key(self.protocol_type, self.last_sent_frame, outbound=True)
+                    if key is not None:
+                        inflight.setdefault(key, deque()).append((time.time(), state))
+                        inflight_count += 1
+                        self.stats['max_inflight'] = max(self.stats['max_inflight'], inflight_count)
+                if self.sock is None:
+                    continue
+                # 窗口已满时阻塞等待响应，否则只取走已到达的数据
+                remaining = timeout - (time.time() - start_time)
+                wait = min(response_timeout, remaining) if inflight_count >= window else 0
+                for message in self.receive_messages(pcap_writer, wait):
+                    self.stats['received'] += 1
+                    msg_name = self.generator.identify_message(
+                        self.decode_frame(message),
+                        dest_mac=self.dest_mac,
+                        source_mac=self.source_mac,
+                        target_ip=self.target_ip,
+                        source_ip=self.source_ip,
+                        target_port=self.target_port,
+                        source_port=self.source_port,
+                        protocol=self.protocol
+                    )
+                    self.count_message(msg_name)
+                    key = correlation_key(self.protocol_type, message, outbound=False)
+                    pending = inflight.get(key)
+                    if not pending:
+                        self.stats['unmatched'] += 1
+                        logger.debug(f"Unmatched response {msg_name} with key {key}")
+                        continue
+                    sent_time, request_state = pending.popleft()
+                    if not pending:
+                        del inflight[key]
+                    inflight_count -= 1
+                    latency = time.time() - sent_time
+                    latency_total += latency
+                    pacer.observe_latency(latency)
+                    logger.debug(f"Matched {msg_name} to {request_state} in {latency * 1000:.1f} ms")
+                # 超时未响应的请求出窗
+                deadline = time.time() - response_timeout
+                for key in list(inflight):
+                    pending = inflight[key]
+                    while pending and pending[0][0] < deadline:
+                        pending.popleft()
+                        inflight_count -= 1
+                        self.stats['no_response'] += 1
+                    if not pending:
+                        del inflight[key]
+        except KeyboardInterrupt:
+            logger.info("Communication interrupted by user")
+        except Exception as e:
+            logger.error(f"Pipelined communication stopped due to error: {e}")
+            self.connected = False
+        finally:
+            pcap_stats = pcap_writer.close()
+            self.stats['no_response'] += inflight_count
+            matched = self.stats['received'] - self.stats['unmatched']
+            if keep_open and self.connected:
+                logger.info(f"Keeping connection open for reuse, state: {self.generator.current_state}")
+            else:
+                self.close()
+            elapsed = time.time() - start_time
+            self.stats['iterations'] = iteration_count
+            self.stats['elapsed'] = elapsed
+            self.stats['pcap_dropped'] = pcap_stats['dropped']
+            self.stats['pacing'] = pacer.report()
+            self.stats['coverage'] = self.generator.coverage.report()
+            self.write_trace(input_fields)
+            logger.info(f"State coverage: {self.stats['coverage']['state_percent']}% states, {self.stats['coverage']['transition_percent']}% transitions")
+            if self.generator.target_state:
+                self.stats['target_reached'] = self.generator.drives_completed
+            if self.generator.corpus is not None:
+                self.generator.corpus.commit()
+                self.stats['new_signatures'] = self.generator.new_signatures
+            self.stats['mean_latency'] = latency_total / matched if matched > 0 else None
+            logger.info(f"Pipelined run finished: {self.stats['sent']} sent, {matched} matched, {self.stats['unmatched']} unmatched, "
+                        f"max in flight {self.stats['max_inflight']}/{window}, PCAP saved to {self.pcap_file}")
+        return self.pcap_file
+
+class DatagramQueueProtocol(asyncio.DatagramProtocol):
+    """把收到的 UDP 数据报放入队列，供会话协程按需读取"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.error = None
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc):
+        self.error = exc
+
+class AsyncSession:
+    """AsyncFuzzer 中单个连接的状态：独立的生成器（状态机）、传输对象和统计"""
+
+    def __init__(self, session_id, generator, pacer):
+        self.session_id = session_id
+        self.generator = generator
+        self.pacer = pacer
+        self.reader = None
+        self.writer = None
+        self.transport = None
+        self.datagrams = None
+        self.source_port = 0
+        self.connected = False
+        self.pending = b''  # 未读完的 TCP 报文，接收超时被取消时保留到下次继续拼接
+        self.stats = new_session_stats()
+
+class AsyncFuzzer:
+    """单个事件循环驱动大量 TCP/UDP 会话，每个会话有独立的状态机，复用 PacketGenerator 生成和识别报文"""
+    PCAP_QUEUE_SIZE = 65536
+    PCAP_FLUSH_INTERVAL = 0.5
+    PCAP_DROP_POLICY = 'drop_newest'
+    CONNECT_CONCURRENCY = 256
+    RECEIVE_TIMEOUT = 2.0
+    RETRY_DELAY = 1.0
+    MAX_RECONNECTS = 3
+
+    def __init__(self, target_ip, target_port, protocol, cache, protocol_type, sessions=100):
+        self.protocol_type = protocol_type.lower()
+        if self.protocol_type == 'modbus':
+            raise ValueError("AsyncFuzzer does not support Modbus RTU over serial")
+        self.protocol = protocol.lower()
+        if self.protocol not in ('tcp', 'udp'):
+            raise ValueError(f"Unsupported protocol: {self.protocol}")
+        self.target_ip = target_ip
+        self.target_port = int(target_port)
+        self.cache = cache
+        self.coverage = new_campaign_coverage(cache, self.protocol_type)  # 所有会话共享，覆盖率按整个测试统计
+        self.sessions = sessions
+        self.source_ip = "127.0.0.1"
+        self.source_mac = SOURCE_MAC
+        self.dest_mac = DEST_MAC
+        self.pcap_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
+        os.makedirs("outpcap", exist_ok=True)
+        self.pcap_writer = None
+        self.connect_semaphore = None
+        self.seed = None
+
+    def new_session(self, session_id, input_fields):
+        generator = create_generator(self.cache, self.protocol_type, self.coverage, seed=session_seed(self.seed, session_id))
+        session = AsyncSession(session_id, generator, create_pacer(input_fields))
+        if self.protocol_type == 'mqtt':
+            config = session.generator.config
+            config['default_client_id'] = f"{config['default_client_id']}-{session_id}"[:23]
+        session.generator.drive_to(input_fields.get("target_state") or None)
+        session.generator.attach_corpus(open_corpus(input_fields.get("corpus"), self.protocol_type))
+        return session
+
+    async def connect(self, session):
+        async with self.connect_semaphore:
+            try:
+                if self.protocol == 'tcp':
+                    session.reader, session.writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.target_ip, self.target_port), self.RECEIVE_TIMEOUT)
+                    session.source_port = session.writer.get_extra_info('sockname')[1]
+                else:
+                    loop = asyncio.get_running_loop()
+                    session.transport, session.datagrams = await loop.create_datagram_endpoint(
+                        DatagramQueueProtocol, remote_addr=(self.target_ip, self.target_port))
+                    session.source_port = session.transport.get_extra_info('sockname')[1]
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.debug(f"Session {session.session_id} connection failed: {e}")
+                session.connected = False
+                return False
+        session.connected = True
+        session.generator.reset_state()
+        return True
+
+    def close(self, session):
+        if session.writer is not None:
+            session.writer.close()
+            session.writer = session.reader = None
+        if session.transport is not None:
+            session.transport.close()
+            session.transport = session.datagrams = None
+        session.pending = b''
+        session.connected = False
+
+    async def send(self, session, packet):
+        wire = packet
+        try:
+            if self.protocol == 'tcp':
+                if self.protocol_type == 'dns':
+                    wire = len(packet).to_bytes(2, 'big') + packet  # DNS over TCP 带 2 字节长度前缀，与同步路径一致
+                session.writer.write(wire)
+                await session.writer.drain()
+            else:
+                session.transport.sendto(bytes(packet))
+        except (OSError, ConnectionError) as e:
+            logger.debug(f"Session {session.session_id} send failed: {e}")
+            session.stats['disconnects'] += 1
+            session.connected = False
+            return False
+        self.pcap_writer.write_frame(self.source_mac, self.dest_mac, self.source_ip, self.target_ip,
+                                     self.protocol, session.source_port, self.target_port, wire)
+        return True
+
+    async def read_message(self, session):
+        """按 stream_frame_length 的协议边界从 TCP 流读出一条完整报文，返回 (线上字节, 不含长度前缀的报文)。
+        只在数据足够时消费，已读部分存在 session.pending，被超时取消后下次接着读"""
+        if self.protocol_type not in STREAM_FRAMED_PROTOCOLS:
+            data = await session.reader.read(4096)
+            if not data:
+                raise asyncio.IncompleteReadError(b'', None)
+            return data, data
+        framed = stream_frame_length(self.protocol_type, session.pending) if session.pending else None
+        while framed is None:
+            session.pending += await session.reader.readexactly(1)
+            framed = stream_frame_length(self.protocol_type, session.pending)
+        prefix, total = framed
+        if total > len(session.pending):
+            session.pending += await session.reader.readexactly(total - len(session.pending))
+        wire, session.pending = session.pending, b''
+        return wire, wire[prefix:total]
+
+    async def receive(self, session, timeout):
+        try:
+            if self.protocol == 'tcp':
+                wire, data = await asyncio.wait_for(self.read_message(session), timeout)
+            else:
+                wire = data = await asyncio.wait_for(session.datagrams.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except asyncio.IncompleteReadError:
+            session.stats['disconnects'] += 1
+            session.connected = False
+            return None
+        except (OSError, ConnectionError) as e:
+            logger.debug(f"Session {session.session_id} receive failed: {e}")
+            session.stats['disconnects'] += 1
+            session.connected = False
+            return None
+        self.pcap_writer.write_frame(self.dest_mac, self.source_mac, self.target_ip, self.source_ip,
+                                     self.protocol, self.target_port, session.source_port, wire)
+        return data
+
+    async def run_session(self, session, input_fields, deadline, fuzz_ratio, max_retries):
+        loop = asyncio.get_running_loop()
+        generator = session.generator
+        stats = session.stats
+        failed_connects = 0
+        no_response_count = 0
+        try:
+            while loop.time() < deadline:
+                if not session.connected:
+                    if session.writer is not None or session.transport is not None:
+                        self.close(session)
+                        stats['reconnects'] += 1
+                    if not await self.connect(session):
+                        failed_connects += 1
+                        if failed_connects >= self.MAX_RECONNECTS:
+                            logger.warning(f"Session {session.session_id} gave up after {failed_connects} failed connects")
+                            break
+                        await asyncio.sleep(self.RETRY_DELAY)
+                        continue
+                    failed_connects = 0
+                # 不限速时 sleep(0) 也会让出事件循环，避免单个会话占满
+                await asyncio.sleep(min(session.pacer.reserve(), max(0.0, deadline - loop.time())))
+                stats['iterations'] += 1
+                sent_time = None
+                next_state = generator.select_next_state()
+                if not next_state:
+                    break
+                generator.current_state = next_state
+                if next_state in generator.client_messages:
+                    packet = generator.generate_next(next_state, input_fields, fuzz_ratio)
+                    if not packet:
+                        continue
+                    if not await self.send(session, packet):
+                        stats['send_failures'] += 1
+                        continue
+                    stats['sent'] += 1
+                    sent_time = loop.time()
+                    if self.protocol_type == 'mqtt' and next_state == 'DISCONNECT':
+                        session.connected = False
+                        continue
+                received = await self.receive(session, max(0.0, min(self.RECEIVE_TIMEOUT, deadline - loop.time())))
+                if received:
+                    if sent_time is not None:
+                        session.pacer.observe_latency(loop.time() - sent_time)
+                    no_response_count = 0
+                    stats['received'] += 1
+                    msg_name = generator.identify_message(
+                        received,
+                        dest_mac=self.dest_mac,
+                        source_mac=self.source_mac,
+                        target_ip=self.target_ip,
+                        source_ip=self.source_ip,
+                        target_port=self.target_port,
+                        source_port=session.source_port,
+                        protocol=self.protocol
+                    )
+                    count_session_message(stats, msg_name)
+                    next_state = generator.select_next_state(msg_name)
+                    if next_state:
+                        generator.current_state = next_state
+                    else:
+                        generator.reset_state()
+                elif session.connected:
+                    no_response_count += 1
+                    stats['no_response'] += 1
+                    if no_response_count >= max_retries:
+                        logger.warning(f"Session {session.session_id} got no response after {no_response_count} attempts, stopping")
+                        break
+                    generator.reset_state()
+        finally:
+            self.close(session)
+            stats['pacing'] = session.pacer.report()
+            stats['coverage'] = self.coverage.report()
+            if generator.corpus is not None:
+                generator.corpus.commit()
+                stats['new_signatures'] = generator.new_signatures
+            # 各会话共享覆盖率统计，状态选择受其他会话影响，这里只记录种子，不写重放 trace
+            stats['seed'] = generator.seed
+        return {'session_id': session.session_id, 'source_port': session.source_port, 'stats': stats}
+
+    async def run_async(self, input_fields, timeout, fuzz_ratio, max_retries):
+        loop = asyncio.get_running_loop()
+        self.connect_semaphore = asyncio.Semaphore(self.CONNECT_CONCURRENCY)
+        start_time = loop.time()
+        deadline = start_time + timeout
+        tasks = [
+            asyncio.create_task(self.run_session(self.new_session(session_id, input_fields), input_fields, deadline, fuzz_ratio, max_retries))
+            for session_id in range(self.sessions)
+        ]
+        results = []
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                logger.error(f"Async session failed: {result}")
+            else:
+                result['stats']['elapsed'] = loop.time() - start_time
+                results.append(result)
+        return results
+
+    def run(self, input_fields, timeout=30.0, fuzz_ratio=0.2, max_retries=5):
+        self.pcap_writer = PcapSink(
+            FramePcapWriter(self.pcap_file, linktype=1),
+            max_queue=self.PCAP_QUEUE_SIZE,
+            flush_interval=self.PCAP_FLUSH_INTERVAL,
+            drop_policy=self.PCAP_DROP_POLICY
+        )
+        self.seed = campaign_seed(input_fields)
+        logger.info(f"Starting {self.sessions} async sessions against {self.target_ip}:{self.target_port} via {self.protocol}, seed {self.seed}")
+        try:
+            results = asyncio.run(self.run_async(input_fields or {}, timeout, fuzz_ratio, max_retries))
+        finally:
+            pcap_stats = self.pcap_writer.close()
+        totals = write_run_stats(self.pcap_file, results, frames=pcap_stats['written'], pcap_dropped=pcap_stats['dropped'], seed=self.seed)
+        logger.info(f"Async run finished, PCAP saved to {self.pcap_file}, totals: {totals}")
+        return self.pcap_file
+
+class SessionManager:
+    """跨 GEN_PACK 调用复用会话：按 (目标 IP, 端口, 传输协议, IR) 保存已连接的 Fuzzer 及其状态机状态，空闲超时后关闭。
+    复用会话的 trace 必须从会话创建开始才能重放，运行次数或 trace 长度超限时换用新会话，避免 trace 文件无限增长"""
+    IDLE_TIMEOUT = 60.0  # 低于 MQTT 默认 keep_alive(60s) 的 1.5 倍，避免 broker 先断开空闲连接
+    MAX_RUNS = 20
+    MAX_TRACE_EVENTS = 200000
+
+    def __init__(self, idle_timeout=None, max_runs=None, max_trace_events=None):
+        self.idle_timeout = idle_timeout if idle_timeout is not None else self.IDLE_TIMEOUT
+        self.max_runs = max_runs or self.MAX_RUNS
+        self.max_trace_events = max_trace_events or self.MAX_TRACE_EVENTS
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def start_reaper(self):
+        # 后台线程定期关闭空闲会话，即使之后不再有 GEN_PACK 请求也不会一直占用连接
+        if self.reaper is None:
+            self.reaper = threading.Thread(target=self.reap, name="session-reaper", daemon=True)
+            self.reaper.start()
+
+    def reap(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            self.expire_idle()
+
+    def expire_idle(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            expired = [key for key, entry in self.sessions.items()
+                       if not entry['busy'] and now - entry['last_used'] >= self.idle_timeout]
+            entries = [self.sessions.pop(key) for key in expired]
+        for key, entry in zip(expired, entries):
+            logger.info(f"Expiring idle session {key}")
+            entry['fuzzer'].close()
+        return len(expired)
+
+    def acquire(self, key, cache, factory):
+        """返回 (fuzzer, 是否复用)。同一会话正被其他请求使用时返回不入池的新 Fuzzer"""
+        self.expire_idle()
+        self.start_reaper()
+        with self.lock:
+            entry = self.sessions.get(key)
+            if entry is not None and entry['fuzzer'].generator.messages is not cache["messages"]:
+                # IR 已重新解析，旧会话的状态机不再适用
+                self.sessions.pop(key)
+                stale, entry = entry, None
+            elif entry is not None and not entry['busy'] and self.exhausted(entry):
+                logger.info(f"Rotating session {key} after {entry['runs']} runs, {len(entry['fuzzer'].generator.trace)} trace events")
+                self.sessions.pop(key)
+                stale, entry = entry, None
+            else:
+                stale = None
+            if entry is not None and entry['busy']:
+                logger.info(f"Session {key} is busy, using a one-off session")
+                return factory(), False
+            if entry is None:
+                entry = {'fuzzer': factory(), 'busy': False, 'last_used': time.time(), 'runs': 0}
+                self.sessions[key] = entry
+            entry['busy'] = True
+        if stale is not None:
+            stale['fuzzer'].close()
+        return entry['fuzzer'], entry['runs'] > 0
+
+    def exhausted(self, entry):
+        return entry['runs'] >= self.max_runs or len(entry['fuzzer'].generator.trace) >= self.max_trace_events
+
+    def release(self, key, fuzzer):
+        with self.lock:
+            entry = self.sessions.get(key)
+            if entry is None or entry['fuzzer'] is not fuzzer:
+                fuzzer.close()
+                return
+            entry['busy'] = False
+            entry['last_used'] = time.time()
+            entry['runs'] += 1
+
+    def run(self, key, cache, factory, input_fields, timeout):
+        fuzzer, reused = self.acquire(key, cache, factory)
+        if reused:
+            # 每次调用输出独立的 pcap 和统计，连接和状态机状态沿用上一次
+            fuzzer.pcap_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
+            fuzzer.stats = new_session_stats()
+            logger.info(f"Reusing session {key}, connected: {fuzzer.connected}, state: {fuzzer.generator.current_state}")
+        try:
+            return fuzzer.communicate_with_timeout(input_fields, timeout=timeout, keep_open=True)
+        finally:
+            self.release(key, fuzzer)
+
+    def close_all(self):
+        with self.lock:
+            entries = list(self.sessions.values())
+            self.sessions.clear()
+        for entry in entries:
+            entry['fuzzer'].close()
+
+SESSION_MANAGER = SessionManager()
+atexit.register(SESSION_MANAGER.close_all)
+
 def GEN_FSM(xml_file):
     init_parser(xml_file)
     return {
@@ -1191,7 +3784,7 @@ def GEN_FSM(xml_file):
         "random_fields": GLOBAL_RANDOM_FIELDS
     }
 
-def GEN_PACK(xml_file, input_fields):
+def GEN_PACK(xml_file, input_fields, sessions=None, timeout=30.0):
     protocol_type=PROTOCOL_TYPE[xml_file]
     try:
         target_ip = input_fields.get("target_ip")
@@ -1204,9 +3797,621 @@ def GEN_PACK(xml_file, input_fields):
     except (TypeError, ValueError) as e:
         logger.error(f"Invalid input fields: {e}")
         return "outpcap/error.pcap"
+    try:
+        sessions = int(sessions if sessions is not None else input_fields.get("sessions") or 1)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid session count {input_fields.get('sessions')}, using 1")
+        sessions = 1
+    if not 1 <= sessions <= MAX_SESSIONS:
+        logger.warning(f"Session count {sessions} out of range, clamping to 1..{MAX_SESSIONS}")
+        sessions = max(1, min(sessions, MAX_SESSIONS))
+    if input_fields.get("engine") == "async" and protocol_type != 'modbus':
+        cache = init_parser(xml_file)
+        return AsyncFuzzer(target_ip, target_port, protocol, cache, protocol_type, sessions=sessions).run(input_fields, timeout=timeout)
+    if input_fields.get("engine") == "fork":
+        if protocol_type != 'modbus' or protocol == 'tcp':
+            return run_forked_sessions(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, sessions, timeout=timeout)
+        logger.warning("Fork execution needs a network target, Modbus RTU runs a single session")
+    serial_port = slave_ids = None
+    if protocol_type == 'modbus':
+        try:
+            slave_ids = parse_slave_ids(input_fields.get("slave_ids"))
+        except ValueError as e:
+            logger.error(f"Invalid input fields: {e}")
+            return "outpcap/error.pcap"
+    if protocol_type == 'modbus' and protocol != 'tcp':
+        serial_ports = [port.strip() for port in str(input_fields.get("serial_port") or "").split(',') if port.strip()]
+        if len(serial_ports) > 1:
+            return run_modbus_campaign(xml_file, {port: slave_ids for port in serial_ports}, input_fields, timeout=timeout)
+        serial_port = serial_ports[0] if serial_ports else None
+        if sessions > 1:
+            logger.warning("Parallel sessions are not supported on a single serial port, running one session")
+    elif sessions > 1:
+        return run_parallel_sessions(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, sessions, timeout=timeout)
+    cache = init_parser(xml_file)
+
+    def new_fuzzer():
+        return Fuzzer(target_ip, target_port, protocol, cache, protocol_type, serial_port=serial_port, slave_ids=slave_ids,
+                      seed=campaign_seed(input_fields))
+
+    # 会话复用需显式开启：复用时 trace 从会话创建开始累计，连接和状态机状态也会带到下一次测试
+    if str(input_fields.get("reuse_session", "false")).lower() not in ("1", "true", "yes", "on"):
+        return new_fuzzer().communicate_with_timeout(input_fields, timeout=timeout)
+    key = (target_ip, str(target_port), protocol, xml_file)
+    if protocol_type == 'modbus':
+        key += (serial_port, tuple(slave_ids or ()))
+    return SESSION_MANAGER.run(key, cache, new_fuzzer, input_fields, timeout)
+
+def parse_slave_ids(spec):
+    """解析形如 "1-4,7" 的从站地址列表，未指定时返回 None"""
+    if spec is None or spec == "":
+        return None
+    if isinstance(spec, (list, tuple)):
+        slave_ids = [int(slave_id) for slave_id in spec]
+    else:
+        slave_ids = []
+        for part in str(spec).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                low, high = (int(x, 0) for x in part.split('-', 1))
+                slave_ids.extend(range(low, high + 1))
+            else:
+                slave_ids.append(int(part, 0))
+    invalid = [slave_id for slave_id in slave_ids if not 1 <= slave_id <= 247]
+    if invalid:
+        raise ValueError(f"Modbus slave IDs must be within 1-247, got {invalid}")
+    return slave_ids or None
+
+def run_modbus_bus(xml_file, serial_port, slave_ids, input_fields, source_port, timeout, seed=None, coverage=None):
+    cache = init_parser(xml_file)
+    fuzzer = Fuzzer(input_fields.get("target_ip"), '', 'serial', cache, 'modbus', source_port=source_port,
+                    serial_port=serial_port, slave_ids=slave_ids, seed=seed, coverage=coverage)
+    pcap_file = fuzzer.communicate_with_timeout(input_fields, timeout=timeout)
+    return {'serial_port': serial_port, 'slave_ids': slave_ids, 'source_port': source_port, 'pcap_file': pcap_file, 'stats': fuzzer.stats}
+
+def run_modbus_campaign(xml_file, buses, input_fields, timeout=30.0):
+    """多条 RS-485 总线并行测试：每个串口一个线程（串口读写会释放 GIL），
+    各总线轮询自己的从站列表；结果按串口和从站汇总，合并为一个 pcap，统计写入同名 .json"""
+    results = []
+    results_lock = threading.Lock()
+    seed = campaign_seed(input_fields)
+    # 每条总线各自统计覆盖率，状态选择只取决于本总线的种子和 trace，可以逐条总线重放；
+    # 登记合并视图，界面查询到的是所有总线的并集
+    cache = init_parser(xml_file)
+    coverages = [StateCoverage(cache["state_machine"]) for _ in buses]
+    IR_COVERAGE['modbus'] = MergedCoverage(coverages)
+
+    def worker(index, serial_port, slave_ids):
+        try:
+            # 每条总线使用不同的伪源端口，合并后的 pcap 中可以区分各总线
+            result = run_modbus_bus(xml_file, serial_port, slave_ids, input_fields, SOURCE_PORT + index, timeout,
+                                    seed=session_seed(seed, index), coverage=coverages[index])
+        except Exception as e:
+            logger.error(f"Modbus bus {serial_port} failed: {e}")
+            return
+        with results_lock:
+            results.append(result)
+
+    threads = [
+        threading.Thread(target=worker, args=(index, serial_port, slave_ids), name=f"modbus-{os.path.basename(serial_port)}", daemon=True)
+        for index, (serial_port, slave_ids) in enumerate(buses.items())
+    ]
+    logger.info(f"Starting Modbus campaign on {len(threads)} buses: {buses}")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.sort(key=lambda r: r['source_port'])
+    os.makedirs("outpcap", exist_ok=True)
+    merged_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
+    pcap_files = [r['pcap_file'] for r in results if os.path.exists(r['pcap_file'])]
+    frames = merge_pcaps(pcap_files, merged_file)
+    slaves = {}
+    for result in results:
+        for slave_id, counters in result['stats'].get('slaves', {}).items():
+            slaves[f"{result['serial_port']}/{slave_id}"] = counters
+    totals = write_run_stats(merged_file, results, frames=frames, slaves=slaves, seed=seed)
+    logger.info(f"Modbus campaign finished, merged {len(pcap_files)} bus pcaps into {merged_file}, totals: {totals}")
+    return merged_file
+
+MAX_SESSIONS = 1024  # 单次测试的会话数上限，会话数来自 HTTP 请求
+MAX_SESSION_WORKERS = int(os.environ.get("FUZZ_MAX_WORKERS") or 0) or None  # 会话进程池上限，未配置时取 CPU 核数
+
+def session_pool_context():
+    """会话进程池的启动方式。控制器是多线程的 Flask 应用，fork 会让子进程继承其他线程持有的锁，
+    因此优先用 forkserver（预先导入本模块，工作进程不再各自导入 scapy），不支持时退回 spawn"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def session_workers(sessions, max_workers=None):
+    """进程池大小：不超过会话数，也不超过配置上限或 CPU 核数"""
+    limit = max_workers or MAX_SESSION_WORKERS or os.cpu_count() or 1
+    return max(1, min(sessions, limit))
+
+def split_sessions(tasks, workers):
+    """把会话轮流分给各工作进程，每个进程内的会话用线程并发运行"""
+    return [tasks[i::workers] for i in range(workers) if tasks[i::workers]]
+
+def run_session_group(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, tasks, timeout, runner=None):
+    """工作进程内并发运行一组会话，tasks 为 (会话编号, 源端口, 种子, 其余参数...)，由 runner（默认 run_fuzz_session）执行；
+    会话大部分时间在等待 I/O，线程并发即可让整组会话同时开始、同时结束，不会按批次排队"""
+    runner = runner or run_fuzz_session
+    init_parser(xml_file)
+    results = []
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [
+            executor.submit(runner, xml_file, target_ip, target_port, protocol, protocol_type,
+                            input_fields, session_id, source_port, timeout, seed, *extra)
+            for session_id, source_port, seed, *extra in tasks
+        ]
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Fuzzing session failed: {e}")
+    return results
+
+def run_fuzz_session(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, session_id, source_port, timeout, seed=None):
+    """进程池中的单个会话，返回该会话的 pcap 路径和统计信息；seed 由测试种子按会话编号派生"""
     cache = init_parser(xml_file)
-    fuzzer = Fuzzer(target_ip, target_port, protocol, cache, protocol_type)
-    return fuzzer.communicate_with_timeout(input_fields, timeout=30.0)
+    slave_ids = parse_slave_ids(input_fields.get("slave_ids")) if protocol_type == 'modbus' else None
+    fuzzer = Fuzzer(target_ip, target_port, protocol, cache, protocol_type, session_id=session_id, source_port=source_port,
+                    slave_ids=slave_ids, seed=seed)
+    pcap_file = fuzzer.communicate_with_timeout(input_fields, timeout=timeout)
+    return {'session_id': session_id, 'source_port': fuzzer.source_port, 'pcap_file': pcap_file, 'stats': fuzzer.stats}
+
+def read_pcap_records(pcap_file):
+    """逐条读取 pcap 记录，返回 (秒, 微秒, 帧数据)"""
+    with open(pcap_file, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+        magic = struct.unpack('<I', header[:4])[0]
+        if magic == 0xa1b2c3d4:
+            record_header = struct.Struct('<IIII')
+        elif magic == 0xd4c3b2a1:
+            record_header = struct.Struct('>IIII')
+        else:
+            raise ValueError(f"Unsupported pcap format in {pcap_file}")
+        while True:
+            raw = f.read(record_header.size)
+            if len(raw) < record_header.size:
+                return
+            sec, usec, incl_len, _ = record_header.unpack(raw)
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                logger.warning(f"Truncated record in {pcap_file}")
+                return
+            yield sec, usec, data
+
+def merge_pcaps(pcap_files, output_file):
+    """按时间戳归并多个会话的 pcap，返回写入的帧数"""
+    writer = FramePcapWriter(output_file, linktype=1)
+    count = 0
+    try:
+        for sec, usec, data in heapq.merge(*(read_pcap_records(f) for f in pcap_files), key=lambda r: (r[0], r[1])):
+            writer.write_raw(data, timestamp=sec + usec / 1_000_000)
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+def aggregate_session_stats(results):
+    totals = {'sessions': len(results), 'iterations': 0, 'sent': 0, 'received': 0, 'send_failures': 0,
+              'no_response': 0, 'reconnects': 0, 'disconnects': 0, 'keepalive_probes': 0, 'pcap_dropped': 0,
+              'new_signatures': 0, 'crashes': 0, 'prefix_replays': 0, 'messages': {}}
+    for result in results:
+        stats = result['stats']
+        for key in ('iterations', 'sent', 'received', 'send_failures', 'no_response', 'reconnects', 'disconnects',
+                    'keepalive_probes', 'pcap_dropped', 'new_signatures', 'prefix_replays'):
+            totals[key] += stats.get(key, 0)
+        totals['crashes'] += len(stats.get('crashes', ()))
+        for msg_name, count in stats.get('messages', {}).items():
+            totals['messages'][msg_name] = totals['messages'].get(msg_name, 0) + count
+    elapsed = max((result['stats'].get('elapsed', 0) for result in results), default=0)
+    totals['elapsed'] = elapsed
+    totals['send_rate'] = totals['sent'] / elapsed if elapsed else 0.0
+    # 各会话（或进程）分别统计覆盖率，汇总时取并集
+    reports = [result['stats']['coverage'] for result in results if result['stats'].get('coverage')]
+    if reports:
+        totals['coverage'] = merge_coverage_reports(reports)
+    return totals
+
+def write_run_stats(pcap_file, results, **extra):
+    """汇总各会话统计并写入与 pcap 同名的 .json 文件，返回汇总结果"""
+    totals = aggregate_session_stats(results)
+    totals.update(extra)
+    with open(os.path.splitext(pcap_file)[0] + '.json', 'w') as f:
+        json.dump({'totals': totals, 'sessions': results}, f, indent=2)
+    return totals
+
+def resolve_run_file(path, root="outpcap"):
+    """把控制器请求中的文件路径解析为真实路径，只接受 root 目录（默认 outpcap）之内的文件，否则返回 None"""
+    if not path:
+        return None
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([root, resolved]) != root:
+        logger.warning(f"Rejected path outside {root}: {path}")
+        return None
+    return resolved
+
+def find_trace(pcap_file, session_id=None):
+    """按 pcap 路径找到重放 trace：单会话 pcap 直接对应同名 .trace.json，
+    合并后的 pcap 从同名 .json 统计里按 session_id（Modbus 多总线为串口名）查找"""
+    base = os.path.splitext(pcap_file)[0]
+    if session_id is None and os.path.exists(base + '.trace.json'):
+        return base + '.trace.json'
+    try:
+        with open(base + '.json') as f:
+            sessions = json.load(f).get('sessions', [])
+    except (OSError, ValueError):
+        return None
+    for result in sessions:
+        if session_id is None or str(result.get('session_id', result.get('serial_port'))) == str(session_id):
+            trace_file = result.get('stats', {}).get('trace_file')
+            if trace_file:
+                return trace_file
+    return None
+
+def protocol_xml(protocol_type):
+    return next(xml for xml, proto in PROTOCOL_TYPE.items() if proto == protocol_type)
+
+def write_packets_pcap(output_file, packets, protocol_type, protocol, target_ip, target_port, source_port):
+    """把离线得到的报文序列写成发送方向的 pcap，Modbus 报文加 MBAP 头，便于在 Wireshark 中查看"""
+    transport = 'udp' if protocol == 'serial' else protocol
+    source_ip = SOURCE_IP if protocol == 'serial' else "127.0.0.1"
+    writer = FramePcapWriter(output_file, linktype=1)
+    try:
+        for transaction_id, packet in enumerate(packets, 1):
+            if protocol_type == 'modbus':
+                packet = rtu_to_mbap(packet, transaction_id & 0xFFFF)
+            writer.write_frame(SOURCE_MAC, DEST_MAC, source_ip, target_ip or DEST_IP, transport, source_port, target_port, packet)
+    finally:
+        writer.close()
+    return output_file
+
+def regenerate_packets(trace, cache=None):
+    """在新的生成器上按相同种子重新执行 trace 中的决策序列，返回 [(状态名, 报文), ...]，不连接目标。
+    使用了语料库的测试种子报文内容取决于当时的语料库，重放结果可能从第一次复用语料处开始不同"""
+    protocol_type = trace['protocol_type']
+    if cache is None:
+        cache = init_parser(protocol_xml(protocol_type))
+    # 单独的覆盖率统计，不覆盖界面上正在进行的测试
+    generator = create_generator(cache, protocol_type, StateCoverage(cache["state_machine"]), seed=trace['seed'])
+    generator.config.update(trace.get('config') or {})
+    if trace.get('corpus'):
+        logger.warning("Traced run used a corpus, replayed packets may diverge from the original run")
+    input_fields = trace.get('input_fields') or {}
+    packets = []
+    for event in trace['events']:
+        kind = event[0]
+        if kind == 'S':
+            next_state = generator.select_next_state(event[1])
+            if next_state:
+                generator.current_state = next_state
+        elif kind == 'R':
+            generator.reset_state()
+        elif kind == 'D':
+            generator.drive_to(event[1])
+        elif kind == 'G':
+            packet = generator.generate_next(event[1], input_fields, event[2])
+            if packet:
+                packets.append((event[1], bytes(packet)))
+        elif kind == 'F':
+            generator.fork_state = event[1]
+        elif kind == 'P':
+            packet = generator.generate_prefix_packet(event[1], {})
+            if packet:
+                packets.append((event[1], bytes(packet)))
+        elif kind == 'X' and packets:
+            packets.pop()
+    return packets
+
+def replay_trace(trace_file, output_file=None):
+    """离线重放一次测试：按 trace 重新生成发送的报文并写入 pcap（Modbus 报文加 MBAP 头），返回 pcap 路径"""
+    with open(trace_file) as f:
+        trace = json.load(f)
+    packets = regenerate_packets(trace)
+    os.makedirs("outpcap", exist_ok=True)
+    output_file = output_file or f"outpcap/replay_{uuid.uuid4().hex}.pcap"
+    write_packets_pcap(output_file, [packet for _, packet in packets], trace['protocol_type'], trace['protocol'],
+                       trace['target_ip'], trace['target_port'], trace['source_port'])
+    logger.info(f"Replayed {len(packets)} packets from {trace_file} (seed {trace['seed']}) into {output_file}")
+    return output_file
+
+CRASH_DIR = "outpcap/crashes"
+FORK_SCOUT_SHARE = 0.2  # 分叉执行时探索前缀占总时长的比例
+
+class CrashMinimizer:
+    """用 ddmin 把导致目标崩溃/挂起的报文序列缩减为仍能复现的最小子序列。
+    每次试验前执行重启命令（环境变量 FUZZ_RESTART_CMD，命令应在目标就绪后返回）并等待目标恢复，
+    然后在新连接上按序发送报文，等待 SETTLE 秒后另开会话探测，探测失败即视为复现"""
+    SETTLE = 1.0
+    RECOVER_TIMEOUT = 60.0
+    RESTART_TIMEOUT = 60.0
+    MAX_TESTS = 200
+
+    def __init__(self, record, target=None, restart_cmd=None, max_tests=None, pcap_writer=None):
+        self.record = record
+        self.cache = init_parser(protocol_xml(record['protocol_type']))
+        self.target_ip, self.target_port = record['target_ip'], record['target_port']
+        if target:
+            # 在本地替身（如 modbus_tcp_server）上最小化，格式为 host:port
+            host, _, port = str(target).rpartition(':')
+            self.target_ip, self.target_port = host or self.target_ip, int(port)
+        self.restart_cmd = restart_cmd if restart_cmd is not None else os.environ.get("FUZZ_RESTART_CMD")
+        self.max_tests = max_tests or self.MAX_TESTS
+        self.pcap_writer = pcap_writer
+        self.input_fields = record.get('input_fields') or {}
+        self.tests = 0
+        self.results = {}
+
+    def new_session(self):
+        return Fuzzer(self.target_ip, self.target_port, self.record['protocol'], self.cache, self.record['protocol_type'],
+                      serial_port=self.record.get('serial_port'), slave_ids=self.record.get('slave_ids'),
+                      coverage=StateCoverage(self.cache["state_machine"]))
+
+    def probe(self):
+        session = self.new_session()
+        try:
+            return session.probe(self.input_fields, self.pcap_writer)
+        finally:
+            session.close()
+
+    def recover(self):
+        if self.restart_cmd:
+            try:
+                subprocess.run(shlex.split(self.restart_cmd), timeout=self.RESTART_TIMEOUT, check=False)
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"Restart command failed: {e}")
+        deadline = time.time() + self.RECOVER_TIMEOUT
+        while self.probe() != 'alive':
+            if time.time() >= deadline:
+                raise RuntimeError(f"Target {self.target_ip}:{self.target_port} did not recover within {self.RECOVER_TIMEOUT}s")
+            time.sleep(self.SETTLE)
+
+    def reproduces(self, packets):
+        key = tuple(packets)
+        if key in self.results:
+            return self.results[key]
+        if self.tests >= self.max_tests:
+            return False
+        self.tests += 1
+        self.recover()
+        session = self.new_session()
+        start = time.time()
+        try:
+            if session.connect():
+                for packet in packets:
+                    if not session.send_packet(packet, self.pcap_writer, start, float('inf')):
+                        break
+                    session.receive_packet(self.pcap_writer, start, float('inf'))
+        finally:
+            session.close()
+        time.sleep(self.SETTLE)
+        status = self.probe()
+        logger.info(f"Minimization test {self.tests}: {len(packets)} packets, target {status}")
+        self.results[key] = status != 'alive'
+        return self.results[key]
+
+    def ddmin(self, packets):
+        n = 2
+        while len(packets) >= 2 and self.tests < self.max_tests:
+            chunk = -(-len(packets) // n)
+            subsets = [packets[i:i + chunk] for i in range(0, len(packets), chunk)]
+            reduced = next((subset for subset in subsets if self.reproduces(subset)), None)
+            if reduced is not None:
+                packets, n = reduced, 2
+                continue
+            if len(subsets) > 2:
+                complements = ([p for j, subset in enumerate(subsets) if j != i for p in subset] for i in range(len(subsets)))
+                reduced = next((complement for complement in complements if self.reproduces(complement)), None)
+                if reduced is not None:
+                    packets, n = reduced, max(n - 1, 2)
+                    continue
+            if n >= len(packets):
+                break
+            n = min(len(packets), n * 2)
+        return packets
+
+    def run(self):
+        """先确认完整序列能复现，再做 ddmin；不能复现时返回 None"""
+        packets = [bytes.fromhex(packet) for _, packet in self.record['packets']]
+        if not packets or not self.reproduces(packets):
+            return None
+        return self.ddmin(packets)
+
+def minimized_record_file(crash_file):
+    """最小化结果的记录文件：与崩溃记录同名的 .min.json，原记录保持不变"""
+    return os.path.splitext(crash_file)[0] + '.min.json'
+
+def minimize_crash(crash_file, target=None, restart_cmd=None, max_tests=None):
+    """对 save_crash 保存的记录做最小化，结果连同原记录写入 minimized_record_file() 并另存为 .min.pcap；
+    返回最小报文序列，不能复现时返回 None"""
+    with open(crash_file) as f:
+        record = json.load(f)
+    base = os.path.splitext(crash_file)[0]
+    pcap_writer = PcapSink(FramePcapWriter(base + '.tests.pcap', linktype=1))
+    minimizer = CrashMinimizer(record, target=target, restart_cmd=restart_cmd, max_tests=max_tests, pcap_writer=pcap_writer)
+    logger.info(f"Minimizing {len(record['packets'])} packets from {crash_file} against {minimizer.target_ip}:{minimizer.target_port}")
+    try:
+        minimized = minimizer.run()
+    finally:
+        pcap_writer.close()
+    record['minimization'] = {'tests': minimizer.tests, 'reproduced': minimized is not None,
+                              'target': f"{minimizer.target_ip}:{minimizer.target_port}"}
+    if minimized is not None:
+        record['minimized'] = [packet.hex() for packet in minimized]
+        record['minimized_pcap'] = write_packets_pcap(base + '.min.pcap', minimized, record['protocol_type'], record['protocol'],
+                                                      minimizer.target_ip, minimizer.target_port, SOURCE_PORT)
+        logger.info(f"Minimized {crash_file} from {len(record['packets'])} to {len(minimized)} packets in {minimizer.tests} tests")
+    else:
+        logger.warning(f"Could not reproduce {crash_file} in {minimizer.tests} tests")
+    with open(minimized_record_file(crash_file), 'w') as f:
+        json.dump(record, f, indent=2, default=str)
+    return minimized
+
+MINIMIZE_JOBS = {}  # 崩溃记录真实路径 -> 最小化任务状态
+MINIMIZE_LOCK = threading.Lock()
+MINIMIZE_RUN_LOCK = threading.Lock()  # 最小化会重启并反复冲击目标，任务逐个执行
+
+def start_minimize_job(crash_file, target=None, restart=False):
+    """在后台线程中最小化崩溃记录，立即返回任务状态。同一记录已有任务时直接返回其状态，
+    restart 为真且上一次任务已结束时重新执行"""
+    key = os.path.realpath(crash_file)
+    with MINIMIZE_LOCK:
+        job = MINIMIZE_JOBS.get(key)
+        if job is not None and (job['status'] in ('queued', 'running') or not restart):
+            return dict(job)
+        job = MINIMIZE_JOBS[key] = {'crash_file': crash_file, 'target': target, 'status': 'queued',
+                                    'record_file': minimized_record_file(crash_file), 'submitted': time.time()}
+        threading.Thread(target=run_minimize_job, args=(job,), name=f"minimize-{os.path.basename(crash_file)}", daemon=True).start()
+        return dict(job)
+
+def run_minimize_job(job):
+    with MINIMIZE_RUN_LOCK:
+        with MINIMIZE_LOCK:
+            job.update(status='running', started=time.time())
+        try:
+            minimized = minimize_crash(job['crash_file'], target=job['target'])
+            update = {'status': 'done', 'reproduced': minimized is not None,
+                      'minimized': len(minimized) if minimized is not None else None}
+        except Exception as e:
+            logger.error(f"Minimization of {job['crash_file']} failed: {e}")
+            update = {'status': 'failed', 'error': str(e)}
+        with MINIMIZE_LOCK:
+            job.update(update, finished=time.time())
+
+def minimize_job_status(crash_file):
+    with MINIMIZE_LOCK:
+        job = MINIMIZE_JOBS.get(os.path.realpath(crash_file))
+        return dict(job) if job is not None else None
+
+PREFIX_CACHE = {}  # (协议类型, 目标, 端口, 传输协议) -> {状态: 最短前缀}，同一进程内跨测试复用
+PREFIX_LOCK = threading.Lock()
+
+def merge_prefixes(store, prefixes):
+    """把新发现的前缀并入缓存，每个状态只保留最短的一条"""
+    with PREFIX_LOCK:
+        for state, prefix in prefixes.items():
+            if state not in store or len(prefix) < len(store[state]):
+                store[state] = tuple(prefix)
+
+def choose_fork_states(prefixes, generator, coverage, target_state=None):
+    """按优先级排列分叉点。指定目标状态时取离目标最近的已缓存状态；
+    否则优先未覆盖出边多的状态，其次前缀更长（更深）的状态"""
+    if target_state:
+        distances = {state: len(generator.path_to(target_state, state) or ()) if state != target_state else 0
+                     for state in prefixes if state == target_state or generator.path_to(target_state, state)}
+        return sorted(distances, key=lambda state: (distances[state], len(prefixes[state])))[:1]
+    return sorted(prefixes, key=lambda state: (-coverage.uncovered_out.get(state, 0), -len(prefixes[state]), state))
+
+def run_fork_worker(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, session_id, source_port, timeout,
+                    seed, fork_state, prefix):
+    """从分叉点开始的单个会话。会话运行在 spawn/forkserver 新建的工作进程里，不继承任何连接或目标状态：
+    建立连接后先重放一遍前缀把目标带到分叉点，再从这里开始变异；复位只把生成器的状态机模型退回分叉点，
+    不向目标发送任何报文，只有断线重连后才再次重放前缀"""
+    cache = init_parser(xml_file)
+    fuzzer = Fuzzer(target_ip, target_port, protocol, cache, protocol_type, session_id=session_id, source_port=source_port, seed=seed)
+    fuzzer.generator.fork_at(fork_state, prefix)
+    pcap_file = fuzzer.communicate_with_timeout(input_fields, timeout=timeout)
+    return {'session_id': session_id, 'source_port': fuzzer.source_port, 'fork_state': fork_state, 'pcap_file': pcap_file,
+            'stats': fuzzer.stats, 'prefixes': fuzzer.generator.prefixes}
+
+def run_forked_sessions(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, sessions, timeout=30.0, max_workers=None):
+    """从状态分叉执行。这里不 fork 进程，也不复制目标上的会话：先用一个锁步会话探索并记录到达各状态的
+    最短前缀（已缓存时跳过），再像 run_parallel_sessions 一样在有上限的进程池里并发启动 sessions 个会话，
+    每个会话连接后重放前缀到达分叉点（见 run_fork_worker），之后的复位不再重复握手。
+    合并各会话 pcap，统计写入同名 .json，会话发现的新前缀并回缓存"""
+    sessions = max(1, min(sessions, MAX_SESSIONS))
+    workers = session_workers(sessions, max_workers)
+    cache = init_parser(xml_file)
+    seed = campaign_seed(input_fields)
+    target_state = input_fields.get("target_state") or None
+    start_time = time.time()
+    with PREFIX_LOCK:
+        prefixes = PREFIX_CACHE.setdefault((protocol_type, target_ip, str(target_port), protocol), {})
+    scout = Fuzzer(target_ip, target_port, protocol, cache, protocol_type, source_port=None, seed=session_seed(seed, 'scout'),
+                   coverage=StateCoverage(cache["state_machine"]))
+    results = []
+    fork_states = choose_fork_states(prefixes, scout.generator, scout.generator.coverage, target_state)
+    if not fork_states:
+        # 锁步模式下响应才会驱动状态机，探索阶段固定用锁步
+        scout_fields = dict(input_fields, window=1, batch=1)
+        scout.communicate_with_timeout(scout_fields, timeout=timeout * FORK_SCOUT_SHARE)
+        merge_prefixes(prefixes, scout.generator.prefixes)
+        results.append({'session_id': 'scout', 'source_port': scout.source_port, 'pcap_file': scout.pcap_file, 'stats': scout.stats})
+        fork_states = choose_fork_states(prefixes, scout.generator, scout.generator.coverage, target_state)
+    if not fork_states:
+        logger.warning("No fork state reached, workers start from the initial state")
+    remaining = max(0.0, timeout - (time.time() - start_time))
+    base_port = random.Random(seed).randint(1024, 65536 - sessions)
+    tasks = []
+    for session_id in range(sessions):
+        fork_state = fork_states[session_id % len(fork_states)] if fork_states else None
+        tasks.append((session_id, base_port + session_id, session_seed(seed, session_id), fork_state,
+                      prefixes.get(fork_state, ()) if fork_state else ()))
+    logger.info(f"Starting {sessions} sessions from fork states {fork_states or ['INIT_STATE']} on {workers} workers, seed {seed}")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=session_pool_context()) as executor:
+        futures = [
+            executor.submit(run_session_group, xml_file, target_ip, target_port, protocol, protocol_type,
+                            input_fields, group, remaining, run_fork_worker)
+            for group in split_sessions(tasks, workers)
+        ]
+        for future in as_completed(futures):
+            try:
+                group_results = future.result()
+            except Exception as e:
+                logger.error(f"Forked session group failed: {e}")
+                continue
+            for result in group_results:
+                merge_prefixes(prefixes, result.pop('prefixes'))
+                results.append(result)
+    results.sort(key=lambda r: str(r['session_id']))
+    os.makedirs("outpcap", exist_ok=True)
+    merged_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
+    pcap_files = [r['pcap_file'] for r in results if os.path.exists(r['pcap_file'])]
+    frames = merge_pcaps(pcap_files, merged_file)
+    totals = write_run_stats(merged_file, results, frames=frames, seed=seed, fork_states=fork_states,
+                             prefixes={state: list(prefix) for state, prefix in prefixes.items()})
+    logger.info(f"Forked run finished, merged {len(pcap_files)} pcaps into {merged_file}, totals: {totals}")
+    return merged_file
+
+def run_parallel_sessions(xml_file, target_ip, target_port, protocol, protocol_type, input_fields, sessions, timeout=30.0, max_workers=None):
+    """在进程池中并行运行多个独立会话，合并为一个按时间排序的 pcap，统计信息写入同名 .json 文件。
+    进程数不超过 CPU 核数（或 FUZZ_MAX_WORKERS），每个进程用线程并发运行分到的多个会话，整个测试只持续 timeout"""
+    sessions = max(1, min(sessions, MAX_SESSIONS))
+    workers = session_workers(sessions, max_workers)
+    seed = campaign_seed(input_fields)
+    base_port = random.Random(seed).randint(1024, 65536 - sessions)
+    tasks = [(session_id, base_port + session_id, session_seed(seed, session_id)) for session_id in range(sessions)]
+    results = []
+    logger.info(f"Starting {sessions} parallel sessions on {workers} workers against {target_ip}:{target_port}, seed {seed}")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=session_pool_context()) as executor:
+        futures = [
+            executor.submit(run_session_group, xml_file, target_ip, target_port, protocol, protocol_type,
+                            input_fields, group, timeout)
+            for group in split_sessions(tasks, workers)
+        ]
+        for future in as_completed(futures):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                logger.error(f"Fuzzing session group failed: {e}")
+    results.sort(key=lambda r: r['session_id'])
+    os.makedirs("outpcap", exist_ok=True)
+    merged_file = f"outpcap/output_{uuid.uuid4().hex}.pcap"
+    pcap_files = [r['pcap_file'] for r in results if os.path.exists(r['pcap_file'])]
+    frames = merge_pcaps(pcap_files, merged_file)
+    totals = write_run_stats(merged_file, results, frames=frames, seed=seed)
+    logger.info(f"Merged {len(pcap_files)} session pcaps into {merged_file} ({frames} frames), totals: {totals}")
+    return merged_file
 
 def generate_default_inputs(mandatory_fields, protocol_type):
     user_input = {}
@@ -0,0 +1,127 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <stdarg.h>
+#include <modbus.h>
+#include <time.h>
+#include <unistd.h>
+
+// 日志函数，带时间戳
+void log_message(const char *level, const char *fmt, ...)
+{
+    va_list args;
+    time_t now = time(NULL);
+    char timestamp[32];
+    strftime(timestamp, sizeof(timestamp), "%Y-%m-%d %H:%M:%S", localtime(&now));
+    fprintf(stderr, "%s [%s] ", timestamp, level);
+    va_start(args, fmt);
+    vfprintf(stderr, fmt, args);
+    va_end(args);
+    fprintf(stderr, "\n");
+    fflush(stderr);
+}
+
+// 打印报文内容
+void log_packet(const char *prefix, const uint8_t *data, int len)
+{
+    fprintf(stderr, "%s: ", prefix);
+    for (int i = 0; i < len; i++)
+    {
+        fprintf(stderr, "%02X ", data[i]);
+    }
+    fprintf(stderr, "\n");
+    fflush(stderr);
+}
+
+int main(int argc, char *argv[])
+{
+    modbus_t *ctx = NULL;
+    modbus_mapping_t *mb_mapping = NULL;
+    uint8_t query[MODBUS_TCP_MAX_ADU_LENGTH];
+    int port = argc > 1 ? atoi(argv[1]) : 502;
+    int server_socket;
+    int rc;
+
+    log_message("INFO", "Starting Modbus TCP server on 0.0.0.0:%d", port);
+
+    // 创建 Modbus TCP 上下文
+    ctx = modbus_new_tcp(NULL, port);
+    if (ctx == NULL)
+    {
+        log_message("ERROR", "Unable to create Modbus TCP context: %s", modbus_strerror(errno));
+        return 1;
+    }
+
+    // 设置调试模式
+    modbus_set_debug(ctx, TRUE);
+
+    // 分配寄存器和线圈
+    mb_mapping = modbus_mapping_new(100, 100, 100, 100);
+    if (mb_mapping == NULL)
+    {
+        log_message("ERROR", "Failed to allocate Modbus mapping: %s", modbus_strerror(errno));
+        modbus_free(ctx);
+        return 1;
+    }
+
+    // 初始化示例数据，与 RTU 服务端保持一致
+    mb_mapping->tab_registers[0] = 1234;
+    mb_mapping->tab_bits[0] = 0;
+
+    server_socket = modbus_tcp_listen(ctx, 1);
+    if (server_socket == -1)
+    {
+        log_message("ERROR", "Listen failed: %s", modbus_strerror(errno));
+        modbus_mapping_free(mb_mapping);
+        modbus_free(ctx);
+        return 1;
+    }
+
+    while (1)
+    {
+        // 等待客户端连接，一次服务一个连接
+        if (modbus_tcp_accept(ctx, &server_socket) == -1)
+        {
+            log_message("ERROR", "Accept failed: %s", modbus_strerror(errno));
+            sleep(1);
+            continue;
+        }
+        log_message("INFO", "Client connected, waiting for queries...");
+
+        while (1)
+        {
+            memset(query, 0, MODBUS_TCP_MAX_ADU_LENGTH);
+
+            // 接收报文，libmodbus 按 MBAP 长度字段切分
+            rc = modbus_receive(ctx, query);
+            if (rc > 0)
+            {
+                log_packet("Received query", query, rc);
+
+                // TCP 下不校验单元 ID，所有从站地址都由本服务端应答
+                int reply_rc = modbus_reply(ctx, query, rc, mb_mapping);
+                if (reply_rc == -1)
+                {
+                    log_message("ERROR", "Failed to reply: %s", modbus_strerror(errno));
+                    continue;
+                }
+                log_message("INFO", "Replied successfully, bytes sent: %d", reply_rc);
+            }
+            else if (rc == -1)
+            {
+                // 连接断开或报文非法，关闭当前连接后等待下一个客户端
+                log_message("WARNING", "Connection closed: %s", modbus_strerror(errno));
+                modbus_close(ctx);
+                break;
+            }
+        }
+    }
+
+    // 清理资源（实际上不会执行到这里）
+    log_message("INFO", "Shutting down server...");
+    close(server_socket);
+    modbus_mapping_free(mb_mapping);
+    modbus_free(ctx);
+    return 0;
+}
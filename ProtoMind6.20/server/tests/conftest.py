@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+import fsm_explan  # noqa: E402
+
+PROTOCOL_XML = {"mqtt": "mqttIR.xml", "dns": "dnsIR.xml", "modbus": "modbusIR.xml"}
+
+
+@pytest.fixture
+def data_dir(monkeypatch):
+    """切换到测试 IR 所在目录：PROTOCOL_TYPE 和 protocol_xml 按文件名查找 IR"""
+    monkeypatch.chdir(DATA_DIR)
+    return DATA_DIR
+
+
+@pytest.fixture(params=sorted(PROTOCOL_XML))
+def protocol_cache(request, data_dir):
+    """返回 (协议类型, 解析缓存)，三种协议各跑一遍"""
+    return request.param, fsm_explan.init_parser(PROTOCOL_XML[request.param])
@@ -0,0 +1,62 @@
+import socket
+import threading
+
+import pytest
+
+import fsm_explan
+
+
+@pytest.fixture
+def dns_echo():
+    """本地 DNS 替身：把查询置上 QR 位原样返回"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.2)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                data, address = sock.recvfrom(4096)
+            except OSError:
+                continue
+            if len(data) >= 12:
+                sock.sendto(data[:2] + bytes([data[2] | 0x80, data[3]]) + data[4:], address)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stop.set()
+    thread.join()
+    sock.close()
+
+
+def batched_fuzzer(port, tmp_path, monkeypatch):
+    cache = fsm_explan.init_parser("dnsIR.xml")
+    monkeypatch.chdir(tmp_path)
+    return fsm_explan.Fuzzer('127.0.0.1', str(port), 'udp', cache, 'dns', seed=17)
+
+
+def test_batched_queries_are_matched_by_id(data_dir, dns_echo, tmp_path, monkeypatch):
+    fuzzer = batched_fuzzer(dns_echo, tmp_path, monkeypatch)
+    fuzzer.communicate_with_timeout({'rate': 'max', 'batch': '16'}, timeout=0.5, fuzz_ratio=0)
+    stats = fuzzer.stats
+    assert stats['sent'] > 16
+    assert stats['received'] > 0
+    assert stats['unmatched'] == 0
+
+
+def test_empty_rounds_back_off_instead_of_spinning(data_dir, dns_echo, tmp_path, monkeypatch):
+    fuzzer = batched_fuzzer(dns_echo, tmp_path, monkeypatch)
+    calls = []
+
+    def nothing_to_send(input_fields, fuzz_ratio):
+        calls.append(1)
+        return fuzzer.generator.current_state, b''
+
+    monkeypatch.setattr(fuzzer, "next_client_packet", nothing_to_send)
+    fuzzer.communicate_with_timeout({'rate': 'max', 'batch': '8'}, timeout=0.5)
+    assert fuzzer.stats['sent'] == 0
+    # 每轮 8 次生成尝试，退避上限 50 ms，0.5 s 内只有几十轮
+    low, high = fsm_explan.Fuzzer.EMPTY_ROUND_BACKOFF
+    assert len(calls) <= 8 * (0.5 / high + 0.05 / low + 10)
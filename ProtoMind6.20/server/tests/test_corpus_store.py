@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import fsm_explan
+
+
+def history(*states):
+    return [(state, bytes([i, len(state)]) + state.encode(), bytes([1, 0]) + b'\x00' * len(state))
+            for i, state in enumerate(states)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = fsm_explan.CorpusStore(str(tmp_path / "mqtt.db"))
+    yield store
+    store.close()
+
+
+def test_signatures_are_deduplicated(store):
+    assert store.observe("CONNACK", 1, history("CONNECT"))
+    assert not store.observe("CONNACK", 1, history("CONNECT", "PINGREQ"))
+    assert store.observe("SUBACK", -2, history("CONNECT", "SUBSCRIBE"))
+    assert not store.observe("SUBACK", 3, [])
+    assert store.size == 2
+
+
+def test_dedup_survives_reopen_and_is_shared_between_connections(tmp_path, store):
+    store.observe("CONNACK", 1, history("CONNECT"))
+    store.commit()
+    other = fsm_explan.CorpusStore(store.path)
+    try:
+        assert other.size == 1
+        assert not other.observe("CONNACK", 1, history("CONNECT"))
+        assert other.observe("PINGRESP", 2, history("CONNECT", "PINGREQ"))
+        other.commit()
+        assert not store.observe("PINGRESP", 2, history("PINGREQ"))
+    finally:
+        other.close()
+
+
+def test_identical_sequences_are_stored_once(store):
+    store.observe("CONNACK", 1, history("CONNECT"))
+    store.observe("PINGRESP", 2, history("CONNECT"))
+    store.commit()
+    assert store.db.execute("SELECT COUNT(*) FROM sequences").fetchone()[0] == 1
+    digests = {row[0] for row in store.db.execute("SELECT sequence FROM signatures")}
+    assert len(digests) == 1 and None not in digests
+
+
+def test_seeds_group_packets_by_state_and_refresh_on_growth(store):
+    sequence = history("CONNECT", "SUBSCRIBE")
+    store.observe("SUBACK", 1, sequence)
+    seeds = store.seeds()
+    assert seeds == {state: [(packet, mask)] for state, packet, mask in sequence}
+    assert store.seeds() is seeds
+    store.observe("PINGRESP", 2, history("PINGREQ"))
+    assert "PINGREQ" in store.seeds()
+
+
+def test_sampling_respects_limit_without_duplicates(store, monkeypatch):
+    for signature in range(50):
+        store.observe("PUBACK", signature, history(f"PUBLISH{signature}"))
+    store.commit()
+    rows = store.sample_sequences(20)
+    assert len(rows) == 20
+    assert len({row[0] for row in rows}) == 20
+    assert len(store.sample_sequences(100)) == 50
+    monkeypatch.setattr(fsm_explan.CorpusStore, "SEED_LIMIT", 10)
+    store.observe("PUBACK", 99, history("PUBLISH99"))
+    assert sum(len(packets) for packets in store.seeds().values()) == 10
+
+
+def test_generator_replays_corpus_seeds(data_dir, store):
+    cache = fsm_explan.init_parser("mqttIR.xml")
+    generator = fsm_explan.create_generator(cache, "mqtt", seed=21)
+    seed_packet = b'\xc0\x01\xaa'  # 与正常生成的 PINGREQ 不同，便于区分
+    store.observe("PINGRESP", 1, [("PINGREQ", seed_packet, b'\x01\x01\x00')])
+    generator.attach_corpus(store)
+    packets = [bytes(generator.generate_packet("PINGREQ", fuzz=False)) for _ in range(200)]
+    assert packets.count(seed_packet) > 0
+
+
+@pytest.fixture
+def corpus_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path / fsm_explan.CORPUS_ROOT
+    fsm_explan.close_corpora()
+
+
+def test_open_corpus_stays_under_root(corpus_root, tmp_path):
+    assert fsm_explan.open_corpus("false", "mqtt") is None
+    default = fsm_explan.open_corpus("true", "mqtt")
+    assert default.path == os.path.join(os.path.realpath(corpus_root), "mqtt.db")
+    assert fsm_explan.open_corpus("1", "mqtt") is default
+    named = fsm_explan.open_corpus("campaign/a", "dns")
+    assert named.path == os.path.join(os.path.realpath(corpus_root), "campaign", "a", "dns.db")
+    for spec in ("../outside", str(tmp_path / "elsewhere"), "/etc"):
+        assert fsm_explan.open_corpus(spec, "mqtt") is None
+    assert not (tmp_path / "outside").exists() and not (tmp_path / "elsewhere").exists()
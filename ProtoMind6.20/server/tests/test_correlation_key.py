@@ -0,0 +1,67 @@
+import struct
+
+import pytest
+
+import fsm_explan
+
+key = fsm_explan.correlation_key
+
+
+def mqtt(first_byte, body):
+    assert len(body) < 128
+    return bytes([first_byte, len(body)]) + body
+
+
+def dns(query_id, flags):
+    return struct.pack('!HHHHHH', query_id, flags, 1, 0, 0, 0) + b'\x03www\x00\x00\x01\x00\x01'
+
+
+def mbap(transaction_id, pdu):
+    return fsm_explan.MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, 1) + pdu
+
+
+@pytest.mark.parametrize("request_packet, response_packet", [
+    (mqtt(0x10, b'\x00\x04MQTT\x04\x02\x00\x3c\x00\x01a'), mqtt(0x20, b'\x00\x00')),  # CONNECT/CONNACK
+    (mqtt(0xc0, b''), mqtt(0xd0, b'')),  # PINGREQ/PINGRESP
+    (mqtt(0x82, b'\x12\x34\x00\x01t\x00'), mqtt(0x90, b'\x12\x34\x00')),  # SUBSCRIBE/SUBACK
+    (mqtt(0xa2, b'\x00\x07\x00\x01t'), mqtt(0xb0, b'\x00\x07')),  # UNSUBSCRIBE/UNSUBACK
+    (mqtt(0x32, b'\x00\x03a/b\xbe\xefpayload'), mqtt(0x40, b'\xbe\xef')),  # PUBLISH QoS1/PUBACK
+    (mqtt(0x62, b'\x00\x09'), mqtt(0x70, b'\x00\x09')),  # PUBREL/PUBCOMP
+])
+def test_mqtt_request_matches_its_response(request_packet, response_packet):
+    expected = key('mqtt', request_packet, outbound=True)
+    assert expected is not None
+    assert key('mqtt', response_packet, outbound=False) == expected
+
+
+def test_mqtt_packet_ids_distinguish_outstanding_requests():
+    first = key('mqtt', mqtt(0x82, b'\x00\x01\x00\x01t\x00'), outbound=True)
+    second = key('mqtt', mqtt(0x82, b'\x00\x02\x00\x01t\x00'), outbound=True)
+    assert first == ('id', 1) and second == ('id', 2)
+
+
+@pytest.mark.parametrize("packet", [
+    mqtt(0x30, b'\x00\x03a/bpayload'),  # PUBLISH QoS 0
+    mqtt(0xe0, b''),  # DISCONNECT
+    mqtt(0x82, b'\x00'),  # packet_id 被截断
+    b'\x82',  # 剩余长度缺失
+])
+def test_mqtt_requests_without_response_have_no_key(packet):
+    assert key('mqtt', packet, outbound=True) is None
+
+
+def test_unsolicited_mqtt_publish_is_keyed_by_type():
+    assert key('mqtt', mqtt(0x30, b'\x00\x01tx'), outbound=False) == ('type', 3)
+
+
+def test_dns_and_modbus_use_transaction_ids():
+    assert key('dns', dns(0xabcd, 0x0100), outbound=True) == key('dns', dns(0xabcd, 0x8180), outbound=False) == ('id', 0xabcd)
+    assert key('dns', b'\xab\xcd\x01', outbound=True) is None
+    request = mbap(0x0102, b'\x01\x00\x00\x00\x08')
+    response = mbap(0x0102, b'\x01\x01\x00')
+    assert key('modbus', request, outbound=True) == key('modbus', response, outbound=False) == ('id', 0x0102)
+    assert key('modbus', request[:6], outbound=True) is None
+
+
+def test_other_protocols_match_in_order():
+    assert key('coap', b'\x40\x01', outbound=True) == ('fifo', None)
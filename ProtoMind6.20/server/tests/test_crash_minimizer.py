@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+import fsm_explan
+
+
+class OracleMinimizer(fsm_explan.CrashMinimizer):
+    """用合成判定代替重启目标、发送和探测：序列包含 trigger 中所有报文且顺序一致时视为复现"""
+
+    def __init__(self, record, trigger, **kwargs):
+        super().__init__(record, **kwargs)
+        self.trigger = trigger
+        self.calls = []
+
+    def reproduces(self, packets):
+        key = tuple(packets)
+        if key in self.results:
+            return self.results[key]
+        if self.tests >= self.max_tests:
+            return False
+        self.tests += 1
+        self.calls.append(key)
+        position = 0
+        for packet in packets:
+            if position < len(self.trigger) and packet == self.trigger[position]:
+                position += 1
+        self.results[key] = position == len(self.trigger)
+        return self.results[key]
+
+
+def crash_record(packets):
+    return {
+        'protocol_type': 'modbus', 'protocol': 'tcp', 'target_ip': '127.0.0.1', 'target_port': 1502,
+        'packets': [('WRITE_SINGLE_COIL_REQUEST', packet.hex()) for packet in packets],
+    }
+
+
+def packets(count):
+    return [bytes([1, 5, 0, i, 0xff, 0]) for i in range(count)]
+
+
+def test_ddmin_finds_one_minimal_subsequence(data_dir):
+    sent = packets(32)
+    trigger = [sent[3], sent[17], sent[29]]
+    minimizer = OracleMinimizer(crash_record(sent), trigger)
+    assert minimizer.run() == trigger
+    for i in range(len(trigger)):
+        assert not minimizer.reproduces(trigger[:i] + trigger[i + 1:])
+
+
+def test_single_packet_trigger(data_dir):
+    sent = packets(10)
+    minimizer = OracleMinimizer(crash_record(sent), [sent[6]])
+    assert minimizer.run() == [sent[6]]
+
+
+def test_repeated_packets_are_kept(data_dir):
+    sent = packets(4) + [packets(6)[5]] * 5
+    trigger = [sent[0]] + [sent[5]] * 3
+    minimizer = OracleMinimizer(crash_record(sent), trigger)
+    assert minimizer.run() == trigger
+
+
+def test_non_reproducible_record_returns_none(data_dir):
+    sent = packets(8)
+    minimizer = OracleMinimizer(crash_record(sent), [b'\x00'])
+    assert minimizer.run() is None
+    assert minimizer.tests == 1
+
+
+def test_test_budget_is_respected(data_dir):
+    sent = packets(64)
+    minimizer = OracleMinimizer(crash_record(sent), sent[::7], max_tests=10)
+    result = minimizer.run()
+    assert minimizer.tests <= 10
+    assert len(set(minimizer.calls)) == len(minimizer.calls)
+    assert result is not None and minimizer.reproduces(result)
+
+
+class FakeMinimize:
+    """代替真实最小化：阻塞到 release 被置位，记录调用顺序"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, crash_file, target=None):
+        self.calls.append(crash_file)
+        self.release.wait(5)
+        if 'broken' in crash_file:
+            raise ValueError("bad record")
+        return [b'\x01']
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    fake = FakeMinimize()
+    monkeypatch.setattr(fsm_explan, "minimize_crash", fake)
+    monkeypatch.setattr(fsm_explan, "MINIMIZE_JOBS", {})
+    yield fake
+    fake.release.set()
+
+
+def wait_finished(crash_file):
+    deadline = time.monotonic() + 5
+    while fsm_explan.minimize_job_status(crash_file)['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return fsm_explan.minimize_job_status(crash_file)
+
+
+def test_minimize_job_runs_in_background(jobs):
+    crash_file = "outpcap/crashes/crash_a.json"
+    job = fsm_explan.start_minimize_job(crash_file)
+    assert job['status'] in ('queued', 'running')
+    assert job['record_file'] == fsm_explan.minimized_record_file(crash_file)
+    # 同一记录的任务未结束时不重复启动
+    assert fsm_explan.start_minimize_job(crash_file, restart=True)['submitted'] == job['submitted']
+    jobs.release.set()
+    job = wait_finished(crash_file)
+    assert (job['status'], job['reproduced'], job['minimized']) == ('done', True, 1)
+    assert fsm_explan.start_minimize_job(crash_file)['status'] == 'done'
+    assert jobs.calls == [crash_file]
+    fsm_explan.start_minimize_job(crash_file, restart=True)
+    wait_finished(crash_file)
+    assert jobs.calls == [crash_file, crash_file]
+
+
+def test_failed_minimize_job_reports_error(jobs):
+    jobs.release.set()
+    crash_file = "outpcap/crashes/crash_broken.json"
+    fsm_explan.start_minimize_job(crash_file)
+    job = wait_finished(crash_file)
+    assert job['status'] == 'failed' and 'bad record' in job['error']
+    assert fsm_explan.minimize_job_status("outpcap/crashes/other.json") is None
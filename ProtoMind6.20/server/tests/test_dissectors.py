@@ -0,0 +1,98 @@
+import pytest
+
+import fsm_explan
+
+ADDRESSES = ("00:00:00:00:00:02", "00:00:00:00:00:01", "127.0.0.1", "127.0.0.1", 1883, 40000, "tcp")
+
+
+def generator_for(protocol_type):
+    cache = fsm_explan.init_parser(f"{protocol_type}IR.xml")
+    return fsm_explan.create_generator(cache, protocol_type, seed=1)
+
+
+def identify(generator, data):
+    return generator.identify_message(data, *ADDRESSES)
+
+
+def mqtt_packet(packet_type, body=b''):
+    return bytes([packet_type << 4]) + bytes([len(body)]) + body
+
+
+def modbus_frame(generator, pdu, slave_id=1):
+    frame = bytes([slave_id]) + pdu
+    return frame + generator.calculate_modbus_crc(frame)
+
+
+@pytest.mark.parametrize("packet_type, body, msg_name", [
+    (2, b'\x00\x00', 'CONNACK'),
+    (9, b'\x00\x01\x00', 'SUBACK'),
+    (11, b'\x00\x01', 'UNSUBACK'),
+    (13, b'', 'PINGRESP'),
+])
+def test_mqtt_packet_type_nibble(data_dir, packet_type, body, msg_name):
+    generator = generator_for("mqtt")
+    packet = mqtt_packet(packet_type, body)
+    assert fsm_explan.dissect_mqtt(generator, packet) == msg_name
+    assert fsm_explan.dissect_mqtt(generator, memoryview(packet)) == msg_name
+    assert identify(generator, packet) == msg_name
+
+
+def test_mqtt_truncated_or_unknown_packets(data_dir):
+    generator = generator_for("mqtt")
+    assert fsm_explan.dissect_mqtt(generator, b'\x20\x02\x00') is None  # 剩余长度 2，只到了 1 字节
+    assert fsm_explan.dissect_mqtt(generator, b'\x20\x80\x80\x80\x80\x01') is None  # 变长整数超过 4 字节
+    assert fsm_explan.dissect_mqtt(generator, mqtt_packet(0)) is None  # 类型 0 为保留值
+
+
+def test_mqtt_remaining_length_varint():
+    assert fsm_explan.decode_mqtt_remaining_length(b'\x30\x00') == (0, 2)
+    assert fsm_explan.decode_mqtt_remaining_length(b'\x30\x7f') == (127, 2)
+    assert fsm_explan.decode_mqtt_remaining_length(b'\x30\x80\x01') == (128, 3)
+    assert fsm_explan.decode_mqtt_remaining_length(b'\x30\xff\xff\xff\x7f') == (268435455, 5)
+    assert fsm_explan.decode_mqtt_remaining_length(b'\x30\x80') is None
+
+
+def test_dns_qr_bit(data_dir):
+    generator = generator_for("dns")
+    query = b'\x12\x34\x01\x00' + b'\x00\x01' + b'\x00' * 6
+    response = b'\x12\x34\x81\x80' + b'\x00\x01\x00\x01' + b'\x00' * 4
+    assert fsm_explan.dissect_dns(generator, query) is None
+    assert fsm_explan.dissect_dns(generator, response) == 'DNS_RESPONSE'
+    assert fsm_explan.dissect_dns(generator, response[:11]) is None
+    assert identify(generator, memoryview(response)) == 'DNS_RESPONSE'
+
+
+def test_modbus_function_codes_and_exceptions(data_dir):
+    generator = generator_for("modbus")
+    cases = [
+        (b'\x01\x01\x05', 'READ_COILS_RESPONSE'),
+        (b'\x03\x02\x00\x2a', 'READ_HOLDING_REGISTERS_RESPONSE'),
+        (b'\x05\x00\x10\xff\x00', 'WRITE_SINGLE_COIL_RESPONSE'),
+        (b'\x83\x02', 'EXCEPTION_RESPONSE'),
+    ]
+    for pdu, msg_name in cases:
+        frame = modbus_frame(generator, pdu)
+        assert fsm_explan.dissect_modbus_rtu(generator, frame) == msg_name, pdu.hex()
+        assert identify(generator, frame) == msg_name, pdu.hex()
+    # 未知的非异常功能码不回退到其他匹配方式
+    assert identify(generator, modbus_frame(generator, b'\x2b\x0e\x01\x00')) is None
+    assert fsm_explan.dissect_modbus_rtu(generator, b'\x01\x01') is None
+
+
+def test_modbus_bad_crc_is_still_classified(data_dir):
+    generator = generator_for("modbus")
+    frame = bytearray(modbus_frame(generator, b'\x03\x02\x00\x2a'))
+    frame[-1] ^= 0xff
+    assert fsm_explan.dissect_modbus_rtu(generator, bytes(frame)) == 'READ_HOLDING_REGISTERS_RESPONSE'
+
+
+def test_default_generator_does_not_use_pyshark(data_dir, monkeypatch):
+    generator = generator_for("mqtt")
+    assert not generator.use_pyshark
+
+    def fail(*args):
+        raise AssertionError("pyshark path used")
+
+    monkeypatch.setattr(generator, "identify_with_pyshark", fail)
+    assert identify(generator, mqtt_packet(13)) == 'PINGRESP'
+    identify(generator, b'\x00\x00')  # 解析器认不出时回退到常量匹配，同样不经过 pyshark
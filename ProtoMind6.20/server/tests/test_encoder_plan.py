@@ -0,0 +1,51 @@
+import fsm_explan
+
+ROUNDS = 50
+
+
+def make_generators(cache, protocol_type, seed):
+    """同一种子的两个生成器：一个走编码计划，一个把所有计划置空，退回逐字段编码（encode_fields）"""
+    planned = fsm_explan.create_generator(cache, protocol_type, seed=seed)
+    walker = fsm_explan.create_generator(cache, protocol_type, seed=seed)
+    walker.encoder_plans = {name: None for name in cache["client_messages"]}
+    return planned, walker
+
+
+def test_plans_compile_for_every_client_message(protocol_cache):
+    protocol_type, cache = protocol_cache
+    generator = fsm_explan.create_generator(cache, protocol_type, seed=1)
+    for state_name in cache["client_messages"]:
+        if state_name in cache["messages"]:
+            assert generator.get_encoder_plan(state_name) is not None, state_name
+
+
+def test_plan_output_matches_field_walk(protocol_cache):
+    protocol_type, cache = protocol_cache
+    states = sorted(state for state in cache["client_messages"] if state in cache["messages"])
+    for fuzz in (False, True):
+        planned, walker = make_generators(cache, protocol_type, seed=1234 + fuzz)
+        for _ in range(ROUNDS):
+            for state_name in states:
+                expected = walker.generate_packet(state_name, fuzz=fuzz)
+                actual = planned.generate_packet(state_name, fuzz=fuzz)
+                assert actual == expected, (state_name, fuzz)
+                assert planned.last_protected_mask == walker.last_protected_mask, (state_name, fuzz)
+
+
+def test_constant_override_uses_field_walk(data_dir):
+    cache = fsm_explan.init_parser("modbusIR.xml")
+    planned, walker = make_generators(cache, "modbus", seed=7)
+    for state_name in sorted(state for state in cache["client_messages"] if state in cache["messages"]):
+        plan = planned.get_encoder_plan(state_name)
+        assert plan.const_names, state_name  # Modbus 请求都有常量功能码
+        overrides = {name: "0x00" for name in plan.const_names}
+        assert planned.generate_packet(state_name, overrides) == walker.generate_packet(state_name, overrides)
+
+
+def test_variable_size_slots_keep_template_runs(data_dir):
+    cache = fsm_explan.init_parser("mqttIR.xml")
+    generator = fsm_explan.create_generator(cache, "mqtt", seed=1)
+    plan = generator.get_encoder_plan("CONNECT")
+    runs = [piece for piece in plan.pieces if isinstance(piece, fsm_explan.TemplateRun)]
+    assert runs  # 剩余长度是变长槽位，但固定头和其余常量仍预先编码
+    assert any(isinstance(piece, fsm_explan.FieldSlot) and piece.role == 'remaining_length' for piece in plan.pieces)
@@ -0,0 +1,71 @@
+import random
+
+import fsm_explan
+
+ROUNDS = 2000
+
+
+def random_case(rng):
+    length = rng.randint(1, 64)
+    packet = bytearray(rng.randrange(256) for _ in range(length))
+    mask = bytearray(rng.random() < 0.4 for _ in range(length))
+    return packet, mask
+
+
+def protected(packet, mask):
+    return [(i, packet[i]) for i in range(len(mask)) if mask[i]]
+
+
+def test_fixed_length_keeps_protected_offsets():
+    rng = random.Random(1)
+    mutator = fsm_explan.HavocMutator(rng)
+    for _ in range(ROUNDS):
+        packet, mask = random_case(rng)
+        before = protected(packet, mask)
+        length = len(packet)
+        packet, mask = mutator.mutate(packet, mask, resizable=False)
+        assert len(packet) == len(mask) == length
+        assert protected(packet, mask) == before
+
+
+def test_resizing_keeps_protected_bytes_in_order():
+    rng = random.Random(2)
+    mutator = fsm_explan.HavocMutator(rng)
+    donors = [random_case(rng) for _ in range(8)]
+    for _ in range(ROUNDS):
+        packet, mask = random_case(rng)
+        before = [value for _, value in protected(packet, mask)]
+        packet, mask = mutator.mutate(packet, mask, donors=donors)
+        assert len(packet) == len(mask) <= mutator.MAX_PACKET
+        assert [value for _, value in protected(packet, mask)] == before
+
+
+def test_fully_protected_packet_is_unchanged():
+    mutator = fsm_explan.HavocMutator(random.Random(3))
+    packet = bytearray(b'\x01\x05\x00\x00\xff\x00')
+    packet, mask = mutator.mutate(packet, bytearray(b'\x01' * len(packet)))
+    assert packet == b'\x01\x05\x00\x00\xff\x00'
+
+
+def test_generator_havoc_pins_modbus_slave_id(data_dir):
+    cache = fsm_explan.init_parser("modbusIR.xml")
+    generator = fsm_explan.create_generator(cache, "modbus", seed=4)
+    rng = random.Random(4)
+    for _ in range(ROUNDS):
+        packet = bytearray(rng.randrange(256) for _ in range(rng.randint(2, 16)))
+        slave_id = packet[0]
+        packet, mask, _ = generator.havoc("READ_COILS_REQUEST", packet, bytearray(len(packet)), [])
+        assert packet[0] == slave_id
+
+
+def test_fuzzed_mqtt_packets_keep_consistent_remaining_length(data_dir):
+    cache = fsm_explan.init_parser("mqttIR.xml")
+    generator = fsm_explan.create_generator(cache, "mqtt", seed=5)
+    states = sorted(state for state in cache["client_messages"] if state in cache["messages"])
+    for _ in range(200):
+        for state_name in states:
+            packet = generator.generate_packet(state_name, fuzz=True)
+            if not packet:
+                continue
+            remaining, header_length = fsm_explan.decode_mqtt_remaining_length(packet)
+            assert header_length + remaining == len(packet), (state_name, packet.hex())
@@ -0,0 +1,93 @@
+import random
+
+import fsm_explan
+
+SAMPLES = 3000
+
+
+def linear_match(messages, data):
+    """原 identify_message 中逐条报文、逐字段比对常量的线性匹配，作为决策树的对照"""
+    def match_fields(fields, offset=0):
+        for field in fields:
+            field_length = field.get('length', '1')
+            if ':' in field_length:
+                field_length = int(field_length.split(':')[0])
+            else:
+                field_length = int(field_length)
+            if offset + field_length > len(data):
+                return False, offset
+            if field['kind'] == 'constant':
+                expected_value = field.get('value')
+                actual_value = int.from_bytes(data[offset:offset + field_length], 'big')
+                if expected_value.startswith('0x') and int(expected_value, 16) != actual_value:
+                    return False, offset
+                if expected_value.startswith('0b') and int(expected_value, 2) != actual_value:
+                    return False, offset
+                offset += field_length
+            elif field['kind'] == 'variable':
+                offset += field_length
+            elif field['kind'] == 'field':
+                match, offset = match_fields(field['subfields'], offset)
+                if not match:
+                    return False, offset
+        return True, offset
+
+    for msg_name, msg in messages.items():
+        fields = msg['fields']
+        if len(data) < sum(int(f.get('length', '1').split(':')[0]) for f in fields if ':' not in f.get('length', '1')):
+            continue
+        if match_fields(fields)[0]:
+            return msg_name
+    return None
+
+
+def linear_first_byte(messages, first_byte):
+    for msg_name, msg in messages.items():
+        for field in msg['fields']:
+            if field['kind'] == 'constant' and field['type'] == 'B' and field.get('field_role') == 'field':
+                try:
+                    if int(field['value'], 16) == first_byte:
+                        return msg_name
+                except ValueError:
+                    continue
+    return None
+
+
+def sample_inputs(classifier, rng):
+    """随机报文，其中一半按某条报文的常量约束填写，保证决策树的各个分支都被走到"""
+    for _ in range(SAMPLES):
+        data = bytearray(rng.randrange(256) for _ in range(rng.randint(0, 48)))
+        if classifier.signatures and rng.random() < 0.5:
+            _, min_len, constraints = rng.choice(classifier.signatures)
+            if len(data) < min_len and rng.random() < 0.8:
+                data.extend(rng.randrange(256) for _ in range(min_len - len(data)))
+            for (offset, length), value in constraints:
+                if offset + length <= len(data) and rng.random() < 0.95:
+                    data[offset:offset + length] = value.to_bytes(length, 'big')
+        yield bytes(data)
+
+
+def test_classifier_matches_linear_matcher(protocol_cache):
+    protocol_type, cache = protocol_cache
+    classifier = cache["classifier"]
+    rng = random.Random(protocol_type)
+    matched = 0
+    for data in sample_inputs(classifier, rng):
+        expected = linear_match(cache["messages"], data)
+        assert classifier.classify(data) == expected, data.hex()
+        matched += expected is not None
+    assert matched
+
+
+def test_first_byte_map_matches_linear_fallback(protocol_cache):
+    _, cache = protocol_cache
+    classifier = cache["classifier"]
+    for first_byte in range(256):
+        assert classifier.first_byte_map.get(first_byte) == linear_first_byte(cache["messages"], first_byte)
+
+
+def test_classifier_accepts_memoryview(data_dir):
+    cache = fsm_explan.init_parser("mqttIR.xml")
+    classifier = cache["classifier"]
+    for data in sample_inputs(classifier, random.Random(0)):
+        assert classifier.classify(memoryview(data)) == classifier.classify(data)
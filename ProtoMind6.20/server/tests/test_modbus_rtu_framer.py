@@ -0,0 +1,139 @@
+import pytest
+
+import fsm_explan
+
+Framer = fsm_explan.ModbusRTUFramer
+
+
+def crc(body):
+    value = 0xFFFF
+    for byte in body:
+        value ^= byte
+        for _ in range(8):
+            value = (value >> 1) ^ 0xA001 if value & 1 else value >> 1
+    return value.to_bytes(2, 'little')
+
+
+class ScriptedSerial:
+    """按脚本逐步到达的假串口：每次 read 或静默等待后放出下一批字节，空批次表示出现 t3.5 静默"""
+
+    def __init__(self, bursts, timeout=None):
+        self.bursts = [bytes(burst) for burst in bursts]
+        self.buffer = bytearray()
+        self._timeout = timeout
+        self.timeout_sets = 0
+        self.reads = []
+        self.arrive()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self.timeout_sets += 1
+
+    def arrive(self):
+        if self.bursts:
+            self.buffer.extend(self.bursts.pop(0))
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read(self, size):
+        self.reads.append(size)
+        if not self.buffer:
+            self.arrive()  # 阻塞读取：等到下一批字节或超时
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class SilenceClock:
+    """代替 time.sleep：记录静默等待，等待期间让假串口放出下一批字节"""
+
+    def __init__(self):
+        self.serial = None
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        if self.serial is not None:
+            self.serial.arrive()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    clock = SilenceClock()
+    monkeypatch.setattr(fsm_explan.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.mark.parametrize("frame, expected", [
+    (b'\x01', None),
+    (b'\x01\x83', 5),
+    (b'\x01\x03', None),
+    (b'\x01\x03\x04', 9),
+    (b'\x01\x01\x01', 6),
+    (b'\x01\x05', 8),
+    (b'\x01\x10', 8),
+    (b'\x01\x2b', None),
+])
+def test_expected_length(frame, expected):
+    assert Framer.expected_length(frame) == expected
+
+
+def frame(body):
+    return body + crc(body)
+
+
+def framer_for(serial, no_sleep, baudrate=19200):
+    no_sleep.serial = serial
+    return Framer(serial, baudrate, response_timeout=2.0)
+
+
+def test_timeout_is_configured_once(no_sleep):
+    serial = ScriptedSerial([], timeout=None)
+    framer = framer_for(serial, no_sleep)
+    assert serial.timeout == 2.0 and serial.timeout_sets == 1
+    Framer(serial, 19200, response_timeout=2.0)
+    assert serial.timeout_sets == 1
+    assert framer.read_frame() is None
+
+
+def test_known_length_frame_stops_without_waiting_for_silence(no_sleep):
+    response = frame(b'\x01\x03\x04\x00\x01\x00\x02')
+    trailing = frame(b'\x01\x06\x00\x01\x00\x03')
+    serial = ScriptedSerial([response[:1], response[1:4], response[4:] + trailing])
+    framer = framer_for(serial, no_sleep)
+    assert framer.read_frame() == response
+    assert framer.read_frame() == trailing
+    assert serial.timeout_sets == 1
+
+
+def test_exception_response(no_sleep):
+    response = frame(b'\x01\x83\x02')
+    serial = ScriptedSerial([response])
+    assert framer_for(serial, no_sleep).read_frame() == response
+    assert no_sleep.sleeps == []
+
+
+def test_unknown_function_code_ends_at_silence(no_sleep):
+    response = frame(b'\x01\x2b\x0e\x01\x01')
+    serial = ScriptedSerial([response[:3], response[3:], b''])
+    framer = framer_for(serial, no_sleep)
+    assert framer.read_frame() == response
+    assert no_sleep.sleeps == [framer.silence] * 2
+
+
+def test_truncated_frame_is_returned_after_silence(no_sleep):
+    response = frame(b'\x01\x03\x04\x00\x01\x00\x02')
+    serial = ScriptedSerial([response[:5], b''])
+    assert framer_for(serial, no_sleep).read_frame() == response[:5]
+
+
+def test_silence_interval_follows_baudrate():
+    assert Framer(ScriptedSerial([]), 9600).silence == pytest.approx(3.5 * 11 / 9600)
+    assert Framer(ScriptedSerial([]), 115200).silence == Framer.FIXED_SILENCE
@@ -0,0 +1,91 @@
+import socket
+import socketserver
+import threading
+
+import pytest
+
+import fsm_explan
+
+
+def mbap(transaction_id, unit, pdu):
+    return fsm_explan.MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, unit) + pdu
+
+
+@pytest.mark.parametrize("protocol_type, data, expected", [
+    ('modbus', b'', None),
+    ('modbus', b'\x00\x01\x00\x00\x00\x06', None),  # MBAP 头不完整
+    ('modbus', mbap(1, 1, b'\x03\x00\x00\x00\x01'), (0, 12)),
+    ('modbus', mbap(1, 1, b'\x03\x00\x00\x00\x01')[:9], (0, 12)),  # 头已完整，报文未收全
+    ('modbus', mbap(7, 1, b'\x83\x02') + mbap(8, 1, b'\x05'), (0, 9)),  # 粘包时只取第一条
+    ('dns', b'\x00', None),
+    ('dns', b'\x00\x0c' + b'\x00' * 12, (2, 14)),
+    ('mqtt', b'\x30', None),
+    ('mqtt', b'\x30\x80\x01', (0, 131)),
+    ('mqtt', b'\x30\xff\xff\xff\xff\x01', (0, 6)),  # 变长整数错位时整块交出
+    ('coap', b'\x40\x01\x00\x01', (0, 4)),
+])
+def test_stream_frame_length(protocol_type, data, expected):
+    assert fsm_explan.stream_frame_length(protocol_type, data) == expected
+
+
+def test_mbap_round_trip(data_dir):
+    generator = fsm_explan.create_generator(fsm_explan.init_parser("modbusIR.xml"), "modbus", seed=16)
+    body = b'\x11\x03\x00\x6b\x00\x03'
+    rtu = body + generator.calculate_modbus_crc(body)
+    frame = fsm_explan.rtu_to_mbap(rtu, 0x1234)
+    assert frame == mbap(0x1234, 0x11, b'\x03\x00\x6b\x00\x03')
+    assert fsm_explan.mbap_to_rtu(generator, frame) == rtu
+
+
+class StandInHandler(socketserver.BaseRequestHandler):
+    """本地 Modbus/TCP 替身：按 MBAP 长度切帧，回复非法功能码异常，响应拆成两段发送以覆盖拆包"""
+
+    def handle(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.request.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while len(buffer) >= fsm_explan.MBAP_HEADER.size:
+                length = 6 + int.from_bytes(buffer[4:6], 'big')
+                if len(buffer) < length:
+                    break
+                frame, buffer = buffer[:length], buffer[length:]
+                self.server.requests.append(frame)
+                function_code = frame[7] if len(frame) > 7 else 0
+                response = mbap(int.from_bytes(frame[0:2], 'big'), frame[6], bytes([function_code | 0x80, 0x01]))
+                self.request.sendall(response[:5])
+                self.request.sendall(response[5:])
+
+
+@pytest.fixture
+def stand_in():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_fuzzer_speaks_mbap_to_stand_in(data_dir, stand_in, tmp_path, monkeypatch, window):
+    cache = fsm_explan.init_parser("modbusIR.xml")
+    monkeypatch.chdir(tmp_path)  # pcap 和 trace 写到临时目录
+    port = stand_in.server_address[1]
+    fuzzer = fsm_explan.Fuzzer('127.0.0.1', port, 'tcp', cache, 'modbus', seed=16)
+    fuzzer.communicate_with_timeout({'rate': 'max'}, timeout=1.0, window=window)
+    assert fuzzer.stats['sent'] > 0
+    assert fuzzer.stats['received'] > 0
+    assert len(stand_in.requests) >= fuzzer.stats['received']
+    ids = [int.from_bytes(frame[0:2], 'big') for frame in stand_in.requests]
+    assert ids == list(range(1, len(ids) + 1))  # 事务 ID 逐条递增
+    for frame in stand_in.requests:
+        assert frame[2:4] == b'\x00\x00'
+        assert int.from_bytes(frame[4:6], 'big') == len(frame) - 6
@@ -0,0 +1,81 @@
+import fsm_explan
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def paced(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(fsm_explan.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(fsm_explan.time, "sleep", clock.sleep)
+    return fsm_explan.Pacer(**kwargs), clock
+
+
+def test_rate_limit_spaces_packets(monkeypatch):
+    pacer, clock = paced(monkeypatch, rate=50.0)
+    start = clock.now
+    for _ in range(101):
+        pacer.wait()
+    # 第一个令牌立即可用，其余 100 个按 50 pps 间隔发送
+    assert abs((clock.now - start) - 2.0) < 1e-6
+    assert pacer.report()['paced'] == 101
+
+
+def test_burst_allows_back_to_back_packets(monkeypatch):
+    pacer, clock = paced(monkeypatch, rate=10.0, burst=5)
+    start = clock.now
+    for _ in range(5):
+        pacer.wait()
+    assert clock.now == start
+    pacer.wait()
+    assert abs(clock.now - start - 0.1) < 1e-6
+
+
+def test_unlimited_never_waits(monkeypatch):
+    for rate in (None, 0, -1):
+        pacer, clock = paced(monkeypatch, rate=rate)
+        start = clock.now
+        for _ in range(1000):
+            pacer.wait()
+        assert clock.now == start
+        assert pacer.rate is None
+
+
+def test_max_wait_bounds_the_sleep(monkeypatch):
+    pacer, clock = paced(monkeypatch, rate=1.0)
+    pacer.wait()
+    start = clock.now
+    pacer.wait(max_wait=0.25)
+    assert abs(clock.now - start - 0.25) < 1e-6
+
+
+def test_adaptive_backs_off_and_recovers(monkeypatch):
+    pacer, clock = paced(monkeypatch, rate=100.0, adaptive=True, min_rate=5.0)
+    pacer.observe_latency(0.001)
+    clock.now += pacer.ADJUST_INTERVAL
+    for _ in range(20):
+        pacer.observe_latency(0.5)
+        clock.now += pacer.ADJUST_INTERVAL
+    assert pacer.rate < 100.0 and pacer.backoffs
+    assert pacer.rate >= 5.0
+    for _ in range(200):
+        pacer.observe_latency(0.001)
+        clock.now += pacer.ADJUST_INTERVAL
+    assert pacer.rate == 100.0
+
+
+def test_create_pacer_defaults_and_overrides():
+    assert fsm_explan.create_pacer({}).rate == fsm_explan.Fuzzer.DEFAULT_RATE
+    assert fsm_explan.create_pacer({"rate": "max"}).rate is None
+    assert fsm_explan.create_pacer({"rate": "0"}).rate is None
+    pacer = fsm_explan.create_pacer({"rate": "25", "burst": "4"})
+    assert (pacer.rate, pacer.burst) == (25.0, 4)
+    assert fsm_explan.create_pacer({"rate": "fast"}).rate == fsm_explan.Fuzzer.DEFAULT_RATE
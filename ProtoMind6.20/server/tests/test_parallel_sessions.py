@@ -0,0 +1,66 @@
+import random
+
+import fsm_explan
+
+
+def write_pcap(path, timestamps, tag):
+    writer = fsm_explan.FramePcapWriter(str(path), linktype=1)
+    for i, timestamp in enumerate(timestamps):
+        writer.write_raw(bytes([tag, i]) + b'\x00' * 12, timestamp=timestamp)
+    writer.close()
+
+
+def test_merge_pcaps_orders_frames_by_timestamp(tmp_path):
+    rng = random.Random(8)
+    files, expected = [], []
+    for tag in range(5):
+        timestamps = sorted(1_700_000_000 + rng.randrange(10_000_000) / 1_000_000 for _ in range(rng.randint(0, 40)))
+        path = tmp_path / f"session_{tag}.pcap"
+        write_pcap(path, timestamps, tag)
+        files.append(str(path))
+        expected.extend(timestamps)
+    merged = tmp_path / "merged.pcap"
+    assert fsm_explan.merge_pcaps(files, str(merged)) == len(expected)
+    records = list(fsm_explan.read_pcap_records(str(merged)))
+    stamps = [(sec, usec) for sec, usec, _ in records]
+    assert stamps == sorted(stamps)
+    assert len(records) == len(expected)
+    for tag in range(5):
+        # 同一会话内的帧保持原有顺序
+        indexes = [data[1] for _, _, data in records if data[0] == tag]
+        assert indexes == sorted(indexes)
+
+
+def test_merge_pcaps_skips_empty_inputs(tmp_path):
+    empty = tmp_path / "empty.pcap"
+    write_pcap(empty, [], 0)
+    full = tmp_path / "full.pcap"
+    write_pcap(full, [1.0, 2.0, 3.0], 1)
+    assert fsm_explan.merge_pcaps([str(empty), str(full)], str(tmp_path / "merged.pcap")) == 3
+
+
+def test_pool_is_capped_and_every_session_is_scheduled(monkeypatch):
+    monkeypatch.setattr(fsm_explan.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(fsm_explan, "MAX_SESSION_WORKERS", None)
+    assert fsm_explan.session_workers(1000) == 4
+    assert fsm_explan.session_workers(3) == 3
+    assert fsm_explan.session_workers(1000, max_workers=2) == 2
+    tasks = [(session_id, 2000 + session_id, session_id) for session_id in range(10)]
+    groups = fsm_explan.split_sessions(tasks, fsm_explan.session_workers(len(tasks)))
+    assert len(groups) == 4
+    assert sorted(task for group in groups for task in group) == tasks
+    assert max(map(len, groups)) - min(map(len, groups)) <= 1
+
+
+def test_session_group_passes_extra_task_fields_to_runner(data_dir):
+    calls = []
+
+    def runner(xml_file, target_ip, target_port, protocol, protocol_type, input_fields,
+               session_id, source_port, timeout, seed, *extra):
+        calls.append((session_id, source_port, seed) + extra)
+        return {'session_id': session_id}
+
+    tasks = [(0, 3000, 10, 'CONNACK', ('CONNECT',)), (1, 3001, 11, 'SUBACK', ('CONNECT', 'SUBSCRIBE'))]
+    results = fsm_explan.run_session_group("mqttIR.xml", "127.0.0.1", 1883, "tcp", "mqtt", {}, tasks, 1.0, runner)
+    assert sorted(result['session_id'] for result in results) == [0, 1]
+    assert sorted(calls) == tasks
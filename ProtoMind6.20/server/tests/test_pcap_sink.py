@@ -0,0 +1,69 @@
+import threading
+import time
+
+import fsm_explan
+
+
+class SlowWriter:
+    """记录写入和落盘的假写入器，每帧写入稍作停顿，让队列里积压报文"""
+
+    def __init__(self, delay=0.0005):
+        self.filename = "slow.pcap"
+        self.delay = delay
+        self.frames = []
+        self.flushed = 0
+        self.closed = False
+
+    def write_frame(self, *fields, timestamp=None):
+        time.sleep(self.delay)
+        self.frames.append(fields[-1])
+
+    def write_raw(self, frame, timestamp=None):
+        time.sleep(self.delay)
+        self.frames.append(frame)
+
+    def flush(self):
+        self.flushed = len(self.frames)
+
+    def close(self):
+        self.closed = True
+
+
+def test_flush_waits_for_queue_to_drain():
+    writer = SlowWriter()
+    sink = fsm_explan.PcapSink(writer, flush_interval=60, batch_size=16)
+    for i in range(300):
+        sink.write_raw(i.to_bytes(2, 'big'))
+    sink.flush()
+    assert len(writer.frames) == 300
+    assert writer.flushed == 300
+    assert writer.frames == [i.to_bytes(2, 'big') for i in range(300)]
+    stats = sink.close()
+    assert stats['written'] == stats['enqueued'] == 300
+    assert writer.closed
+
+
+def test_stats_are_consistent_under_concurrent_writers():
+    writer = SlowWriter(delay=0)
+    sink = fsm_explan.PcapSink(writer, max_queue=64, drop_policy='drop_oldest')
+
+    def produce():
+        for _ in range(2000):
+            sink.write_raw(b'\x00')
+
+    threads = [threading.Thread(target=produce) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.flush()
+    stats = sink.close()
+    assert stats['enqueued'] == 8000
+    assert stats['written'] + stats['dropped'] == stats['enqueued']
+    assert stats['written'] == len(writer.frames)
+
+
+def test_flush_after_close_returns_immediately():
+    sink = fsm_explan.PcapSink(SlowWriter())
+    sink.close()
+    sink.flush()
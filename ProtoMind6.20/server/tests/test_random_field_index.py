@@ -0,0 +1,58 @@
+import copy
+
+import fsm_explan
+
+
+def test_index_covers_every_random_field_once(protocol_cache):
+    _, cache = protocol_cache
+    indexed = [field_name for fields in fsm_explan.GLOBAL_RANDOM_FIELD_INDEX.values() for field_name, _ in fields]
+    assert sorted(indexed) == sorted(fsm_explan.GLOBAL_RANDOM_FIELDS)
+    for msg_name, fields in fsm_explan.GLOBAL_RANDOM_FIELD_INDEX.items():
+        assert msg_name in cache["client_messages"]
+        for field_name, _ in fields:
+            assert field_name.startswith(f"{msg_name}_"), field_name
+
+
+def test_entries_carry_parsed_bounds_and_keep_ui_fields_unchanged(protocol_cache):
+    for fields in fsm_explan.GLOBAL_RANDOM_FIELD_INDEX.values():
+        for field_name, entry in fields:
+            field_info = fsm_explan.GLOBAL_RANDOM_FIELDS[field_name]
+            assert 'bounds' not in field_info and 'byte_length' not in field_info  # GEN_FSM 返回给界面的字段不变
+            assert {key: entry[key] for key in field_info} == field_info
+            range_str = field_info.get('range')
+            if entry['bounds'] is not None:
+                base = 16 if field_info['type'] == 'B' else 2
+                assert entry['bounds'] == tuple(int(x, base) for x in range_str.split('-'))
+
+
+def test_prefix_sharing_messages_keep_their_own_fields(data_dir):
+    parser = fsm_explan.ProtoIRParser("mqttIR.xml")
+    parser.messages["PUBLISH_RETAINED"] = copy.deepcopy(parser.messages["PUBLISH"])
+    parser.client_messages.add("PUBLISH_RETAINED")
+    parser.generate_fields()
+    publish = [field_name for field_name, _ in parser.random_field_index["PUBLISH"]]
+    retained = [field_name for field_name, _ in parser.random_field_index["PUBLISH_RETAINED"]]
+    assert publish and len(publish) == len(retained)
+    assert not any(field_name.startswith("PUBLISH_RETAINED_") for field_name in publish)
+    assert all(field_name.startswith("PUBLISH_RETAINED_") for field_name in retained)
+
+
+def test_preparsed_bounds_draw_the_same_values(protocol_cache):
+    protocol_type, cache = protocol_cache
+    for fuzz in (False, True):
+        indexed = fsm_explan.create_generator(cache, protocol_type, seed=11)
+        parsed = fsm_explan.create_generator(cache, protocol_type, seed=11)
+        for _ in range(50):
+            for fields in fsm_explan.GLOBAL_RANDOM_FIELD_INDEX.values():
+                for field_name, entry in fields:
+                    expected = parsed.generate_field_value(field_name, fsm_explan.GLOBAL_RANDOM_FIELDS[field_name], fuzz)
+                    assert indexed.generate_field_value(field_name, entry, fuzz) == expected, field_name
+
+
+def test_values_stay_within_bounds(data_dir):
+    cache = fsm_explan.init_parser("dnsIR.xml")
+    generator = fsm_explan.create_generator(cache, "dns", seed=3)
+    entries = dict(fsm_explan.GLOBAL_RANDOM_FIELD_INDEX["DNS_QUERY"])
+    entry = dict(entries["DNS_QUERY_id_B"], bounds=(5, 9))  # 预解析的范围优先于 range 字符串
+    for _ in range(200):
+        assert 5 <= int(generator.generate_field_value("DNS_QUERY_id_B", entry, fuzz=True), 16) <= 9
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+import fsm_explan
+
+
+class ChunkSocket:
+    """按给定分块依次交给 recv_into 的假套接字，分块用完后返回 0（对端关闭）"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(view):
+            self.chunks.insert(0, chunk[len(view):])
+            chunk = chunk[:len(view)]
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def remaining_length(length):
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def mqtt_message(rng, size):
+    body = bytes(rng.randrange(256) for _ in range(size))
+    return bytes([0x30]) + remaining_length(size) + body, None
+
+
+def dns_message(rng, size):
+    body = bytes(rng.randrange(256) for _ in range(size))
+    return size.to_bytes(2, 'big') + body, body
+
+
+def mbap_message(rng, size):
+    pdu = bytes(rng.randrange(256) for _ in range(size))
+    return fsm_explan.MBAP_HEADER.pack(rng.randrange(65536), 0, size + 1, 1) + pdu, None
+
+
+BUILDERS = {'mqtt': mqtt_message, 'dns': dns_message, 'modbus': mbap_message}
+
+
+def split_stream(rng, stream):
+    """把字节流随机切成 1 字节到多条报文不等的分块，覆盖拆包和粘包"""
+    chunks = []
+    position = 0
+    while position < len(stream):
+        size = rng.choice((1, 2, 3, rng.randint(1, 64), rng.randint(64, 4096)))
+        chunks.append(stream[position:position + size])
+        position += size
+    return chunks
+
+
+def drain(ring, sock):
+    received = []
+    while True:
+        message = ring.next_message()
+        if message is not None:
+            received.append(bytes(message))
+            continue
+        if not ring.fill(sock):
+            return received
+
+
+@pytest.mark.parametrize("protocol_type", sorted(BUILDERS))
+def test_split_and_merged_reads_yield_whole_messages(protocol_type):
+    rng = random.Random(protocol_type)
+    sizes = [rng.choice((0, 1, 5, 127, 128, 300, rng.randint(0, 2000))) for _ in range(400)]
+    if protocol_type == 'modbus':
+        sizes = [min(size, 250) for size in sizes]
+    wires, expected = [], []
+    for size in sizes:
+        wire, payload = BUILDERS[protocol_type](rng, size)
+        wires.append(wire)
+        expected.append(payload if payload is not None else wire)
+    ring = fsm_explan.ReceiveRing(protocol_type, capacity=8192)
+    assert drain(ring, ChunkSocket(split_stream(rng, b''.join(wires)))) == expected
+    assert len(ring) == 0
+
+
+def test_message_larger_than_capacity_grows_buffer():
+    rng = random.Random(1)
+    wire, payload = dns_message(rng, 20000)
+    ring = fsm_explan.ReceiveRing('dns', capacity=4096)
+    assert drain(ring, ChunkSocket(split_stream(rng, wire + wire))) == [payload, payload]
+
+
+def test_views_stay_valid_until_next_fill():
+    rng = random.Random(2)
+    first, _ = mqtt_message(rng, 10)
+    second, _ = mqtt_message(rng, 10)
+    ring = fsm_explan.ReceiveRing('mqtt', capacity=8192)
+    ring.fill(ChunkSocket([first + second[:5]]))
+    message = ring.next_message()
+    assert bytes(message) == first
+    assert ring.next_message() is None
+    assert len(ring) == 5
+
+
+def test_clear_drops_partial_message():
+    rng = random.Random(3)
+    wire, payload = dns_message(rng, 40)
+    ring = fsm_explan.ReceiveRing('dns')
+    ring.fill(ChunkSocket([wire[:10]]))
+    ring.clear()
+    ring.fill(ChunkSocket([wire]))
+    assert bytes(ring.next_message()) == payload
@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import socket
+import threading
+
+import pytest
+
+import fsm_explan
+
+
+def live_walk(cache, protocol_type, seed, steps=300):
+    """模拟一次测试：响应、复位和发送失败由独立的随机源决定，只有生成器的决策写入 trace"""
+    generator = fsm_explan.create_generator(cache, protocol_type, seed=seed)
+    world = random.Random(seed ^ 0x5A5A)
+    servers = sorted(cache["server_messages"]) + [None]
+    sent = []
+    received = None
+    for _ in range(steps):
+        if world.random() < 0.05:
+            generator.reset_state()
+        state = generator.select_next_state(received)
+        if state:
+            generator.current_state = state
+        packet = generator.generate_next(state, {}, 0.5) if state else None
+        if packet and world.random() < 0.1:
+            generator.discard_last()
+        elif packet:
+            sent.append((state, bytes(packet)))
+        received = world.choice(servers)
+    return generator, sent
+
+
+def test_trace_regenerates_identical_packets(protocol_cache):
+    protocol_type, cache = protocol_cache
+    generator, sent = live_walk(cache, protocol_type, seed=23)
+    assert sent
+    # 经过 JSON 往返，与写入 .trace.json 后再读出的情况一致
+    trace = json.loads(json.dumps({'seed': generator.seed, 'protocol_type': protocol_type,
+                                   'config': generator.config, 'events': generator.trace}))
+    assert fsm_explan.regenerate_packets(trace, cache) == sent
+    assert fsm_explan.regenerate_packets(trace, cache) == sent
+
+
+def test_different_seeds_diverge(data_dir):
+    cache = fsm_explan.init_parser("dnsIR.xml")
+    assert live_walk(cache, "dns", seed=1)[1] != live_walk(cache, "dns", seed=2)[1]
+
+
+@pytest.fixture
+def dns_echo():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.2)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                data, address = sock.recvfrom(4096)
+            except OSError:
+                continue
+            if len(data) >= 12:
+                sock.sendto(data[:2] + bytes([data[2] | 0x80, data[3]]) + data[4:], address)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield sock.getsockname()[1]
+    stop.set()
+    thread.join()
+    sock.close()
+
+
+def outbound_payloads(pcap_file, source_port):
+    payloads = []
+    for _, _, frame in fsm_explan.read_pcap_records(pcap_file):
+        l4 = 14 + (frame[14] & 0x0F) * 4
+        if int.from_bytes(frame[l4:l4 + 2], 'big') == source_port:
+            payloads.append(bytes(frame[l4 + 8:]))
+    return payloads
+
+
+def test_replay_trace_matches_live_pcap(data_dir, dns_echo, tmp_path, monkeypatch):
+    cache = fsm_explan.init_parser("dnsIR.xml")
+    monkeypatch.chdir(tmp_path)
+    fuzzer = fsm_explan.Fuzzer('127.0.0.1', str(dns_echo), 'udp', cache, 'dns', seed=0x1234)
+    fuzzer.communicate_with_timeout({'rate': 'max'}, timeout=0.5, fuzz_ratio=0.5)
+    live = outbound_payloads(fuzzer.pcap_file, fuzzer.source_port)
+    trace_file = fsm_explan.find_trace(fuzzer.pcap_file)
+    assert live and trace_file == fuzzer.stats['trace_file']
+    replayed = fsm_explan.replay_trace(trace_file)
+    assert outbound_payloads(replayed, fuzzer.source_port) == live
+
+
+def test_resolve_run_file_rejects_paths_outside_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "outpcap"
+    (root / "crashes").mkdir(parents=True)
+    inside = root / "output_1.trace.json"
+    inside.write_text("{}")
+    (tmp_path / "secret.json").write_text("{}")
+    os.symlink(tmp_path / "secret.json", root / "link.json")
+    resolve = fsm_explan.resolve_run_file
+    assert resolve("outpcap/output_1.trace.json") == os.path.realpath(inside)
+    assert resolve(str(inside)) == os.path.realpath(inside)
+    assert resolve("outpcap/crashes/../output_1.trace.json") == os.path.realpath(inside)
+    for path in ("outpcap/../secret.json", str(tmp_path / "secret.json"), "/etc/passwd",
+                 "outpcap/link.json", "outpcap_evil/x.json", "", None):
+        assert resolve(path) is None, path
+    assert resolve("outpcap/output_1.trace.json", "outpcap/crashes") is None
+    assert resolve("outpcap/crashes/crash.json", "outpcap/crashes") == os.path.realpath(root / "crashes" / "crash.json")
@@ -0,0 +1,110 @@
+import fsm_explan
+
+
+class FakeGenerator:
+    def __init__(self, messages):
+        self.messages = messages
+        self.current_state = "INIT"
+        self.trace = []
+
+
+class FakeFuzzer:
+    """只记录调用的假 Fuzzer：每次测试向 trace 追加 events 个事件"""
+
+    def __init__(self, messages, events=1):
+        self.generator = FakeGenerator(messages)
+        self.events = events
+        self.connected = True
+        self.pcap_file = "outpcap/output_first.pcap"
+        self.stats = None
+        self.closed = False
+        self.runs = 0
+
+    def communicate_with_timeout(self, input_fields, timeout=15.0, keep_open=False):
+        assert keep_open
+        self.runs += 1
+        self.generator.trace.extend([('response', 'CONNACK')] * self.events)
+        return self.pcap_file
+
+    def close(self):
+        self.closed = True
+
+
+def manager(**kwargs):
+    sessions = fsm_explan.SessionManager(**kwargs)
+    sessions.reaper = object()  # 测试中不启动后台回收线程
+    return sessions
+
+
+def factory(created, messages, events=1):
+    def build():
+        fuzzer = FakeFuzzer(messages, events)
+        created.append(fuzzer)
+        return fuzzer
+    return build
+
+
+def test_second_run_reuses_connection():
+    cache = {"messages": {}}
+    created = []
+    sessions = manager()
+    first = sessions.run("key", cache, factory(created, cache["messages"]), {}, 1.0)
+    second = sessions.run("key", cache, factory(created, cache["messages"]), {}, 1.0)
+    assert len(created) == 1 and created[0].runs == 2
+    assert first != second  # 每次调用输出独立的 pcap
+    assert not created[0].closed
+
+
+def test_busy_session_gets_one_off_fuzzer():
+    cache = {"messages": {}}
+    created = []
+    sessions = manager()
+    pooled, reused = sessions.acquire("key", cache, factory(created, cache["messages"]))
+    assert not reused
+    one_off, reused = sessions.acquire("key", cache, factory(created, cache["messages"]))
+    assert one_off is not pooled and not reused
+    sessions.release("key", one_off)
+    assert one_off.closed and not pooled.closed
+    sessions.release("key", pooled)
+    assert sessions.acquire("key", cache, factory(created, cache["messages"])) == (pooled, True)
+
+
+def test_reparsed_ir_replaces_session():
+    created = []
+    sessions = manager()
+    old_cache = {"messages": {}}
+    sessions.run("key", old_cache, factory(created, old_cache["messages"]), {}, 1.0)
+    new_cache = {"messages": {}}
+    sessions.run("key", new_cache, factory(created, new_cache["messages"]), {}, 1.0)
+    assert len(created) == 2 and created[0].closed
+
+
+def test_session_rotates_after_max_runs():
+    cache = {"messages": {}}
+    created = []
+    sessions = manager(max_runs=3)
+    for _ in range(7):
+        sessions.run("key", cache, factory(created, cache["messages"]), {}, 1.0)
+    assert [fuzzer.runs for fuzzer in created] == [3, 3, 1]
+    assert [fuzzer.closed for fuzzer in created] == [True, True, False]
+
+
+def test_session_rotates_when_trace_is_long():
+    cache = {"messages": {}}
+    created = []
+    sessions = manager(max_trace_events=100)
+    for _ in range(5):
+        sessions.run("key", cache, factory(created, cache["messages"], events=60), {}, 1.0)
+    assert all(len(fuzzer.generator.trace) <= 120 for fuzzer in created)
+    assert len(created) == 3
+
+
+def test_idle_sessions_expire():
+    cache = {"messages": {}}
+    created = []
+    sessions = manager(idle_timeout=10.0)
+    sessions.run("key", cache, factory(created, cache["messages"]), {}, 1.0)
+    last_used = sessions.sessions["key"]["last_used"]
+    assert sessions.expire_idle(now=last_used + 5) == 0
+    assert sessions.expire_idle(now=last_used + 10) == 1
+    assert created[0].closed and not sessions.sessions
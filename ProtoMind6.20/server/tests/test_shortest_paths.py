@@ -0,0 +1,76 @@
+import fsm_explan
+
+
+def edges_of(state_machine):
+    return {(state, t['next_state']) for state, info in state_machine.items() for t in info.get('transitions', [])}
+
+
+def distances(state_machine):
+    """Floyd-Warshall 求各状态间的最短跳数，作为 BFS 结果的对照"""
+    edges = edges_of(state_machine)
+    states = set(state_machine) | {b for _, b in edges}
+    inf = float('inf')
+    dist = {(a, b): 0 if a == b else 1 if (a, b) in edges else inf for a in states for b in states}
+    for k in states:
+        for i in states:
+            for j in states:
+                if dist[i, k] + dist[k, j] < dist[i, j]:
+                    dist[i, j] = dist[i, k] + dist[k, j]
+    return dist
+
+
+def test_paths_are_valid_and_shortest(protocol_cache):
+    _, cache = protocol_cache
+    state_machine = cache["state_machine"]
+    edges = edges_of(state_machine)
+    dist = distances(state_machine)
+    paths = cache["shortest_paths"]
+    assert set(paths) == set(state_machine)
+    for source, targets in paths.items():
+        reachable = {target for (start, target), d in dist.items() if start == source and d != float('inf')}
+        assert set(targets) == reachable
+        for target, path in targets.items():
+            assert len(path) == dist[source, target], (source, target)
+            hops = [source] + path
+            assert all((a, b) in edges for a, b in zip(hops, hops[1:])), (source, target)
+
+
+def test_drive_to_reaches_target_in_minimum_steps(protocol_cache):
+    protocol_type, cache = protocol_cache
+    generator = fsm_explan.create_generator(cache, protocol_type, seed=20)
+    start = generator.current_state
+    driven = 0
+    for target in sorted(cache["client_messages"]):
+        generator.current_state = start
+        path = generator.path_to(target)
+        if not path:
+            continue
+        assert generator.drive_to(target)
+        steps = []
+        while generator.driving:
+            steps.append(generator.select_next_state(None))
+        assert steps == path, target
+        assert generator.current_state == target
+        driven += 1
+    assert driven
+
+
+def test_drive_to_unknown_state_is_rejected(data_dir):
+    generator = fsm_explan.create_generator(fsm_explan.init_parser("mqttIR.xml"), "mqtt", seed=20)
+    assert not generator.drive_to("NO_SUCH_STATE")
+    assert generator.target_state is None and not generator.driving
+
+
+def test_reset_drives_back_to_target(data_dir):
+    generator = fsm_explan.create_generator(fsm_explan.init_parser("mqttIR.xml"), "mqtt", seed=20)
+    target = "SUBSCRIBE"
+    generator.drive_to(target)
+    while generator.driving:
+        generator.select_next_state(None)
+    generator.reset_state()
+    assert generator.driving
+    steps = []
+    while generator.driving:
+        steps.append(generator.select_next_state(None))
+    assert steps[-1] == target
+    assert generator.drives_completed == 2
@@ -0,0 +1,65 @@
+import random
+
+import fsm_explan
+
+STATE_MACHINE = {
+    'A': {'transitions': [{'next_state': 'B'}, {'next_state': 'C'}]},
+    'B': {'transitions': [{'next_state': 'A'}]},
+    'C': {'transitions': [{'next_state': 'A'}, {'next_state': 'D'}]},
+}
+
+
+def test_merged_coverage_reports_union_and_keeps_parts_independent(data_dir, monkeypatch):
+    cache = fsm_explan.init_parser("modbusIR.xml")
+    monkeypatch.setattr(fsm_explan, "IR_COVERAGE", {})
+    edges = sorted(fsm_explan.StateCoverage(cache["state_machine"]).edges)
+    first = fsm_explan.StateCoverage(cache["state_machine"])
+    second = fsm_explan.StateCoverage(cache["state_machine"])
+    first.record(*edges[0])
+    second.record(*edges[1])
+    second.record(*edges[0])
+    fsm_explan.IR_COVERAGE['modbus'] = fsm_explan.MergedCoverage([first, second])
+    report = fsm_explan.get_coverage('modbus')
+    assert report['transitions_covered'] == 2
+    assert report['covered_transitions'] == sorted(f"{a}->{b}" for a, b in edges[:2])
+    # 合并视图只读：各部分的命中次数互不影响，状态选择仍只取决于本会话
+    assert first.edge_hits == {edges[0]: 1}
+    assert second.edge_hits == {edges[1]: 1, edges[0]: 1}
+    assert fsm_explan.get_coverage()['modbus'] == report
+
+
+def test_record_counts_states_edges_and_uncovered_out_edges():
+    coverage = fsm_explan.StateCoverage(STATE_MACHINE)
+    assert coverage.states == {'A', 'B', 'C', 'D'}
+    assert coverage.uncovered_out == {'A': 2, 'B': 1, 'C': 2}
+    coverage.record('A', 'B')
+    coverage.record('A', 'B')
+    coverage.record('B', 'A')
+    assert coverage.edge_hits == {('A', 'B'): 2, ('B', 'A'): 1}
+    assert coverage.uncovered_out == {'A': 1, 'B': 0, 'C': 2}
+    report = coverage.report()
+    assert report['covered_states'] == ['A', 'B']
+    assert (report['transitions_covered'], report['transitions_total']) == (2, 5)
+    assert report['transition_percent'] == 40.0
+
+
+def test_choose_prefers_unseen_transitions():
+    coverage = fsm_explan.StateCoverage(STATE_MACHINE)
+    for _ in range(5):
+        coverage.record('A', 'B')
+    rng = random.Random(19)
+    picks = [coverage.choose('A', ['B', 'C'], rng) for _ in range(2000)]
+    # C 未走过且还有两条未覆盖出边，权重 3 * 8，B 为 (1 + 0) / 6
+    assert picks.count('C') > 0.95 * len(picks)
+
+
+def test_guided_walk_covers_every_transition():
+    coverage = fsm_explan.StateCoverage(STATE_MACHINE)
+    rng = random.Random(19)
+    state = 'A'
+    for _ in range(40):
+        candidates = [t['next_state'] for t in STATE_MACHINE.get(state, {}).get('transitions', [])] or ['A']
+        next_state = coverage.choose(state, candidates, rng)
+        coverage.record(state, next_state)
+        state = next_state
+    assert coverage.report()['transition_percent'] == 100.0